@@ -0,0 +1,413 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+import numpy as np
+from cnn_layers import *
+
+LAYERS = ("zero_pad", "conv_forward", "conv_backward", "pool_forward", "pool_backward")
+
+
+def time_call(target, *args, repeat=3):
+    """
+    Best wall time of target(*args) over repeat calls.
+
+    Returns:
+    seconds -- best time in seconds
+    output -- output of the last call
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = target(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def max_difference(expected, actual):
+    """
+    Largest absolute difference between two arrays or tuples of arrays.
+    """
+    if isinstance(expected, (tuple, list)):
+        return max(max_difference(e, a) for e, a in zip(expected, actual))
+    return float(np.max(np.abs(np.asarray(expected) - np.asarray(actual))))
+
+
+def conv_benchmark(shapes, tolerance=1e-10, repeat=3, seed=1):
+    """
+    Times the vectorized conv_forward/conv_backward against the reference loop layers and
+    checks that they agree.
+
+    Arguments:
+    shapes -- list of (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) tuples
+    tolerance -- largest absolute difference allowed between the two implementations
+    repeat -- number of timed calls, the best one is kept
+
+    Returns:
+    results -- list of dictionaries, one per shape, with the timings, speedups and differences
+    """
+    rng = np.random.RandomState(seed)
+    results = []
+    for (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) in shapes:
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev)
+        W = rng.randn(f, f, n_C_prev, n_C)
+        b = rng.randn(1, 1, 1, n_C)
+        hparameters = {"stride": stride, "pad": pad}
+
+        loop_forward, (Z_loop, cache) = time_call(conv_forward_loop, A_prev, W, b, hparameters, repeat=repeat)
+        fast_forward, (Z, cache) = time_call(conv_forward, A_prev, W, b, hparameters, repeat=repeat)
+        dZ = rng.randn(*Z.shape)
+        loop_backward, grads_loop = time_call(conv_backward_loop, dZ, cache, repeat=repeat)
+        fast_backward, grads = time_call(conv_backward, dZ, cache, repeat=repeat)
+
+        result = {"shape": (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad),
+                  "forward_loop": loop_forward, "forward": fast_forward,
+                  "forward_speedup": loop_forward / fast_forward,
+                  "forward_difference": max_difference(Z_loop, Z),
+                  "backward_loop": loop_backward, "backward": fast_backward,
+                  "backward_speedup": loop_backward / fast_backward,
+                  "backward_difference": max_difference(grads_loop, grads)}
+        assert result["forward_difference"] < tolerance, "conv_forward differs from the loop version for {}".format(result["shape"])
+        assert result["backward_difference"] < tolerance, "conv_backward differs from the loop version for {}".format(result["shape"])
+        results.append(result)
+    return results
+
+
+def pool_benchmark(shapes, modes=("max", "average"), tolerance=1e-10, repeat=3, seed=1):
+    """
+    Times the vectorized pool_forward/pool_backward against the reference loop layers and
+    checks that they agree, on random inputs and on the same inputs after a ReLU, where many
+    entries of a window tie at zero.
+
+    Arguments:
+    shapes -- list of (m, n_H_prev, n_W_prev, n_C_prev, f, stride) tuples
+    modes -- pooling modes to time
+    tolerance -- largest absolute difference allowed between the two implementations
+    repeat -- number of timed calls, the best one is kept
+
+    Returns:
+    results -- list of dictionaries, one per shape, input and mode, with the timings, speedups and differences
+    """
+    rng = np.random.RandomState(seed)
+    results = []
+    for (m, n_H_prev, n_W_prev, n_C_prev, f, stride) in shapes:
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev)
+        hparameters = {"f": f, "stride": stride}
+        for name, inputs in (("randn", A_prev), ("relu", np.maximum(A_prev, 0))):
+            for mode in modes:
+                loop_forward, (A_loop, cache_loop) = time_call(pool_forward_loop, inputs, hparameters, mode, repeat=repeat)
+                fast_forward, (A, cache) = time_call(pool_forward, inputs, hparameters, mode, repeat=repeat)
+                dA = rng.randn(*A.shape)
+                loop_backward, dA_prev_loop = time_call(pool_backward_loop, dA, cache_loop, mode, repeat=repeat)
+                fast_backward, dA_prev = time_call(pool_backward, dA, cache, mode, repeat=repeat)
+
+                result = {"shape": (m, n_H_prev, n_W_prev, n_C_prev, f, stride, name, mode),
+                          "forward_loop": loop_forward, "forward": fast_forward,
+                          "forward_speedup": loop_forward / fast_forward,
+                          "forward_difference": max_difference(A_loop, A),
+                          "backward_loop": loop_backward, "backward": fast_backward,
+                          "backward_speedup": loop_backward / fast_backward,
+                          "backward_difference": max_difference(dA_prev_loop, dA_prev)}
+                assert result["forward_difference"] < tolerance, "pool_forward differs from the loop version for {}".format(result["shape"])
+                assert result["backward_difference"] < tolerance, "pool_backward differs from the loop version for {}".format(result["shape"])
+                results.append(result)
+    return results
+
+
+def peak_allocation(target, *args):
+    """
+    Largest amount of memory in bytes allocated at once by target(*args), as traced by tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        target(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def workspace_benchmark(shapes, dtype=np.float32, repeat=3, seed=1):
+    """
+    Times one conv_forward/conv_backward/pool_forward/pool_backward step with new arrays on every
+    call against the same step run in a Workspace, and records the memory each allocates once
+    the workspace is warm.
+
+    Arguments:
+    shapes -- list of (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) tuples of the conv layer,
+              followed by a 2x2 max pool
+    dtype -- dtype of the workspace
+
+    Returns:
+    results -- list of dictionaries, one per shape
+    """
+    rng = np.random.RandomState(seed)
+    results = []
+    for (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) in shapes:
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev)
+        W = rng.randn(f, f, n_C_prev, n_C)
+        b = rng.randn(1, 1, 1, n_C)
+        hparameters = {"stride": stride, "pad": pad}
+        pool_hparameters = {"f": 2, "stride": 2}
+        conv_workspace = Workspace(dtype)
+        pool_workspace = Workspace(dtype)
+
+        def step(conv_workspace=None, pool_workspace=None):
+            Z, cache = conv_forward(A_prev, W, b, hparameters, workspace=conv_workspace)
+            A, pool_cache = pool_forward(Z, pool_hparameters, workspace=pool_workspace)
+            dZ = pool_backward(A, pool_cache, workspace=pool_workspace)
+            return conv_backward(dZ, cache, workspace=conv_workspace)
+
+        default, _ = time_call(step, repeat=repeat)
+        step(conv_workspace, pool_workspace)
+        workspace, _ = time_call(step, conv_workspace, pool_workspace, repeat=repeat)
+        results.append({"shape": (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad),
+                        "step": default, "step_workspace": workspace,
+                        "speedup": default / workspace,
+                        "allocated": peak_allocation(step),
+                        "allocated_workspace": peak_allocation(step, conv_workspace, pool_workspace),
+                        "workspace_bytes": conv_workspace.nbytes + pool_workspace.nbytes})
+    return results
+
+
+def parallel_benchmark(shapes, workers=None, chunk_size=8, dtype=None, repeat=3, seed=1):
+    """
+    Times one conv + max pool forward/backward step run by BatchParallel with an increasing number
+    of workers, and checks that the results do not depend on it.
+
+    Arguments:
+    shapes -- list of (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) tuples of the conv layer
+    workers -- list of worker counts, powers of two up to the number of cores by default
+    chunk_size -- number of examples per chunk
+    dtype -- dtype of the per-worker workspaces, None for no workspace
+
+    Returns:
+    results -- list of dictionaries, one per shape and worker count, with the time and the speedup over one worker
+    """
+    if workers is None:
+        workers = [2 ** k for k in range(int(np.log2(os.cpu_count())) + 1)]
+    rng = np.random.RandomState(seed)
+    results = []
+    for (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) in shapes:
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev)
+        W = rng.randn(f, f, n_C_prev, n_C)
+        b = rng.randn(1, 1, 1, n_C)
+        hparameters = {"stride": stride, "pad": pad}
+        pool_hparameters = {"f": 2, "stride": 2}
+
+        expected = None
+        for count in workers:
+            with BatchParallel(count, chunk_size, dtype) as parallel:
+                def step():
+                    Z, cache = parallel.conv_forward(A_prev, W, b, hparameters)
+                    A, pool_cache = parallel.pool_forward(Z, pool_hparameters)
+                    dZ = parallel.pool_backward(A, pool_cache)
+                    return parallel.conv_backward(dZ, cache)
+
+                seconds, grads = time_call(step, repeat=repeat)
+            if expected is None:
+                expected, single = grads, seconds
+            assert all(np.array_equal(e, g) for e, g in zip(expected, grads)), \
+                "BatchParallel results depend on the number of workers for {}".format((m, n_H_prev, n_W_prev, n_C_prev))
+            results.append({"shape": (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad, count),
+                            "step": seconds, "speedup": single / seconds})
+    return results
+
+
+def tf_peak_allocation(target, *args):
+    """
+    Peak memory in bytes of the TensorFlow CPU allocator while running target(*args), None when
+    the allocator does not keep statistics. Most CPU builds do not, and report a peak of 0.
+    """
+    import tensorflow as tf
+    try:
+        tf.config.experimental.reset_memory_stats("CPU:0")
+        target(*args)
+        peak = tf.config.experimental.get_memory_info("CPU:0")["peak"]
+    except (ValueError, RuntimeError):
+        return None
+    return peak or None
+
+
+def tf_layers(f, stride, pad, mode="max"):
+    """
+    TensorFlow equivalents of the NumPy layers, as tf.functions taking and returning the same
+    arguments as the layer functions, except that the caches are left out.
+    """
+    import tensorflow as tf
+    paddings = [[0, 0], [pad, pad], [pad, pad], [0, 0]]
+    pool = tf.nn.max_pool2d if mode == "max" else tf.nn.avg_pool2d
+
+    def conv(A_prev, W, b):
+        return tf.nn.conv2d(tf.pad(A_prev, paddings), W, strides=stride, padding="VALID") + b
+
+    @tf.function
+    def conv_backward(dZ, A_prev, W, b):
+        with tf.GradientTape() as tape:
+            tape.watch([A_prev, W, b])
+            Z = conv(A_prev, W, b)
+        return tape.gradient(Z, [A_prev, W, b], output_gradients=dZ)
+
+    @tf.function
+    def pool_backward(dA, A_prev):
+        with tf.GradientTape() as tape:
+            tape.watch(A_prev)
+            A = pool(A_prev, f, stride, "VALID")
+        return tape.gradient(A, A_prev, output_gradients=dA)
+
+    return {"zero_pad": tf.function(lambda X: tf.pad(X, paddings)),
+            "conv_forward": tf.function(conv),
+            "conv_backward": conv_backward,
+            "pool_forward": tf.function(lambda A_prev: pool(A_prev, f, stride, "VALID")),
+            "pool_backward": pool_backward}
+
+
+def tf_benchmark(shapes, mode="max", dtype=np.float32, tolerance=1e-4, repeat=3, seed=1):
+    """
+    Times the NumPy layers against the equivalent TensorFlow ops (tf.pad, tf.nn.conv2d,
+    tf.nn.max_pool2d or tf.nn.avg_pool2d and their gradients) and checks that they agree.
+
+    Arguments:
+    shapes -- list of (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) tuples, the pool layers
+              use the same f and stride without padding
+    mode -- pooling mode, "max" or "average"
+    dtype -- dtype of the inputs of both implementations
+    tolerance -- largest difference allowed, relative to the largest TensorFlow output
+    repeat -- number of timed calls, the best one is kept
+
+    Returns:
+    results -- list of dictionaries, one per shape and layer, with the time, throughput in examples
+               per second and peak memory of both implementations and their difference
+    """
+    import tensorflow as tf
+    rng = np.random.RandomState(seed)
+    results = []
+    for (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad) in shapes:
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev).astype(dtype)
+        W = rng.randn(f, f, n_C_prev, n_C).astype(dtype)
+        b = rng.randn(1, 1, 1, n_C).astype(dtype)
+        hparameters = {"stride": stride, "pad": pad}
+        pool_hparameters = {"f": f, "stride": stride}
+        Z, cache = conv_forward(A_prev, W, b, hparameters)
+        dZ = rng.randn(*Z.shape).astype(dtype)
+        A, pool_cache = pool_forward(A_prev, pool_hparameters, mode)
+        dA = rng.randn(*A.shape).astype(dtype)
+
+        numpy_calls = {"zero_pad": (zero_pad, A_prev, pad),
+                       "conv_forward": (lambda *args: conv_forward(*args)[0], A_prev, W, b, hparameters),
+                       "conv_backward": (conv_backward, dZ, cache),
+                       "pool_forward": (lambda *args: pool_forward(*args)[0], A_prev, pool_hparameters, mode),
+                       "pool_backward": (pool_backward, dA, pool_cache, mode)}
+        tf_functions = tf_layers(f, stride, pad, mode)
+        tf_args = {"zero_pad": (A_prev,),
+                   "conv_forward": (A_prev, W, b),
+                   "conv_backward": (dZ, A_prev, W, b),
+                   "pool_forward": (A_prev,),
+                   "pool_backward": (dA, A_prev)}
+
+        for layer in LAYERS:
+            target, *args = numpy_calls[layer]
+            tf_target = tf_functions[layer]
+            tensors = [tf.constant(arg) for arg in tf_args[layer]]
+            tf_target(*tensors)
+            numpy_seconds, output = time_call(target, *args, repeat=repeat)
+            tf_seconds, tf_output = time_call(lambda *args: tf.nest.map_structure(np.asarray, tf_target(*args)),
+                                              *tensors, repeat=repeat)
+            scale = max(float(np.max(np.abs(np.asarray(t)))) for t in tf.nest.flatten(tf_output))
+            if layer == "conv_backward":
+                tf_output = (tf_output[0], tf_output[1], np.reshape(tf_output[2], b.shape))
+
+            result = {"layer": layer, "shape": (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad),
+                      "numpy_seconds": numpy_seconds, "tf_seconds": tf_seconds,
+                      "numpy_throughput": m / numpy_seconds, "tf_throughput": m / tf_seconds,
+                      "numpy_peak_bytes": peak_allocation(target, *args),
+                      "tf_peak_bytes": tf_peak_allocation(tf_target, *tensors),
+                      "difference": max_difference(tf_output, output) / max(scale, 1.0)}
+            assert result["difference"] < tolerance, "{} differs from TensorFlow for {}".format(layer, result["shape"])
+            results.append(result)
+    return results
+
+
+def baseline_key(result):
+    return "{} {}".format(result["layer"], "x".join(str(n) for n in result["shape"]))
+
+
+def save_baselines(results, filename):
+    """
+    Writes the results of tf_benchmark() to a JSON file, one entry per layer and shape.
+    """
+    baselines = {baseline_key(result): {key: value for key, value in result.items() if key not in ("layer", "shape")}
+                 for result in results}
+    with open(filename, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+def load_baselines(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare_baselines(results, baselines, slowdown=1.25):
+    """
+    Layers of results that are more than slowdown times slower than in the saved baselines.
+
+    Arguments:
+    results -- output of tf_benchmark()
+    baselines -- dictionary returned by load_baselines()
+    slowdown -- ratio between the current and the saved NumPy time above which a layer has regressed
+
+    Returns:
+    regressions -- list of (key, baseline seconds, current seconds) tuples
+    """
+    regressions = []
+    for result in results:
+        key = baseline_key(result)
+        if key in baselines and result["numpy_seconds"] > slowdown * baselines[key]["numpy_seconds"]:
+            regressions.append((key, baselines[key]["numpy_seconds"], result["numpy_seconds"]))
+    return regressions
+
+
+def print_results(results):
+    for result in results:
+        print(result.get("layer", ""), result["shape"])
+        for key, value in result.items():
+            if key not in ("layer", "shape"):
+                print("    {:<22} {}".format(key, "-" if value is None else "{:.4g}".format(value)))
+
+
+if __name__ == "__main__":
+    # (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad)
+    production_shapes = [(64, 64, 64, 3, 3, 16, 1, 1),
+                         (64, 32, 32, 16, 3, 32, 1, 1),
+                         (32, 128, 128, 3, 5, 8, 2, 2),
+                         (256, 16, 16, 32, 2, 64, 2, 0)]
+
+    # python benchmarks.py baselines.json
+    # compares the layers to TensorFlow and to the baselines in baselines.json, which is written
+    # on the first run
+    if len(sys.argv) > 1:
+        results = tf_benchmark(production_shapes)
+        print_results(results)
+        if os.path.exists(sys.argv[1]):
+            for key, baseline, current in compare_baselines(results, load_baselines(sys.argv[1])):
+                print("Regression: {} took {:.4g}s, baseline {:.4g}s".format(key, current, baseline))
+        else:
+            save_baselines(results, sys.argv[1])
+    else:
+        # (m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad)
+        conv_shapes = [(2, 5, 7, 4, 3, 8, 2, 1),
+                       (10, 4, 4, 3, 2, 8, 2, 2),
+                       (8, 32, 32, 3, 5, 8, 1, 2),
+                       (16, 64, 64, 3, 3, 16, 1, 1)]
+        print_results(conv_benchmark(conv_shapes, repeat=1))
+
+        # (m, n_H_prev, n_W_prev, n_C_prev, f, stride)
+        pool_shapes = [(2, 5, 5, 3, 3, 1),
+                       (10, 16, 16, 8, 2, 2),
+                       (16, 64, 64, 16, 3, 2)]
+        print_results(pool_benchmark(pool_shapes, repeat=1))
+
+        print_results(workspace_benchmark(conv_shapes[2:]))
+
+        # Set OMP_NUM_THREADS=1 so that only the batch is split between the cores
+        print_results(parallel_benchmark([(128, 32, 32, 16, 3, 32, 1, 1)], workers=[1, 2, 4, 8, 16]))
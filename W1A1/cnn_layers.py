@@ -0,0 +1,790 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def zero_pad(X, pad, out=None):
+    """
+    Pad with zeros all images of the dataset X. The padding is applied to the height and width of an image.
+
+    Argument:
+    X -- python numpy array of shape (m, n_H, n_W, n_C) representing a batch of m images
+    pad -- integer, amount of padding around each image on vertical and horizontal dimensions
+    out -- optional array of shape (m, n_H + 2 * pad, n_W + 2 * pad, n_C) to pad into instead of a new array,
+           X is cast to its dtype
+
+    Returns:
+    X_pad -- padded image of shape (m, n_H + 2 * pad, n_W + 2 * pad, n_C)
+    """
+    if out is None:
+        return np.pad(X, ((0, 0), (pad, pad), (pad, pad), (0, 0)))
+
+    (m, n_H, n_W, n_C) = X.shape
+    if pad > 0:
+        out[:, :pad] = 0
+        out[:, pad + n_H:] = 0
+        out[:, pad:pad + n_H, :pad] = 0
+        out[:, pad:pad + n_H, pad + n_W:] = 0
+    out[:, pad:pad + n_H, pad:pad + n_W] = X
+
+    return out
+
+
+def conv_single_step(a_slice_prev, W, b):
+    """
+    Apply one filter defined by parameters W on a single slice (a_slice_prev) of the output activation
+    of the previous layer.
+
+    Arguments:
+    a_slice_prev -- slice of input data of shape (f, f, n_C_prev)
+    W -- Weight parameters contained in a window - matrix of shape (f, f, n_C_prev)
+    b -- Bias parameters contained in a window - matrix of shape (1, 1, 1)
+
+    Returns:
+    Z -- a scalar value, the result of convolving the sliding window (W, b) on a slice x of the input data
+    """
+    s = a_slice_prev * W
+    Z = np.sum(s)
+    Z = Z + float(np.squeeze(b))
+
+    return Z
+
+
+class PoolCache(tuple):
+    """
+    Cache of pool_forward(), the (A_prev, hparameters) tuple of the loop version that also
+    carries the max of every window in max mode.
+    """
+    window_max = None
+
+
+class Workspace:
+    """
+    Buffers reused by the layer functions across calls, so that repeated forward and backward
+    passes over batches of the same shape allocate no new arrays. Everything passed to a layer
+    with a workspace is computed in the workspace dtype, float32 by default.
+
+    The outputs of a layer called with a workspace are views of its buffers and are overwritten
+    by the next call of the same layer function, so use one workspace per layer of a network.
+    """
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=None, zero=False):
+        """
+        Buffer called name of the given shape and dtype, allocated only the first time it is
+        requested with that shape.
+
+        Arguments:
+        name -- key of the buffer
+        shape -- tuple, shape of the buffer
+        dtype -- dtype of the buffer, the workspace dtype by default
+        zero -- fill an existing buffer with zeros, new buffers always start at zero
+
+        Returns:
+        buffer -- numpy array of the given shape
+        """
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            self.buffers[name] = buffer
+        elif zero:
+            buffer.fill(0)
+        return buffer
+
+    def cast(self, name, X):
+        """
+        X itself if it is already a C-contiguous array of the workspace dtype, otherwise a copy of
+        it in the buffer called name.
+        """
+        if X.dtype == self.dtype and X.flags.c_contiguous:
+            return X
+        buffer = self.get(name, X.shape)
+        np.copyto(buffer, X, casting="same_kind")
+        return buffer
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+def _windows(A_prev_pad, f, stride):
+    """
+    Read-only view of every (f, f) window of A_prev_pad visited by a convolution or pooling
+    with the given stride, without copying any data.
+
+    Arguments:
+    A_prev_pad -- numpy array of shape (m, n_H_pad, n_W_pad, n_C_prev)
+    f -- size of the (square) window
+    stride -- step between two windows
+
+    Returns:
+    windows -- view of shape (m, n_H, n_W, n_C_prev, f, f)
+    """
+    return sliding_window_view(A_prev_pad, (f, f), axis=(1, 2))[:, ::stride, ::stride]
+
+
+######################################
+######## REFERENCE LOOP LAYERS #######
+######################################
+
+def conv_forward_loop(A_prev, W, b, hparameters):
+    """
+    Reference loop implementation of conv_forward(), one conv_single_step() per output value.
+
+    Arguments:
+    A_prev -- output activations of the previous layer,
+        numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    hparameters -- python dictionary containing "stride" and "pad"
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache of values needed for the conv_backward() function
+    """
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    (f, f, n_C_prev, n_C) = W.shape
+    stride = hparameters['stride']
+    pad = hparameters['pad']
+
+    n_H = int((n_H_prev - f + 2 * pad) / stride) + 1
+    n_W = int((n_W_prev - f + 2 * pad) / stride) + 1
+
+    Z = np.zeros((m, n_H, n_W, n_C))
+    A_prev_pad = zero_pad(A_prev, pad)
+
+    for i in range(m):
+        a_prev_pad = A_prev_pad[i]
+        for h in range(n_H):
+            vert_start = h * stride
+            vert_end = vert_start + f
+            for w in range(n_W):
+                horiz_start = w * stride
+                horiz_end = horiz_start + f
+                for c in range(n_C):
+                    a_slice_prev = a_prev_pad[vert_start:vert_end, horiz_start:horiz_end, :]
+                    Z[i, h, w, c] = conv_single_step(a_slice_prev, W[:, :, :, c], b[:, :, :, c])
+
+    cache = (A_prev, W, b, hparameters)
+
+    return Z, cache
+
+
+def conv_backward_loop(dZ, cache):
+    """
+    Reference loop implementation of conv_backward().
+
+    Arguments:
+    dZ -- gradient of the cost with respect to the output of the conv layer (Z), numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache of values needed for the conv_backward(), output of conv_forward()
+
+    Returns:
+    dA_prev -- gradient of the cost with respect to the input of the conv layer (A_prev),
+               numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    dW -- gradient of the cost with respect to the weights of the conv layer (W)
+          numpy array of shape (f, f, n_C_prev, n_C)
+    db -- gradient of the cost with respect to the biases of the conv layer (b)
+          numpy array of shape (1, 1, 1, n_C)
+    """
+    (A_prev, W, b, hparameters) = cache
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    (f, f, n_C_prev, n_C) = W.shape
+    stride = hparameters["stride"]
+    pad = hparameters["pad"]
+    (m, n_H, n_W, n_C) = dZ.shape
+
+    dA_prev = np.zeros((m, n_H_prev, n_W_prev, n_C_prev))
+    dW = np.zeros((f, f, n_C_prev, n_C))
+    db = np.zeros((1, 1, 1, n_C))
+
+    A_prev_pad = zero_pad(A_prev, pad)
+    dA_prev_pad = zero_pad(dA_prev, pad)
+
+    for i in range(m):
+        a_prev_pad = A_prev_pad[i]
+        da_prev_pad = dA_prev_pad[i]
+        for h in range(n_H):
+            for w in range(n_W):
+                for c in range(n_C):
+                    vert_start = h * stride
+                    vert_end = vert_start + f
+                    horiz_start = w * stride
+                    horiz_end = horiz_start + f
+
+                    a_slice = a_prev_pad[vert_start:vert_end, horiz_start:horiz_end, :]
+
+                    da_prev_pad[vert_start:vert_end, horiz_start:horiz_end, :] += W[:, :, :, c] * dZ[i, h, w, c]
+                    dW[:, :, :, c] += a_slice * dZ[i, h, w, c]
+                    db[:, :, :, c] += dZ[i, h, w, c]
+
+        dA_prev[i, :, :, :] = da_prev_pad[pad:pad + n_H_prev, pad:pad + n_W_prev, :]
+
+    assert(dA_prev.shape == (m, n_H_prev, n_W_prev, n_C_prev))
+
+    return dA_prev, dW, db
+
+
+def create_mask_from_window(x):
+    """
+    Creates a mask from an input matrix x, to identify the max entry of x.
+
+    Arguments:
+    x -- Array of shape (f, f)
+
+    Returns:
+    mask -- Array of the same shape as window, contains a True at the position corresponding to the max entry of x.
+    """
+    mask = (x == np.max(x))
+
+    return mask
+
+
+def distribute_value(dz, shape):
+    """
+    Distributes the input value in the matrix of dimension shape
+
+    Arguments:
+    dz -- input scalar
+    shape -- the shape (n_H, n_W) of the output matrix for which we want to distribute the value of dz
+
+    Returns:
+    a -- Array of size (n_H, n_W) for which we distributed the value of dz
+    """
+    (n_H, n_W) = shape
+    average = dz / (n_H * n_W)
+    a = np.ones(shape) * average
+
+    return a
+
+
+def pool_forward_loop(A_prev, hparameters, mode="max"):
+    """
+    Reference loop implementation of pool_forward().
+
+    Arguments:
+    A_prev -- Input data, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    hparameters -- python dictionary containing "f" and "stride"
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+
+    Returns:
+    A -- output of the pool layer, a numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache used in the backward pass of the pooling layer, contains the input and hparameters
+    """
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    f = hparameters["f"]
+    stride = hparameters["stride"]
+
+    n_H = int(1 + (n_H_prev - f) / stride)
+    n_W = int(1 + (n_W_prev - f) / stride)
+    n_C = n_C_prev
+
+    A = np.zeros((m, n_H, n_W, n_C))
+
+    for i in range(m):
+        for h in range(n_H):
+            vert_start = h * stride
+            vert_end = vert_start + f
+            for w in range(n_W):
+                horiz_start = w * stride
+                horiz_end = horiz_start + f
+                for c in range(n_C):
+                    a_prev_slice = A_prev[i, vert_start:vert_end, horiz_start:horiz_end, c]
+                    if mode == "max":
+                        A[i, h, w, c] = np.max(a_prev_slice)
+                    elif mode == "average":
+                        A[i, h, w, c] = np.mean(a_prev_slice)
+
+    cache = (A_prev, hparameters)
+
+    return A, cache
+
+
+def pool_backward_loop(dA, cache, mode="max"):
+    """
+    Reference loop implementation of pool_backward(), one create_mask_from_window() or
+    distribute_value() per window.
+
+    Arguments:
+    dA -- gradient of cost with respect to the output of the pooling layer, same shape as A
+    cache -- cache output from the forward pass of the pooling layer, contains the layer's input and hparameters
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+
+    Returns:
+    dA_prev -- gradient of cost with respect to the input of the pooling layer, same shape as A_prev
+    """
+    (A_prev, hparameters) = cache
+    stride = hparameters["stride"]
+    f = hparameters["f"]
+    m, n_H_prev, n_W_prev, n_C_prev = A_prev.shape
+    m, n_H, n_W, n_C = dA.shape
+
+    dA_prev = np.zeros(A_prev.shape)
+
+    for i in range(m):
+        a_prev = A_prev[i]
+        for h in range(n_H):
+            for w in range(n_W):
+                for c in range(n_C):
+                    vert_start = h * stride
+                    vert_end = vert_start + f
+                    horiz_start = w * stride
+                    horiz_end = horiz_start + f
+
+                    if mode == "max":
+                        a_prev_slice = a_prev[vert_start:vert_end, horiz_start:horiz_end, c]
+                        mask = create_mask_from_window(a_prev_slice)
+                        dA_prev[i, vert_start:vert_end, horiz_start:horiz_end, c] += mask * dA[i, h, w, c]
+                    elif mode == "average":
+                        da = dA[i, h, w, c]
+                        shape = (f, f)
+                        dA_prev[i, vert_start:vert_end, horiz_start:horiz_end, c] += distribute_value(da, shape)
+
+    assert(dA_prev.shape == A_prev.shape)
+
+    return dA_prev
+
+
+######################################
+######### VECTORIZED LAYERS ##########
+######################################
+
+def conv_forward(A_prev, W, b, hparameters, workspace=None):
+    """
+    Implements the forward propagation for a convolution function, as one matrix product
+    between every window of the padded input (im2col) and the filters.
+
+    Arguments:
+    A_prev -- output activations of the previous layer,
+        numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    hparameters -- python dictionary containing "stride" and "pad"
+    workspace -- optional Workspace whose buffers and dtype are used instead of new arrays
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache of values needed for the conv_backward() function
+    """
+    if workspace is not None:
+        return _conv_forward_workspace(A_prev, W, b, hparameters, workspace)
+
+    (f, f, n_C_prev, n_C) = W.shape
+    stride = hparameters['stride']
+    pad = hparameters['pad']
+
+    A_prev_pad = zero_pad(A_prev, pad)
+
+    # (m, n_H, n_W, n_C_prev, f, f) windows contracted with W over (f, f, n_C_prev)
+    windows = _windows(A_prev_pad, f, stride)
+    Z = np.tensordot(windows, W, axes=([4, 5, 3], [0, 1, 2]))
+    Z += b
+
+    cache = (A_prev, W, b, hparameters)
+
+    return Z, cache
+
+
+def conv_backward(dZ, cache, workspace=None):
+    """
+    Implement the backward propagation for a convolution function. dW is one matrix product
+    between the input windows and dZ, and dA_prev is scattered back from the window gradients
+    with one strided add per filter position (col2im).
+
+    Arguments:
+    dZ -- gradient of the cost with respect to the output of the conv layer (Z), numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache of values needed for the conv_backward(), output of conv_forward()
+    workspace -- optional Workspace whose buffers and dtype are used instead of new arrays
+
+    Returns:
+    dA_prev -- gradient of the cost with respect to the input of the conv layer (A_prev),
+               numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    dW -- gradient of the cost with respect to the weights of the conv layer (W)
+          numpy array of shape (f, f, n_C_prev, n_C)
+    db -- gradient of the cost with respect to the biases of the conv layer (b)
+          numpy array of shape (1, 1, 1, n_C)
+    """
+    if workspace is not None:
+        return _conv_backward_workspace(dZ, cache, workspace)
+
+    (A_prev, W, b, hparameters) = cache
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    (f, f, n_C_prev, n_C) = W.shape
+    stride = hparameters["stride"]
+    pad = hparameters["pad"]
+    (m, n_H, n_W, n_C) = dZ.shape
+
+    A_prev_pad = zero_pad(A_prev, pad)
+    windows = _windows(A_prev_pad, f, stride)
+
+    db = dZ.sum(axis=(0, 1, 2)).reshape(1, 1, 1, n_C)
+    dW = np.tensordot(windows, dZ, axes=([0, 1, 2], [0, 1, 2])).transpose(1, 2, 0, 3)
+
+    # Gradient of every window, (m, n_H, n_W, f, f, n_C_prev), added back where it was read
+    dwindows = np.tensordot(dZ, W, axes=([3], [3]))
+    dA_prev_pad = np.zeros(A_prev_pad.shape, dtype=dwindows.dtype)
+    for i in range(f):
+        for j in range(f):
+            dA_prev_pad[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] += dwindows[:, :, :, i, j, :]
+    dA_prev = dA_prev_pad[:, pad:pad + n_H_prev, pad:pad + n_W_prev, :]
+
+    assert(dA_prev.shape == (m, n_H_prev, n_W_prev, n_C_prev))
+
+    return dA_prev, dW, db
+
+
+def pool_forward(A_prev, hparameters, mode="max", workspace=None):
+    """
+    Implements the forward pass of the pooling layer over a strided view of every window.
+    In max mode the max of every window is kept in the cache, so pool_backward() does not
+    have to search the windows again.
+
+    Arguments:
+    A_prev -- Input data, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    hparameters -- python dictionary containing "f" and "stride"
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+    workspace -- optional Workspace whose buffers and dtype are used instead of new arrays
+
+    Returns:
+    A -- output of the pool layer, a numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache used in the backward pass of the pooling layer, contains the input and hparameters
+    """
+    if workspace is not None:
+        return _pool_forward_workspace(A_prev, hparameters, mode, workspace)
+
+    f = hparameters["f"]
+    stride = hparameters["stride"]
+
+    # (m, n_H, n_W, n_C, f, f) windows, flattened to (m, n_H, n_W, n_C, f * f)
+    windows = _windows(A_prev, f, stride)
+    cache = PoolCache((A_prev, hparameters))
+
+    if mode == "max":
+        A = windows.max(axis=(4, 5))
+        cache.window_max = A
+    elif mode == "average":
+        A = windows.mean(axis=(4, 5))
+    else:
+        raise ValueError("mode should be 'max' or 'average', got {}".format(mode))
+
+    return A, cache
+
+
+def pool_backward(dA, cache, mode="max", workspace=None):
+    """
+    Implements the backward pass of the pooling layer with one strided add per window position.
+    In max mode every entry equal to the max of its window gets the whole gradient, as with
+    create_mask_from_window(), so tied entries (e.g. zeros after a ReLU) all get it; in average
+    mode the gradient is spread evenly over the window.
+
+    Arguments:
+    dA -- gradient of cost with respect to the output of the pooling layer, same shape as A
+    cache -- cache output from the forward pass of the pooling layer, contains the layer's input and hparameters
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+    workspace -- optional Workspace whose buffers and dtype are used instead of new arrays
+
+    Returns:
+    dA_prev -- gradient of cost with respect to the input of the pooling layer, same shape as A_prev
+    """
+    if workspace is not None:
+        return _pool_backward_workspace(dA, cache, mode, workspace)
+
+    (A_prev, hparameters) = cache
+    stride = hparameters["stride"]
+    f = hparameters["f"]
+    m, n_H_prev, n_W_prev, n_C_prev = A_prev.shape
+    m, n_H, n_W, n_C = dA.shape
+
+    if mode == "max":
+        window_max = getattr(cache, "window_max", None)
+        if window_max is None:
+            window_max = _windows(A_prev, f, stride).max(axis=(4, 5))
+        dA_prev = np.zeros(A_prev.shape, dtype=dA.dtype)
+        for i in range(f):
+            for j in range(f):
+                mask = A_prev[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] == window_max
+                dA_prev[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] += dA * mask
+    elif mode == "average":
+        da = dA / (f * f)
+        dA_prev = np.zeros(A_prev.shape, dtype=da.dtype)
+        for i in range(f):
+            for j in range(f):
+                dA_prev[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] += da
+    else:
+        raise ValueError("mode should be 'max' or 'average', got {}".format(mode))
+
+    assert(dA_prev.shape == A_prev.shape)
+
+    return dA_prev
+
+
+######################################
+########## WORKSPACE LAYERS ##########
+######################################
+
+def _conv_columns(A_prev, f, stride, pad, workspace):
+    """
+    Pads A_prev into the workspace and copies every window into the im2col matrix of shape
+    (m * n_H * n_W, f * f * n_C_prev), laid out in the same order as W.
+    """
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    A_prev_pad = workspace.get("conv_pad", (m, n_H_prev + 2 * pad, n_W_prev + 2 * pad, n_C_prev))
+    zero_pad(A_prev, pad, out=A_prev_pad)
+
+    windows = _windows(A_prev_pad, f, stride)
+    (m, n_H, n_W) = windows.shape[:3]
+    columns = workspace.get("conv_columns", (m, n_H, n_W, f, f, n_C_prev))
+    np.copyto(columns, windows.transpose(0, 1, 2, 4, 5, 3))
+
+    return A_prev_pad, columns.reshape(m * n_H * n_W, f * f * n_C_prev)
+
+
+def _conv_forward_workspace(A_prev, W, b, hparameters, workspace):
+    (f, f, n_C_prev, n_C) = W.shape
+    stride = hparameters['stride']
+    pad = hparameters['pad']
+
+    A_prev_pad, columns = _conv_columns(A_prev, f, stride, pad, workspace)
+    (m, n_H, n_W) = _windows(A_prev_pad, f, stride).shape[:3]
+    W = workspace.cast("conv_W", W)
+    b = workspace.cast("conv_b", b)
+
+    Z = workspace.get("conv_Z", (m, n_H, n_W, n_C))
+    np.matmul(columns, W.reshape(f * f * n_C_prev, n_C), out=Z.reshape(m * n_H * n_W, n_C))
+    Z += b
+
+    cache = (A_prev, W, b, hparameters)
+
+    return Z, cache
+
+
+def _conv_backward_workspace(dZ, cache, workspace):
+    (A_prev, W, b, hparameters) = cache
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    (f, f, n_C_prev, n_C) = W.shape
+    stride = hparameters["stride"]
+    pad = hparameters["pad"]
+    (m, n_H, n_W, n_C) = dZ.shape
+
+    # The columns are rebuilt, the workspace may have run another batch since the forward pass
+    A_prev_pad, columns = _conv_columns(A_prev, f, stride, pad, workspace)
+    W = workspace.cast("conv_W", W)
+    dZ = workspace.cast("conv_dZ", dZ).reshape(m * n_H * n_W, n_C)
+
+    db = workspace.get("conv_db", (1, 1, 1, n_C))
+    np.sum(dZ, axis=0, out=db.reshape(n_C))
+    dW = workspace.get("conv_dW", (f, f, n_C_prev, n_C))
+    np.matmul(columns.T, dZ, out=dW.reshape(f * f * n_C_prev, n_C))
+
+    dcolumns = workspace.get("conv_dcolumns", (m, n_H, n_W, f, f, n_C_prev))
+    np.matmul(dZ, W.reshape(f * f * n_C_prev, n_C).T, out=dcolumns.reshape(m * n_H * n_W, f * f * n_C_prev))
+    dA_prev_pad = workspace.get("conv_dpad", A_prev_pad.shape, zero=True)
+    for i in range(f):
+        for j in range(f):
+            dA_prev_pad[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] += dcolumns[:, :, :, i, j, :]
+    dA_prev = dA_prev_pad[:, pad:pad + n_H_prev, pad:pad + n_W_prev, :]
+
+    return dA_prev, dW, db
+
+
+def _pool_forward_workspace(A_prev, hparameters, mode, workspace):
+    f = hparameters["f"]
+    stride = hparameters["stride"]
+
+    A_prev = workspace.cast("pool_A_prev", A_prev)
+    cache = PoolCache((A_prev, hparameters))
+
+    if mode == "max":
+        windows = _windows(A_prev, f, stride)
+        A = workspace.get("pool_A", windows.shape[:4])
+        np.max(windows, axis=(4, 5), out=A)
+        cache.window_max = A
+    elif mode == "average":
+        windows = _windows(A_prev, f, stride)
+        A = workspace.get("pool_A", windows.shape[:4])
+        np.mean(windows, axis=(4, 5), out=A)
+    else:
+        raise ValueError("mode should be 'max' or 'average', got {}".format(mode))
+
+    return A, cache
+
+
+def _pool_backward_workspace(dA, cache, mode, workspace):
+    (A_prev, hparameters) = cache
+    stride = hparameters["stride"]
+    f = hparameters["f"]
+    m, n_H, n_W, n_C = dA.shape
+
+    dA = workspace.cast("pool_dA", dA)
+    dA_prev = workspace.get("pool_dA_prev", A_prev.shape, zero=True)
+    da = workspace.get("pool_da", dA.shape)
+
+    if mode == "max":
+        A_prev = workspace.cast("pool_A_prev", A_prev)
+        window_max = getattr(cache, "window_max", None)
+        if window_max is None:
+            window_max = workspace.get("pool_A", dA.shape)
+            np.max(_windows(A_prev, f, stride), axis=(4, 5), out=window_max)
+
+        mask = workspace.get("pool_mask", dA.shape, dtype=bool)
+        for i in range(f):
+            for j in range(f):
+                np.equal(A_prev[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :], window_max, out=mask)
+                np.multiply(dA, mask, out=da)
+                dA_prev[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] += da
+    elif mode == "average":
+        np.divide(dA, f * f, out=da)
+        for i in range(f):
+            for j in range(f):
+                dA_prev[:, i:i + stride * n_H:stride, j:j + stride * n_W:stride, :] += da
+    else:
+        raise ValueError("mode should be 'max' or 'average', got {}".format(mode))
+
+    return dA_prev
+
+
+######################################
+####### BATCH-PARALLEL LAYERS ########
+######################################
+
+class BatchParallel:
+    """
+    Runs the layer functions on chunks of the batch in a pool of threads. NumPy and BLAS release
+    the GIL, so the chunks run on separate cores.
+
+    The batch is always cut into chunks of chunk_size examples, whatever the number of workers,
+    and dW and db are summed over the chunks in order, so the results do not depend on the
+    number of workers. Limit BLAS to one thread (e.g. OMP_NUM_THREADS=1) to avoid running more
+    threads than cores.
+
+    Arguments:
+    workers -- number of threads, all the cores by default
+    chunk_size -- number of examples per chunk
+    dtype -- run every chunk in a Workspace of this dtype, one per worker thread reused by every
+             chunk it runs, None to allocate new arrays as the layer functions do by default
+    """
+
+    def __init__(self, workers=None, chunk_size=8, dtype=None):
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.workspaces = {}
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def _map(self, run, m):
+        """
+        Calls run(chunk) for every chunk of a batch of m examples, returns the results in order.
+        """
+        chunks = [slice(start, min(start + self.chunk_size, m)) for start in range(0, m, self.chunk_size)]
+        return list(self.pool.map(run, chunks))
+
+    def _workspace(self):
+        """
+        Workspace of the calling worker thread, so there are never more workspaces than workers
+        however large the batch.
+        """
+        if self.dtype is None:
+            return None
+        thread = threading.get_ident()
+        if thread not in self.workspaces:
+            self.workspaces[thread] = Workspace(self.dtype)
+        return self.workspaces[thread]
+
+    def _dtype(self, *arrays):
+        return np.dtype(self.dtype) if self.dtype is not None else np.result_type(*arrays)
+
+    def conv_forward(self, A_prev, W, b, hparameters):
+        """
+        conv_forward() of the whole batch, see conv_forward().
+        """
+        (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+        (f, f, n_C_prev, n_C) = W.shape
+        stride = hparameters['stride']
+        pad = hparameters['pad']
+        n_H = (n_H_prev - f + 2 * pad) // stride + 1
+        n_W = (n_W_prev - f + 2 * pad) // stride + 1
+        Z = np.empty((m, n_H, n_W, n_C), dtype=self._dtype(A_prev, W, b))
+
+        def run(chunk):
+            Z[chunk] = conv_forward(A_prev[chunk], W, b, hparameters, workspace=self._workspace())[0]
+
+        self._map(run, m)
+        cache = (A_prev, W, b, hparameters)
+
+        return Z, cache
+
+    def conv_backward(self, dZ, cache):
+        """
+        conv_backward() of the whole batch, see conv_backward().
+        """
+        (A_prev, W, b, hparameters) = cache
+        dA_prev = np.empty(A_prev.shape, dtype=self._dtype(dZ, W))
+
+        def run(chunk):
+            dA_chunk, dW, db = conv_backward(dZ[chunk], (A_prev[chunk], W, b, hparameters),
+                                             workspace=self._workspace())
+            dA_prev[chunk] = dA_chunk
+            # dW and db may be workspace buffers the next chunk of this thread overwrites
+            return dW.copy(), db.copy()
+
+        grads = self._map(run, len(A_prev))
+        dW = grads[0][0].copy()
+        db = grads[0][1].copy()
+        for (dW_chunk, db_chunk) in grads[1:]:
+            dW += dW_chunk
+            db += db_chunk
+
+        return dA_prev, dW, db
+
+    def pool_forward(self, A_prev, hparameters, mode="max"):
+        """
+        pool_forward() of the whole batch, see pool_forward().
+        """
+        (m, n_H_prev, n_W_prev, n_C) = A_prev.shape
+        f = hparameters["f"]
+        stride = hparameters["stride"]
+        n_H = (n_H_prev - f) // stride + 1
+        n_W = (n_W_prev - f) // stride + 1
+        A = np.empty((m, n_H, n_W, n_C), dtype=self._dtype(A_prev))
+        cache = PoolCache((A_prev, hparameters))
+        if mode == "max":
+            cache.window_max = A
+
+        def run(chunk):
+            A[chunk] = pool_forward(A_prev[chunk], hparameters, mode, workspace=self._workspace())[0]
+
+        self._map(run, m)
+
+        return A, cache
+
+    def pool_backward(self, dA, cache, mode="max"):
+        """
+        pool_backward() of the whole batch, see pool_backward().
+        """
+        (A_prev, hparameters) = cache
+        window_max = getattr(cache, "window_max", None)
+        dA_prev = np.empty(A_prev.shape, dtype=self._dtype(dA))
+
+        def run(chunk):
+            chunk_cache = PoolCache((A_prev[chunk], hparameters))
+            if window_max is not None:
+                chunk_cache.window_max = window_max[chunk]
+            dA_prev[chunk] = pool_backward(dA[chunk], chunk_cache, mode, workspace=self._workspace())
+
+        self._map(run, len(A_prev))
+
+        return dA_prev
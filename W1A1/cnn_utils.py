@@ -1,4 +1,6 @@
 import math
+import queue
+import threading
 import numpy as np
 import h5py
 import matplotlib.pyplot as plt
@@ -7,19 +9,19 @@ from tensorflow.python.framework import ops
 
 
 def load_dataset():
-    train_dataset = h5py.File('datasets/train_signs.h5', "r")
-    # your train set features
-    train_set_x_orig = np.array(train_dataset["train_set_x"][:])
-    train_set_y_orig = np.array(
-        train_dataset["train_set_y"][:])  # your train set labels
+    with h5py.File('datasets/train_signs.h5', "r") as train_dataset:
+        # your train set features
+        train_set_x_orig = np.array(train_dataset["train_set_x"][:])
+        train_set_y_orig = np.array(
+            train_dataset["train_set_y"][:])  # your train set labels
 
-    test_dataset = h5py.File('datasets/test_signs.h5', "r")
-    # your test set features
-    test_set_x_orig = np.array(test_dataset["test_set_x"][:])
-    test_set_y_orig = np.array(
-        test_dataset["test_set_y"][:])  # your test set labels
+    with h5py.File('datasets/test_signs.h5', "r") as test_dataset:
+        # your test set features
+        test_set_x_orig = np.array(test_dataset["test_set_x"][:])
+        test_set_y_orig = np.array(
+            test_dataset["test_set_y"][:])  # your test set labels
 
-    classes = np.array(test_dataset["list_classes"][:])  # the list of classes
+        classes = np.array(test_dataset["list_classes"][:])  # the list of classes
 
     train_set_y_orig = train_set_y_orig.reshape((1, train_set_y_orig.shape[0]))
     test_set_y_orig = test_set_y_orig.reshape((1, test_set_y_orig.shape[0]))
@@ -27,6 +29,96 @@ def load_dataset():
     return train_set_x_orig, train_set_y_orig, test_set_x_orig, test_set_y_orig, classes
 
 
+class H5Dataset:
+    """
+    Lazy handle on one split of an h5 dataset file, for datasets too large to load with
+    load_dataset(). The images stay as uint8 on disk and are only read in slices or
+    batches, which are normalized to float32 on the fly. The file is closed by close()
+    or when leaving a with block.
+
+    Arguments:
+    filename -- path of the h5 file, e.g. 'datasets/train_signs.h5'
+    split -- prefix of the datasets in the file, e.g. "train" for "train_set_x" and "train_set_y"
+    normalize -- if True, images are returned as float32 divided by 255, otherwise as stored
+
+    Usage:
+    with H5Dataset('datasets/train_signs.h5', "train") as train_set:
+        for X_batch, Y_batch in train_set.batches(64, seed=0):
+            ...
+    """
+
+    def __init__(self, filename, split, normalize=True):
+        self.file = h5py.File(filename, "r")
+        self.X = self.file[split + "_set_x"]
+        self.Y = self.file[split + "_set_y"]
+        self.normalize = normalize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    def _images(self, X):
+        if not self.normalize:
+            return X
+        X = X.astype(np.float32)
+        X *= np.float32(1 / 255.)
+        return X
+
+    def __getitem__(self, index):
+        """
+        Reads a slice (or any index h5py accepts) of images and labels.
+
+        Returns:
+        (X, Y) -- images, float32 in [0, 1] if normalize, and labels
+        """
+        return self._images(self.X[index]), self.Y[index]
+
+    def take(self, index):
+        """
+        Reads the examples at an arbitrary array of indices, in the given order.
+
+        Returns:
+        (X, Y) -- images, float32 in [0, 1] if normalize, and labels
+        """
+        index = np.asarray(index)
+        # h5py reads fancy indices in increasing order only
+        unique, inverse = np.unique(index, return_inverse=True)
+        return self._images(self.X[unique][inverse]), self.Y[unique][inverse]
+
+    def batches(self, mini_batch_size=64, seed=None):
+        """
+        Reads the dataset one minibatch at a time.
+
+        Arguments:
+        mini_batch_size -- size of the mini-batches, integer
+        seed -- if None, batches are read in order with contiguous reads, otherwise
+                they are shuffled like random_mini_batches(X, Y, mini_batch_size, seed)
+
+        Yields:
+        (mini_batch_X, mini_batch_Y) -- synchronous minibatches, the last one may be smaller
+        """
+        m = len(self)
+        if seed is not None:
+            permutation = np.random.RandomState(seed).permutation(m)
+        for k in range(0, m, mini_batch_size):
+            if seed is None:
+                yield self[k: k + mini_batch_size]
+            else:
+                yield self.take(permutation[k: k + mini_batch_size])
+
+
 def random_mini_batches(X, Y, mini_batch_size=64, seed=0):
     """
     Creates a list of random minibatches from (X, Y)
@@ -73,11 +165,147 @@ def random_mini_batches(X, Y, mini_batch_size=64, seed=0):
     return mini_batches
 
 
+def iter_mini_batches(X, Y, mini_batch_size=64, seed=0, prefetch=False):
+    """
+    Lazily yields the same minibatches as random_mini_batches(X, Y, mini_batch_size, seed)
+    without building a shuffled copy of (X, Y). Only an index permutation is shuffled and
+    each minibatch is gathered on demand into a preallocated buffer that is reused, so a
+    yielded minibatch is only valid until the next one is requested (copy it to keep it).
+
+    Arguments:
+    X -- input data, of shape (input size, number of examples) (m, Hi, Wi, Ci)
+    Y -- true "label" vector (containing 0 if cat, 1 if non-cat), of shape (1, number of examples) (m, n_y)
+    mini_batch_size - size of the mini-batches, integer
+    seed -- seed of the shuffle, the same seed gives the same minibatches as random_mini_batches
+    prefetch -- if True, the next minibatch is gathered on a background thread
+
+    Yields:
+    (mini_batch_X, mini_batch_Y) -- synchronous minibatches, the last one may be smaller
+    """
+
+    m = X.shape[0]                  # number of training examples
+    # Same permutation as np.random.seed(seed); np.random.permutation(m), without
+    # touching the global random state
+    permutation = np.random.RandomState(seed).permutation(m)
+    num_mini_batches = math.ceil(m / mini_batch_size)
+
+    # One buffer is enough when gathering on demand. With prefetching one buffer is
+    # held by the caller, one waits in the queue and one is being filled.
+    n_buffers = 3 if prefetch else 1
+    buffers = [(np.empty((mini_batch_size,) + X.shape[1:], dtype=X.dtype),
+                np.empty((mini_batch_size,) + Y.shape[1:], dtype=Y.dtype))
+               for _ in range(n_buffers)]
+
+    def gather(k):
+        index = permutation[k * mini_batch_size: (k + 1) * mini_batch_size]
+        buffer_X, buffer_Y = buffers[k % n_buffers]
+        # mode='clip' lets np.take write straight into the buffer
+        mini_batch_X = np.take(X, index, axis=0, out=buffer_X[:len(index)], mode='clip')
+        mini_batch_Y = np.take(Y, index, axis=0, out=buffer_Y[:len(index)], mode='clip')
+        return mini_batch_X, mini_batch_Y
+
+    if not prefetch:
+        for k in range(num_mini_batches):
+            yield gather(k)
+        return
+
+    batches = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def producer():
+        for k in range(num_mini_batches):
+            try:
+                batch = gather(k)
+            except Exception as error:
+                batch = error
+            while not stop.is_set():
+                try:
+                    batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set() or isinstance(batch, Exception):
+                return
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        for k in range(num_mini_batches):
+            batch = batches.get()
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        thread.join()
+
+
 def convert_to_one_hot(Y, C):
     Y = np.eye(C)[Y.reshape(-1)].T
     return Y
 
 
+def one_hot(Y, C, dtype=np.float32, out=None):
+    """
+    Memory-lean version of convert_to_one_hot(Y, C).T: writes the one-hot encoding of Y
+    straight into an (m, C) array of the chosen dtype, without building a C x C identity
+    matrix or a float64 copy to transpose.
+
+    Arguments:
+    Y -- integer labels, of any shape holding m labels in total, e.g. (1, m)
+    C -- number of classes
+    dtype -- dtype of the encoding, e.g. np.uint8 or np.float32
+    out -- optional preallocated array of shape (m, C) to write into, e.g. a slice of a larger buffer
+
+    Returns:
+    out -- one-hot encoding of Y, of shape (m, C)
+    """
+    labels = np.asarray(Y).reshape(-1)
+    if labels.size and (labels.min() < 0 or labels.max() >= C):
+        raise ValueError("Labels must be between 0 and {}".format(C - 1))
+    if out is None:
+        out = np.zeros((labels.shape[0], C), dtype=dtype)
+    else:
+        out[...] = 0
+    out[np.arange(labels.shape[0]), labels] = 1
+    return out
+
+
+def sparse_labels(Y, dtype=np.int32):
+    """
+    Integer labels for sparse_categorical_crossentropy, in place of a one-hot encoding.
+
+    Arguments:
+    Y -- integer labels, of any shape holding m labels in total, e.g. (1, m)
+    dtype -- integer dtype of the labels
+
+    Returns:
+    labels -- labels of shape (m,)
+    """
+    return np.asarray(Y).reshape(-1).astype(dtype, copy=False)
+
+
+def iter_one_hot(Y, C, chunk_size=65536, dtype=np.float32):
+    """
+    Streams the one-hot encoding of a large label array in chunks, reusing one buffer, so
+    only chunk_size encoded labels are held in memory at once. Each yielded chunk is only
+    valid until the next one is requested.
+
+    Arguments:
+    Y -- integer labels of shape (m,) or (m, 1), e.g. an h5py dataset
+    C -- number of classes
+    chunk_size -- number of labels encoded at a time
+    dtype -- dtype of the encoding, e.g. np.uint8 or np.float32
+
+    Yields:
+    chunk -- one-hot encoding of Y[start:start + chunk_size], of shape (<= chunk_size, C)
+    """
+    buffer = np.empty((chunk_size, C), dtype=dtype)
+    for start in range(0, Y.shape[0], chunk_size):
+        labels = Y[start:start + chunk_size]
+        yield one_hot(labels, C, out=buffer[:len(labels)])
+
+
 def forward_propagation_for_predict(X, parameters):
     """
     Implements the forward propagation for the model: LINEAR -> RELU -> LINEAR -> RELU -> LINEAR -> SOFTMAX
@@ -111,28 +339,56 @@ def forward_propagation_for_predict(X, parameters):
     return Z3
 
 
-def predict(X, parameters):
+class Predictor:
+    """
+    Reusable predictor for the model of forward_propagation_for_predict.
+    The weights are kept on the device as tf.Variable and the forward pass
+    is traced once as a tf.function accepting any number of examples, so
+    repeated calls only pay for the matrix multiplications.
 
-    W1 = tf.convert_to_tensor(parameters["W1"])
-    b1 = tf.convert_to_tensor(parameters["b1"])
-    W2 = tf.convert_to_tensor(parameters["W2"])
-    b2 = tf.convert_to_tensor(parameters["b2"])
-    W3 = tf.convert_to_tensor(parameters["W3"])
-    b3 = tf.convert_to_tensor(parameters["b3"])
+    Arguments:
+    parameters -- python dictionary containing your parameters "W1", "b1", "W2", "b2", "W3", "b3"
+
+    Usage:
+    predictor = Predictor(parameters)
+    predictions = predictor(X)  # X of shape (input size, number of examples)
+    """
 
-    params = {"W1": W1,
-              "b1": b1,
-              "W2": W2,
-              "b2": b2,
-              "W3": W3,
-              "b3": b3}
+    def __init__(self, parameters):
+        self.parameters = {key: tf.Variable(np.asarray(parameters[key], dtype=np.float32),
+                                            trainable=False, name=key)
+                           for key in ("W1", "b1", "W2", "b2", "W3", "b3")}
+        n_x = self.parameters["W1"].shape[1]
+        self._predict = tf.function(self._forward,
+                                    input_signature=[tf.TensorSpec([n_x, None], tf.float32)])
 
-    x = tf.placeholder("float", [12288, 1])
+    def _forward(self, X):
+        return tf.argmax(forward_propagation_for_predict(X, self.parameters))
 
-    z3 = forward_propagation_for_predict(x, params)
-    p = tf.argmax(z3)
+    def __call__(self, X):
+        """
+        Arguments:
+        X -- input data, of shape (input size, number of examples) or (input size,)
 
-    sess = tf.Session()
-    prediction = sess.run(p, feed_dict={x: X})
+        Returns:
+        prediction -- predicted class of each example, of shape (number of examples,)
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(-1, 1)
+        return self._predict(tf.convert_to_tensor(X)).numpy()
 
-    return prediction
+
+def predict(X, parameters):
+    """
+    Predicts the classes of X. Builds a new Predictor on every call, so
+    create a Predictor once when predicting many batches.
+
+    Arguments:
+    X -- input data, of shape (input size, number of examples)
+    parameters -- python dictionary containing your parameters "W1", "b1", "W2", "b2", "W3", "b3"
+
+    Returns:
+    prediction -- predicted class of each example, of shape (number of examples,)
+    """
+    return Predictor(parameters)(X)
@@ -3,7 +3,7 @@ from test_utils import single_test, multiple_test
 from outputs import *
 
 
-def zero_pad_test(target):
+def zero_pad_test(target, budget=None):
     np.random.seed(1)
     x = np.random.randn(4, 3, 3, 2)
     pad = 2
@@ -24,10 +24,10 @@ def zero_pad_test(target):
         }
     ]
 
-    single_test(test_cases, target)
+    single_test(test_cases, target, budget)
 
 
-def conv_single_step_test(target):
+def conv_single_step_test(target, budget=None):
 
     np.random.seed(1)
     a_slice_prev = np.random.randn(4, 4, 3)
@@ -55,10 +55,10 @@ def conv_single_step_test(target):
         }
     ]
 
-    multiple_test(test_cases, target)
+    multiple_test(test_cases, target, budget)
 
 
-def conv_forward_test(target):
+def conv_forward_test(target, budget=None):
     # Test 1
     A_prev = np.random.randn(2, 5, 7, 4)
     W = np.random.randn(3, 3, 4, 8)
@@ -117,10 +117,10 @@ def conv_forward_test(target):
         }
     ]
 
-    multiple_test(test_cases, target)
+    multiple_test(test_cases, target, budget)
 
 
-def pool_forward_test(target):
+def pool_forward_test(target, budget=None):
     
     # Test 1
     A_prev = np.random.randn(2, 5, 7, 3)
@@ -191,7 +191,7 @@ def pool_forward_test(target):
         }
     ]
 
-    multiple_test(test_cases, target)
+    multiple_test(test_cases, target, budget)
 
 ######################################
 ############## UNGRADED ##############
@@ -1,5 +1,15 @@
+import json
+import time
+import tracemalloc
 import numpy as np
 
+# Wall time and peak allocation of every input of the last test of each function, by function name
+timings = {}
+
+# Trace the memory allocated by every evaluation. tracemalloc slows down code creating many arrays
+# several times over, so the times of traced evaluations are not compared to the time budgets
+trace_memory = False
+
 
 def datatype_check(expected_output, target_output, error):
     success = 0
@@ -99,39 +109,162 @@ def shape_check(expected_output, target_output, error):
         return 1
 
 
-def single_test(test_cases, target):
-    success = 0
+def evaluate(target, inputs, trace=None):
+    """
+    Calls target(*inputs) once, recording its wall time and, when tracing, the peak memory it
+    allocates as traced by tracemalloc.
+
+    Arguments:
+    trace -- trace the memory of the call, trace_memory by default
+
+    Returns:
+    output -- what target returned
+    record -- dictionary with the "seconds" and "peak_bytes" (None when not traced) of the call,
+              and whether it was "traced"
+    """
+    if trace is None:
+        trace = trace_memory
+    if not trace:
+        start = time.perf_counter()
+        output = target(*inputs)
+        return output, {"seconds": time.perf_counter() - start, "peak_bytes": None, "traced": False}
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        output = target(*inputs)
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+        if not tracing:
+            tracemalloc.stop()
+    return output, {"seconds": seconds, "peak_bytes": peak_bytes, "traced": True}
+
+
+def evaluate_cases(test_cases, target):
+    """
+    Evaluates target once per distinct input of test_cases, test cases sharing the same input
+    objects reuse the same output.
+
+    Returns:
+    answers -- list of (output, exception) pairs, one per test case
+    records -- list of the timing records of every evaluation
+    """
+    results = {}
+    answers = []
+    records = []
     for test_case in test_cases:
+        key = tuple(id(value) for value in test_case['input'])
+        if key not in results:
+            start = time.perf_counter()
+            try:
+                output, record = evaluate(target, test_case['input'])
+                results[key] = (output, None)
+            except Exception as error:
+                record = {"seconds": time.perf_counter() - start, "peak_bytes": None,
+                          "traced": trace_memory}
+                results[key] = (None, error)
+            records.append(record)
+        answers.append(results[key])
+    return answers, records
+
+
+def check_budget(target, records, budget):
+    """
+    Raises an AssertionError when the slowest evaluation of target took longer than budget. Traced
+    evaluations are left out, their times are inflated by tracemalloc.
+
+    Arguments:
+    budget -- time budget in seconds of one call of target, or a dictionary of budgets by function
+              name as returned by load_budgets(), None for no budget
+    """
+    if isinstance(budget, dict):
+        budget = budget.get(target.__name__)
+    records = [record for record in records if not record["traced"]]
+    if budget is None or not records:
+        return
+    seconds = max(record["seconds"] for record in records)
+    if seconds > budget:
+        print("\033[91m {} took {:.3g} s, over its time budget of {:.3g} s".format(target.__name__, seconds, budget))
+        raise AssertionError(
+            "{} is slower than its time budget. Check that it did not regress.".format(target.__name__))
+
+
+def save_baselines(filename, names=None):
+    """
+    Writes the slowest recorded time of each tested function to a JSON file, to be read by
+    load_budgets(). Traced evaluations are left out.
+
+    Arguments:
+    names -- functions to save, every function tested so far by default
+    """
+    names = timings.keys() if names is None else names
+    baselines = {}
+    for name in names:
+        seconds = [record["seconds"] for record in timings[name] if not record["traced"]]
+        if seconds:
+            baselines[name] = max(seconds)
+    with open(filename, "w") as f:
+        json.dump(baselines, f, indent=2)
+
+
+def load_budgets(filename, slowdown=1.5):
+    """
+    Time budgets of the functions saved by save_baselines(), slowdown times their baseline.
+    """
+    with open(filename) as f:
+        return {name: slowdown * seconds for name, seconds in json.load(f).items()}
+
+
+def report(test_cases, target, success, records, budget):
+    timings[target.__name__] = records
+    if success == len(test_cases):
+        print("\033[92m All tests passed.")
+    else:
+        print('\033[92m', success, " Tests passed")
+        print('\033[91m', len(test_cases) - success, " Tests failed")
+        raise AssertionError(
+            "Not all tests were passed for {}. Check your equations and avoid using global variables inside the function.".format(target.__name__))
+    check_budget(target, records, budget)
+
+
+def single_test(test_cases, target, budget=None):
+    success = 0
+    answers, records = evaluate_cases(test_cases, target)
+    for test_case, (target_answer, error) in zip(test_cases, answers):
         try:
+            if error is not None:
+                raise error
             if test_case['name'] == "datatype_check":
-                assert isinstance(target(*test_case['input']),
+                assert isinstance(target_answer,
                                   type(test_case["expected"]))
                 success += 1
             if test_case['name'] == "equation_output_check":
                 assert np.allclose(test_case["expected"],
-                                   target(*test_case['input']))
+                                   target_answer)
                 success += 1
             if test_case['name'] == "shape_check":
-                assert test_case['expected'].shape == target(
-                    *test_case['input']).shape
+                assert test_case['expected'].shape == target_answer.shape
                 success += 1
         except:
             print("Error: " + test_case['error'])
 
-    if success == len(test_cases):
-        print("\033[92m All tests passed.")
-    else:
-        print('\033[92m', success, " Tests passed")
-        print('\033[91m', len(test_cases) - success, " Tests failed")
-        raise AssertionError(
-            "Not all tests were passed for {}. Check your equations and avoid using global variables inside the function.".format(target.__name__))
+    report(test_cases, target, success, records, budget)
+    return records
 
 
-def multiple_test(test_cases, target):
+def multiple_test(test_cases, target, budget=None):
     success = 0
-    for test_case in test_cases:
+    answers, records = evaluate_cases(test_cases, target)
+    for test_case, (target_answer, error) in zip(test_cases, answers):
         try:
-            target_answer = target(*test_case['input'])
+            if error is not None:
+                raise error
             if test_case['name'] == "datatype_check":
                 success += datatype_check(test_case['expected'],
                                           target_answer, test_case['error'])
@@ -144,10 +277,5 @@ def multiple_test(test_cases, target):
         except:
             print("Error: " + test_case['error'])
 
-    if success == len(test_cases):
-        print("\033[92m All tests passed.")
-    else:
-        print('\033[92m', success, " Tests passed")
-        print('\033[91m', len(test_cases) - success, " Tests failed")
-        raise AssertionError(
-            "Not all tests were passed for {}. Check your equations and avoid using global variables inside the function.".format(target.__name__))
+    report(test_cases, target, success, records, budget)
+    return records
@@ -3,51 +3,32 @@ import numpy as np
 import tensorflow as tf
 import h5py
 import math
+import queue
+import threading
+import time
 from PIL import Image, ImageOps, ImageFilter, ImageEnhance
 from matplotlib.pyplot import imshow
 
 def load_dataset():
-    train_dataset = h5py.File('datasets/train_signs.h5', "r")
-    # your train set features
-    train_set_x_orig = np.array(train_dataset["train_set_x"][:])
-
-    '''
-    img = Image.fromarray(train_set_x_orig[im])
-    for im in range(len(train_set_x_orig)):
-        img = Image.fromarray(train_set_x_orig[im])
-        #img = ImageEnhance.Contrast(img).enhance(1)
-        img = ImageOps.equalize(img, mask = None)
-        img = img.filter(ImageFilter.SMOOTH)
-        train_set_x_orig[im] = np.array(img)
-    train_set_x_orig2 = []
-    for im in range(len(train_set_x_orig)):
-        train_set_x_orig2.append(np.rot90(train_set_x_orig[im], axes=(-3, -2)))
-    train_set_x_orig3 = []
-    for im in range(len(train_set_x_orig)):
-        train_set_x_orig3.append(np.rot90(train_set_x_orig2[im], axes=(-3, -2)))
-    train_set_x_orig3 = np.array(train_set_x_orig3)
-    train_set_x_orig4 = []
-    for im in range(len(train_set_x_orig)):
-        train_set_x_orig4.append(np.rot90(train_set_x_orig3[im], axes=(-3, -2)))
-    train_set_x_orig4 = np.array(train_set_x_orig4)
-
-    train_set_x_orig = np.concatenate((train_set_x_orig, train_set_x_orig2, train_set_x_orig3, train_set_x_orig4))
-    '''
-    
-    train_set_y_orig = np.array(
-        train_dataset["train_set_y"][:])  # your train set labels
+    with h5py.File('datasets/train_signs.h5', "r") as train_dataset:
+        # your train set features
+        train_set_x_orig = np.array(train_dataset["train_set_x"][:])
 
-    #train_set_y_orig = np.concatenate((train_set_y_orig, train_set_y_orig, train_set_y_orig, train_set_y_orig))
+        # Rotations, flips, equalization and smoothing of the training images are
+        # applied per minibatch by augment_batch() / augmented_mini_batches()
+    
+        train_set_y_orig = np.array(
+            train_dataset["train_set_y"][:])  # your train set labels
 
     
-    test_dataset = h5py.File('datasets/test_signs.h5', "r")
-    # your test set features
-    test_set_x_orig = np.array(test_dataset["test_set_x"][:])
+    with h5py.File('datasets/test_signs.h5', "r") as test_dataset:
+        # your test set features
+        test_set_x_orig = np.array(test_dataset["test_set_x"][:])
         
-    test_set_y_orig = np.array(
-        test_dataset["test_set_y"][:])  # your test set labels
+        test_set_y_orig = np.array(
+            test_dataset["test_set_y"][:])  # your test set labels
 
-    classes = np.array(test_dataset["list_classes"][:])  # the list of classes
+        classes = np.array(test_dataset["list_classes"][:])  # the list of classes
 
     train_set_y_orig = train_set_y_orig.reshape((1, train_set_y_orig.shape[0]))
     test_set_y_orig = test_set_y_orig.reshape((1, test_set_y_orig.shape[0]))
@@ -55,6 +36,96 @@ def load_dataset():
     return train_set_x_orig, train_set_y_orig, test_set_x_orig, test_set_y_orig, classes
 
 
+class H5Dataset:
+    """
+    Lazy handle on one split of an h5 dataset file, for datasets too large to load with
+    load_dataset(). The images stay as uint8 on disk and are only read in slices or
+    batches, which are normalized to float32 on the fly. The file is closed by close()
+    or when leaving a with block.
+
+    Arguments:
+    filename -- path of the h5 file, e.g. 'datasets/train_signs.h5'
+    split -- prefix of the datasets in the file, e.g. "train" for "train_set_x" and "train_set_y"
+    normalize -- if True, images are returned as float32 divided by 255, otherwise as stored
+
+    Usage:
+    with H5Dataset('datasets/train_signs.h5', "train") as train_set:
+        for X_batch, Y_batch in train_set.batches(64, seed=0):
+            ...
+    """
+
+    def __init__(self, filename, split, normalize=True):
+        self.file = h5py.File(filename, "r")
+        self.X = self.file[split + "_set_x"]
+        self.Y = self.file[split + "_set_y"]
+        self.normalize = normalize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    def _images(self, X):
+        if not self.normalize:
+            return X
+        X = X.astype(np.float32)
+        X *= np.float32(1 / 255.)
+        return X
+
+    def __getitem__(self, index):
+        """
+        Reads a slice (or any index h5py accepts) of images and labels.
+
+        Returns:
+        (X, Y) -- images, float32 in [0, 1] if normalize, and labels
+        """
+        return self._images(self.X[index]), self.Y[index]
+
+    def take(self, index):
+        """
+        Reads the examples at an arbitrary array of indices, in the given order.
+
+        Returns:
+        (X, Y) -- images, float32 in [0, 1] if normalize, and labels
+        """
+        index = np.asarray(index)
+        # h5py reads fancy indices in increasing order only
+        unique, inverse = np.unique(index, return_inverse=True)
+        return self._images(self.X[unique][inverse]), self.Y[unique][inverse]
+
+    def batches(self, mini_batch_size=64, seed=None):
+        """
+        Reads the dataset one minibatch at a time.
+
+        Arguments:
+        mini_batch_size -- size of the mini-batches, integer
+        seed -- if None, batches are read in order with contiguous reads, otherwise
+                they are shuffled like random_mini_batches(X, Y, mini_batch_size, seed)
+
+        Yields:
+        (mini_batch_X, mini_batch_Y) -- synchronous minibatches, the last one may be smaller
+        """
+        m = len(self)
+        if seed is not None:
+            permutation = np.random.RandomState(seed).permutation(m)
+        for k in range(0, m, mini_batch_size):
+            if seed is None:
+                yield self[k: k + mini_batch_size]
+            else:
+                yield self.take(permutation[k: k + mini_batch_size])
+
+
 def random_mini_batches(X, Y, mini_batch_size=64, seed=0):
     """
     Creates a list of random minibatches from (X, Y)
@@ -101,11 +172,300 @@ def random_mini_batches(X, Y, mini_batch_size=64, seed=0):
     return mini_batches
 
 
+def iter_mini_batches(X, Y, mini_batch_size=64, seed=0, prefetch=False):
+    """
+    Lazily yields the same minibatches as random_mini_batches(X, Y, mini_batch_size, seed)
+    without building a shuffled copy of (X, Y). Only an index permutation is shuffled and
+    each minibatch is gathered on demand into a preallocated buffer that is reused, so a
+    yielded minibatch is only valid until the next one is requested (copy it to keep it).
+
+    Arguments:
+    X -- input data, of shape (input size, number of examples) (m, Hi, Wi, Ci)
+    Y -- true "label" vector (containing 0 if cat, 1 if non-cat), of shape (1, number of examples) (m, n_y)
+    mini_batch_size - size of the mini-batches, integer
+    seed -- seed of the shuffle, the same seed gives the same minibatches as random_mini_batches
+    prefetch -- if True, the next minibatch is gathered on a background thread
+
+    Yields:
+    (mini_batch_X, mini_batch_Y) -- synchronous minibatches, the last one may be smaller
+    """
+
+    m = X.shape[0]                  # number of training examples
+    # Same permutation as np.random.seed(seed); np.random.permutation(m), without
+    # touching the global random state
+    permutation = np.random.RandomState(seed).permutation(m)
+    num_mini_batches = math.ceil(m / mini_batch_size)
+
+    # One buffer is enough when gathering on demand. With prefetching one buffer is
+    # held by the caller, one waits in the queue and one is being filled.
+    n_buffers = 3 if prefetch else 1
+    buffers = [(np.empty((mini_batch_size,) + X.shape[1:], dtype=X.dtype),
+                np.empty((mini_batch_size,) + Y.shape[1:], dtype=Y.dtype))
+               for _ in range(n_buffers)]
+
+    def gather(k):
+        index = permutation[k * mini_batch_size: (k + 1) * mini_batch_size]
+        buffer_X, buffer_Y = buffers[k % n_buffers]
+        # mode='clip' lets np.take write straight into the buffer
+        mini_batch_X = np.take(X, index, axis=0, out=buffer_X[:len(index)], mode='clip')
+        mini_batch_Y = np.take(Y, index, axis=0, out=buffer_Y[:len(index)], mode='clip')
+        return mini_batch_X, mini_batch_Y
+
+    if not prefetch:
+        for k in range(num_mini_batches):
+            yield gather(k)
+        return
+
+    batches = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def producer():
+        for k in range(num_mini_batches):
+            try:
+                batch = gather(k)
+            except Exception as error:
+                batch = error
+            while not stop.is_set():
+                try:
+                    batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set() or isinstance(batch, Exception):
+                return
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        for k in range(num_mini_batches):
+            batch = batches.get()
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+def equalize_batch(X):
+    """
+    Histogram equalization of every channel of every image of a batch, the vectorized
+    equivalent of PIL's ImageOps.equalize applied image by image.
+
+    Arguments:
+    X -- uint8 images, of shape (m, n_H, n_W, n_C)
+
+    Returns:
+    X_eq -- equalized uint8 images, of shape (m, n_H, n_W, n_C)
+    """
+    if X.dtype != np.uint8:
+        raise ValueError("equalize_batch expects uint8 images, got {}".format(X.dtype))
+    m, n_H, n_W, n_C = X.shape
+
+    # One 256-bin histogram per (image, channel), all from a single bincount
+    offsets = (np.arange(m)[:, None] * n_C + np.arange(n_C)[None, :]) * 256
+    index = X.astype(np.int32 if m * n_C * 256 < 2**31 else np.int64) + offsets[:, None, None, :]
+    histo = np.bincount(index.ravel(), minlength=m * n_C * 256).reshape(m, n_C, 256)
+
+    # Same lookup table as PIL: the count of the brightest occupied bin is left out
+    # of the step, and channels with a single occupied bin are left unchanged
+    last = 255 - np.argmax(histo[:, :, ::-1] > 0, axis=-1)
+    step = (n_H * n_W - np.take_along_axis(histo, last[..., None], -1)[..., 0]) // 255
+    safe_step = np.maximum(step, 1)[..., None]
+    lut = (safe_step // 2 + np.cumsum(histo, axis=-1) - histo) // safe_step
+    lut = np.where((step == 0)[..., None], np.arange(256), lut)
+    lut = np.minimum(lut, 255).astype(np.uint8)
+
+    return lut.reshape(-1)[index]
+
+
+def smooth_batch(X):
+    """
+    3x3 smoothing of a batch of images with the kernel of PIL's ImageFilter.SMOOTH
+    ([[1, 1, 1], [1, 5, 1], [1, 1, 1]] / 13). Border pixels are left unchanged as in PIL,
+    and uint8 images are rounded the same way.
+
+    Arguments:
+    X -- images, of shape (m, n_H, n_W, n_C)
+
+    Returns:
+    X_smooth -- smoothed images, same shape and dtype as X
+    """
+    integer = np.issubdtype(X.dtype, np.integer)
+    # 13 * 255 fits in int16, which keeps the sums cheap for uint8 images
+    A = X.astype((np.int16 if X.dtype == np.uint8 else np.int64) if integer else X.dtype)
+    S = (A[:, :-2, :-2] + A[:, :-2, 1:-1] + A[:, :-2, 2:] +
+         A[:, 1:-1, :-2] + 5 * A[:, 1:-1, 1:-1] + A[:, 1:-1, 2:] +
+         A[:, 2:, :-2] + A[:, 2:, 1:-1] + A[:, 2:, 2:])
+    X_smooth = X.copy()
+    if integer:
+        # round(S / 13) with integers, S / 13 is never exactly halfway
+        X_smooth[:, 1:-1, 1:-1] = (2 * S + 13) // 26
+    else:
+        X_smooth[:, 1:-1, 1:-1] = S / 13
+    return X_smooth
+
+
+def rotate_batch(X, k):
+    """
+    Rotates every image of a batch by k * 90 degrees, with one np.rot90 per distinct k.
+
+    Arguments:
+    X -- images, of shape (m, n_H, n_W, n_C)
+    k -- number of quarter turns, an integer or an array of shape (m,) with one per image
+
+    Returns:
+    X_rot -- rotated images, of shape (m, n_H, n_W, n_C) (n_H and n_W swap if k is an odd integer)
+    """
+    if np.ndim(k) == 0:
+        return np.ascontiguousarray(np.rot90(X, k, axes=(1, 2)))
+    if X.shape[1] != X.shape[2]:
+        raise ValueError("Per-image rotations need square images, got {}".format(X.shape[1:3]))
+    k = np.asarray(k) % 4
+    X_rot = X.copy()
+    for turns in (1, 2, 3):
+        selected = k == turns
+        if np.any(selected):
+            X_rot[selected] = np.rot90(X[selected], turns, axes=(1, 2))
+    return X_rot
+
+
+def flip_batch(X, horizontal=None, vertical=None):
+    """
+    Mirrors the selected images of a batch.
+
+    Arguments:
+    X -- images, of shape (m, n_H, n_W, n_C)
+    horizontal -- boolean array of shape (m,), images to mirror left-right (None for none)
+    vertical -- boolean array of shape (m,), images to mirror top-bottom (None for none)
+
+    Returns:
+    X_flip -- flipped images, of shape (m, n_H, n_W, n_C)
+    """
+    X_flip = X.copy()
+    if horizontal is not None and np.any(horizontal):
+        X_flip[horizontal] = X_flip[horizontal][:, :, ::-1]
+    if vertical is not None and np.any(vertical):
+        X_flip[vertical] = X_flip[vertical][:, ::-1]
+    return X_flip
+
+
+def augment_batch(X, rng, rotate=True, flip=True, equalize=False, smooth=False):
+    """
+    Randomly augments a minibatch with batched NumPy operations, so the augmented
+    dataset never has to be stored.
+
+    Arguments:
+    X -- images, of shape (m, n_H, n_W, n_C), uint8 if equalize is True
+    rng -- np.random.RandomState choosing the augmentation of each image
+    rotate -- rotate each image by a random multiple of 90 degrees (square images only)
+    flip -- mirror each image left-right with probability 0.5
+    equalize -- histogram equalize every image, see equalize_batch()
+    smooth -- smooth every image, see smooth_batch()
+
+    Returns:
+    X_aug -- augmented images, same shape and dtype as X
+    """
+    m = X.shape[0]
+    if equalize:
+        X = equalize_batch(X)
+    if smooth:
+        X = smooth_batch(X)
+    if rotate:
+        X = rotate_batch(X, rng.randint(0, 4, size=m))
+    if flip:
+        X = flip_batch(X, horizontal=rng.random_sample(m) < 0.5)
+    return X
+
+
+def augmented_mini_batches(X, Y, mini_batch_size=64, seed=0, prefetch=False, **augment):
+    """
+    Yields the minibatches of iter_mini_batches(X, Y, mini_batch_size, seed, prefetch),
+    each augmented on the fly by augment_batch(). Using a different seed every epoch gives
+    a new shuffle and new augmentations.
+
+    Arguments:
+    X -- input data, of shape (m, Hi, Wi, Ci)
+    Y -- labels, of shape (m, n_y)
+    mini_batch_size -- size of the mini-batches, integer
+    seed -- seed of the shuffle and of the augmentations
+    prefetch -- if True, the next minibatch is gathered on a background thread
+    augment -- keyword arguments of augment_batch (rotate, flip, equalize, smooth)
+
+    Yields:
+    (mini_batch_X, mini_batch_Y) -- augmented minibatches
+    """
+    rng = np.random.RandomState(seed)
+    for mini_batch_X, mini_batch_Y in iter_mini_batches(X, Y, mini_batch_size, seed, prefetch):
+        yield augment_batch(mini_batch_X, rng, **augment), mini_batch_Y
+
+
 def convert_to_one_hot(Y, C):
     Y = np.eye(C)[Y.reshape(-1)].T
     return Y
 
 
+def one_hot(Y, C, dtype=np.float32, out=None):
+    """
+    Memory-lean version of convert_to_one_hot(Y, C).T: writes the one-hot encoding of Y
+    straight into an (m, C) array of the chosen dtype, without building a C x C identity
+    matrix or a float64 copy to transpose.
+
+    Arguments:
+    Y -- integer labels, of any shape holding m labels in total, e.g. (1, m)
+    C -- number of classes
+    dtype -- dtype of the encoding, e.g. np.uint8 or np.float32
+    out -- optional preallocated array of shape (m, C) to write into, e.g. a slice of a larger buffer
+
+    Returns:
+    out -- one-hot encoding of Y, of shape (m, C)
+    """
+    labels = np.asarray(Y).reshape(-1)
+    if labels.size and (labels.min() < 0 or labels.max() >= C):
+        raise ValueError("Labels must be between 0 and {}".format(C - 1))
+    if out is None:
+        out = np.zeros((labels.shape[0], C), dtype=dtype)
+    else:
+        out[...] = 0
+    out[np.arange(labels.shape[0]), labels] = 1
+    return out
+
+
+def sparse_labels(Y, dtype=np.int32):
+    """
+    Integer labels for sparse_categorical_crossentropy, in place of a one-hot encoding.
+
+    Arguments:
+    Y -- integer labels, of any shape holding m labels in total, e.g. (1, m)
+    dtype -- integer dtype of the labels
+
+    Returns:
+    labels -- labels of shape (m,)
+    """
+    return np.asarray(Y).reshape(-1).astype(dtype, copy=False)
+
+
+def iter_one_hot(Y, C, chunk_size=65536, dtype=np.float32):
+    """
+    Streams the one-hot encoding of a large label array in chunks, reusing one buffer, so
+    only chunk_size encoded labels are held in memory at once. Each yielded chunk is only
+    valid until the next one is requested.
+
+    Arguments:
+    Y -- integer labels of shape (m,) or (m, 1), e.g. an h5py dataset
+    C -- number of classes
+    chunk_size -- number of labels encoded at a time
+    dtype -- dtype of the encoding, e.g. np.uint8 or np.float32
+
+    Yields:
+    chunk -- one-hot encoding of Y[start:start + chunk_size], of shape (<= chunk_size, C)
+    """
+    buffer = np.empty((chunk_size, C), dtype=dtype)
+    for start in range(0, Y.shape[0], chunk_size):
+        labels = Y[start:start + chunk_size]
+        yield one_hot(labels, C, out=buffer[:len(labels)])
+
+
 def forward_propagation_for_predict(X, parameters):
     """
     Implements the forward propagation for the model: LINEAR -> RELU -> LINEAR -> RELU -> LINEAR -> SOFTMAX
@@ -164,3 +524,201 @@ def predict(X, parameters):
     prediction = sess.run(p, feed_dict={x: X})
 
     return prediction
+
+
+def _layer_references(obj, renames=None, found=None):
+    """
+    Walks the inbound_nodes or output_layers of a functional model config and collects the names of
+    the layers whose outputs are referenced, renaming them with the renames dictionary if given.
+    Handles both the Keras 3 ("keras_history") and the Keras 2 ([name, node, tensor, kwargs]) formats.
+    """
+    found = [] if found is None else found
+    if isinstance(obj, dict):
+        history = obj.get("keras_history")
+        if history is not None:
+            found.append(history[0])
+            if renames and history[0] in renames:
+                history[0] = renames[history[0]]
+        for key, value in obj.items():
+            if key != "keras_history":
+                _layer_references(value, renames, found)
+    elif isinstance(obj, (list, tuple)):
+        if len(obj) >= 3 and isinstance(obj[0], str) and isinstance(obj[1], int):
+            found.append(obj[0])
+            if renames and obj[0] in renames:
+                obj[0] = renames[obj[0]]
+        for value in obj:
+            _layer_references(value, renames, found)
+    return found
+
+
+def _drop_training(obj):
+    """
+    Removes the training arguments baked into the layer calls of a config, e.g. by
+    BatchNormalization(axis = 3)(X, training = training), so every layer runs in inference mode.
+    """
+    if isinstance(obj, dict):
+        obj.pop("training", None)
+        for value in obj.values():
+            _drop_training(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _drop_training(value)
+
+
+def _foldable(conv, bn, consumers):
+    """
+    True when the BatchNormalization layer bn only normalizes the output channels of conv, and
+    nothing else uses the output of conv.
+    """
+    return (isinstance(conv, tf.keras.layers.Conv2D)
+            and conv.get_config()["activation"] == "linear"
+            and conv.get_config().get("data_format", "channels_last") == "channels_last"
+            and bn.axis in (-1, 3, [-1], [3])
+            and consumers.get(conv.name) == [bn.name])
+
+
+def _fold_weights(conv, bn):
+    """
+    Kernel and bias of conv followed by bn in inference mode, as a single convolution.
+    """
+    kernel = conv.kernel.numpy()
+    bias = conv.bias.numpy() if conv.use_bias else np.zeros(kernel.shape[-1], dtype=kernel.dtype)
+    scale = 1 / np.sqrt(bn.moving_variance.numpy() + bn.epsilon)
+    if bn.gamma is not None:
+        scale = scale * bn.gamma.numpy()
+    shift = -bn.moving_mean.numpy() * scale
+    if bn.beta is not None:
+        shift = shift + bn.beta.numpy()
+    return [kernel * scale, bias * scale + shift]
+
+
+def _rebuild(model, fold):
+    config = model.get_config()
+    for layer_config in config["layers"]:
+        _drop_training(layer_config["inbound_nodes"])
+
+    # Layers using the output of each layer
+    consumers = {}
+    for layer_config in config["layers"]:
+        for name in set(_layer_references(layer_config["inbound_nodes"])):
+            consumers.setdefault(name, []).append(layer_config["name"])
+
+    # BatchNormalization layer name -> name of the Conv2D it is folded into
+    folded = {}
+    if fold:
+        for layer_config in config["layers"]:
+            layer = model.get_layer(layer_config["name"])
+            if not isinstance(layer, tf.keras.layers.BatchNormalization):
+                continue
+            inputs = set(_layer_references(layer_config["inbound_nodes"]))
+            if len(inputs) == 1:
+                conv = model.get_layer(inputs.pop())
+                if _foldable(conv, layer, consumers):
+                    folded[layer.name] = conv.name
+
+    convs = set(folded.values())
+    config["layers"] = [layer_config for layer_config in config["layers"] if layer_config["name"] not in folded]
+    for layer_config in config["layers"]:
+        if layer_config["name"] in convs:
+            layer_config["config"]["use_bias"] = True
+        _layer_references(layer_config["inbound_nodes"], folded)
+    _layer_references(config["output_layers"], folded)
+
+    inference = tf.keras.Model.from_config(config)
+    bns = {conv: bn for bn, conv in folded.items()}
+    for layer in inference.layers:
+        if layer.name in bns:
+            layer.set_weights(_fold_weights(model.get_layer(layer.name), model.get_layer(bns[layer.name])))
+        else:
+            layer.set_weights(model.get_layer(layer.name).get_weights())
+    return inference
+
+
+def inference_model(model):
+    """
+    Copy of a functional Keras model with every layer in inference mode. The identity and
+    convolutional blocks call BatchNormalization with training=True by default, which a
+    ResNet50 built from them keeps when it is called directly (and with Keras 2 in predict()).
+
+    Arguments:
+    model -- functional tf.keras.Model, e.g. a trained ResNet50
+
+    Returns:
+    inference -- tf.keras.Model with the same weights, normalizing with the moving mean and variance
+    """
+    return _rebuild(model, fold=False)
+
+
+def fold_batch_norm(model):
+    """
+    Exports a functional Keras model for inference with every BatchNormalization that directly
+    follows a Conv2D folded into that convolution's kernel and bias, so the normalization no longer
+    costs a pass over the activations. For ResNet50 this removes all 53 BatchNormalization layers.
+
+    Arguments:
+    model -- functional tf.keras.Model, e.g. a trained ResNet50
+
+    Returns:
+    folded -- tf.keras.Model computing the same outputs as inference_model(model)
+    """
+    return _rebuild(model, fold=True)
+
+
+def folding_error(model, folded, X, batch_size=64):
+    """
+    Largest absolute difference between the outputs of inference_model(model) and folded on X.
+    """
+    expected = inference_model(model).predict(X, batch_size=batch_size, verbose=0)
+    return float(np.max(np.abs(expected - folded.predict(X, batch_size=batch_size, verbose=0))))
+
+
+def inference_throughput(model, X, batch_size=64, repeat=3):
+    """
+    Number of images per second a model classifies on the CPU, in batches of batch_size.
+
+    Arguments:
+    model -- tf.keras.Model
+    X -- input images, e.g. 64x64 tiles of shape (m, 64, 64, 3)
+    batch_size -- number of images per call of the model
+    repeat -- number of timed passes over X, the fastest one is kept
+
+    Returns:
+    throughput -- images per second
+    """
+    X = np.asarray(X, dtype=np.float32)
+    spec = tf.TensorSpec((None,) + X.shape[1:], tf.float32)
+    with tf.device("/CPU:0"):
+        call = tf.function(lambda x: model(x, training=False), input_signature=[spec])
+        batches = [tf.constant(X[start:start + batch_size]) for start in range(0, X.shape[0], batch_size)]
+        call(batches[0])
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for batch in batches:
+                call(batch).numpy()
+            best = min(best, time.perf_counter() - start)
+    return X.shape[0] / best
+
+
+def benchmark_folding(model, X, batch_size=64, repeat=3):
+    """
+    Folds the BatchNormalization layers of model, checks the folded outputs and compares the CPU
+    throughput of both versions.
+
+    Arguments:
+    model -- functional tf.keras.Model, e.g. a trained ResNet50
+    X -- input images, e.g. 64x64 tiles of shape (m, 64, 64, 3)
+
+    Returns:
+    folded -- the folded model
+    report -- dictionary with the output "error", the number of BatchNormalization layers left and
+              the images per second of both versions
+    """
+    folded = fold_batch_norm(model)
+    reference = inference_model(model)
+    report = {"error": folding_error(model, folded, X, batch_size),
+              "batch_norm_layers": sum(isinstance(layer, tf.keras.layers.BatchNormalization) for layer in folded.layers),
+              "throughput": inference_throughput(reference, X, batch_size, repeat),
+              "folded_throughput": inference_throughput(folded, X, batch_size, repeat)}
+    return folded, report
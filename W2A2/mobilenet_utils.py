@@ -0,0 +1,242 @@
+import os
+import hashlib
+import numpy as np
+import tensorflow as tf
+import h5py
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+def split_model(model, pooling_layer=None):
+    """
+    Splits a transfer learning model such as alpaca_model into the frozen part, from the input to
+    the pooled features of the base model, and the trainable classification head after it.
+
+    Arguments:
+    model -- tf.keras.Model made of a chain of layers: data augmentation, preprocessing, a frozen base
+             model, a pooling layer and the head (e.g. Dropout and Dense)
+    pooling_layer -- name of the layer whose output is cached, the first GlobalAveragePooling2D layer
+                     by default
+
+    Returns:
+    extractor -- tf.keras.Model from the input of model to the pooled features. Called with
+                 training=True it applies the data augmentation of model
+    head -- tf.keras.Model from the pooled features to the output of model, sharing the layers
+            (and weights) of model, so training the head trains model
+    """
+    layers = model.layers
+    if pooling_layer is None:
+        index = next(i for i, layer in enumerate(layers)
+                     if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D))
+    else:
+        index = [layer.name for layer in layers].index(pooling_layer)
+
+    extractor = tf.keras.Model(model.inputs, layers[index].output)
+    features = tf.keras.Input(shape=layers[index].output.shape[1:])
+    x = features
+    for layer in layers[index + 1:]:
+        x = layer(x)
+    head = tf.keras.Model(features, x)
+
+    return extractor, head
+
+
+def cache_features(extractor, dataset, augmented_copies=1, filename=None, fingerprint=None):
+    """
+    Runs the frozen part of the model once over every image of dataset, plus once per augmented
+    copy, and keeps the pooled features.
+
+    Arguments:
+    extractor -- feature extractor returned by split_model()
+    dataset -- tf.data.Dataset of (images, labels) batches, e.g. from image_dataset_from_directory
+    augmented_copies -- number of randomly augmented copies of every image added to the features of the
+                        original images, 0 for the validation set
+    filename -- HDF5 file to store the features in, the features are only kept in memory if None
+    fingerprint -- feature_fingerprint() stored with the features
+
+    Returns:
+    features -- numpy array of shape (m * (1 + augmented_copies), n_features)
+    labels -- numpy array of shape (m * (1 + augmented_copies),)
+    """
+    call = tf.function(lambda images, training: extractor(images, training=training), reduce_retracing=True)
+    features = []
+    labels = []
+    for copy in range(1 + augmented_copies):
+        for images, batch_labels in dataset:
+            features.append(call(images, copy > 0).numpy())
+            labels.append(batch_labels.numpy())
+    features = np.concatenate(features).astype(np.float32)
+    labels = np.concatenate(labels)
+
+    if filename is not None:
+        with h5py.File(filename, "w") as store:
+            store["features"] = features
+            store["labels"] = labels
+            if fingerprint is not None:
+                store.attrs["fingerprint"] = fingerprint
+
+    return features, labels
+
+
+def load_features(filename):
+    """
+    Features and labels stored by cache_features().
+    """
+    with h5py.File(filename, "r") as store:
+        return np.array(store["features"]), np.array(store["labels"])
+
+
+def feature_fingerprint(extractor, dataset, augmented_copies=1):
+    """
+    Hash of what the features of cache_features() depend on: the layers and weights of the
+    extractor, its input shape, the number of augmented copies and the dataset, through its element
+    spec, number of batches and, when it lists them like image_dataset_from_directory and
+    directory_dataset, its files.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((extractor.input_shape, augmented_copies, str(dataset.element_spec),
+                        int(dataset.cardinality()))).encode())
+    # Class names rather than layer names, which Keras numbers differently in every session
+    for layer in extractor.layers:
+        digest.update(type(layer).__name__.encode())
+    for weight in extractor.weights:
+        digest.update(np.ascontiguousarray(weight.numpy()).tobytes())
+    for path in getattr(dataset, "file_paths", None) or ():
+        digest.update(path.encode())
+    return digest.hexdigest()
+
+
+def stored_fingerprint(filename):
+    """
+    feature_fingerprint() the features in filename were stored with, None if there is none.
+    """
+    with h5py.File(filename, "r") as store:
+        return store.attrs.get("fingerprint")
+
+
+def feature_dataset(features, labels, batch_size=32, shuffle=True, seed=0):
+    """
+    tf.data.Dataset of (features, labels) batches, shuffled every epoch.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((features, labels))
+    if shuffle:
+        dataset = dataset.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def fit_cached_head(model, train_dataset, validation_dataset=None, epochs=5, augmented_copies=1,
+                    cache_dir=None, batch_size=32, optimizer=None, loss=None, metrics=("accuracy",),
+                    seed=0, **kwargs):
+    """
+    Trains the classification head of a model with a frozen base model, such as alpaca_model, on
+    cached features. The base model runs once per image and augmented copy instead of once per image
+    and epoch, and every epoch only runs the head. The head shares its layers with model, so model
+    can be fine-tuned with model.fit() afterwards.
+
+    Arguments:
+    model -- tf.keras.Model with a frozen base model, see split_model()
+    train_dataset -- tf.data.Dataset of (images, labels) batches
+    validation_dataset -- optional tf.data.Dataset of (images, labels) batches
+    epochs -- number of epochs of the head
+    augmented_copies -- number of augmented copies of every training image
+    cache_dir -- directory where the features are stored as train_features.h5 and
+                 validation_features.h5, and read from if they already exist and were built by the
+                 same base model and weights from the same images, see feature_fingerprint()
+    batch_size -- batch size of the head
+    optimizer -- optimizer of the head, Adam with a learning rate of 0.001 by default
+    loss -- loss of the head, BinaryCrossentropy(from_logits=True) by default
+    metrics -- metrics of the head
+    seed -- seed of the shuffle of the features
+    kwargs -- other arguments of fit()
+
+    Returns:
+    history -- History of head.fit()
+    """
+    extractor, head = split_model(model)
+
+    def features(dataset, name, copies):
+        if cache_dir is None:
+            return cache_features(extractor, dataset, copies)
+        filename = os.path.join(cache_dir, name + "_features.h5")
+        fingerprint = feature_fingerprint(extractor, dataset, copies)
+        if os.path.exists(filename) and stored_fingerprint(filename) == fingerprint:
+            return load_features(filename)
+        return cache_features(extractor, dataset, copies, filename, fingerprint)
+
+    train_features = feature_dataset(*features(train_dataset, "train", augmented_copies), batch_size, seed=seed)
+    if validation_dataset is not None:
+        validation_features = feature_dataset(*features(validation_dataset, "validation", 0), batch_size,
+                                              shuffle=False)
+    else:
+        validation_features = None
+
+    head.compile(optimizer=optimizer or tf.keras.optimizers.Adam(learning_rate=0.001),
+                 loss=loss or tf.keras.losses.BinaryCrossentropy(from_logits=True),
+                 metrics=list(metrics))
+    return head.fit(train_features, validation_data=validation_features, epochs=epochs, **kwargs)
+
+
+def decode_image(path, image_size):
+    """
+    Reads, decodes and resizes one JPEG, PNG, BMP or GIF image as image_dataset_from_directory does.
+    """
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, image_size, method="bilinear")
+    image.set_shape(tuple(image_size) + (3,))
+    return image
+
+
+def directory_dataset(directory, image_size=(160, 160), batch_size=32, validation_split=None, subset=None,
+                      seed=42, cache=None, data_augmentation=None, shuffle=True):
+    """
+    Loads the images of directory, one subdirectory per class, into a tf.data pipeline with the same
+    files, split and labels as image_dataset_from_directory. The images are decoded and resized in
+    parallel and cached after the first epoch, so later epochs and later calls of fit() (e.g. for
+    fine-tuning) only read the cache. Data augmentation runs as a parallel map on the batches.
+
+    Arguments:
+    directory -- directory with one subdirectory of images per class, e.g. "dataset/"
+    image_size -- (height, width) the images are resized to
+    batch_size -- number of images per batch
+    validation_split -- fraction of the images kept for validation, None to use all of them
+    subset -- "training" or "validation" when validation_split is given
+    seed -- seed of the split and of the shuffle
+    cache -- file the decoded images are cached to, the subset is added to its name. The cache is
+             kept between runs; delete it when the images change. '' caches in memory and None
+             does not cache
+    data_augmentation -- tf.keras.Sequential applied in training mode to every batch, e.g.
+                         data_augmenter(). Pass an empty tf.keras.Sequential() to alpaca_model()
+                         so the images are not augmented twice
+    shuffle -- shuffle the files before the split, as image_dataset_from_directory does, and the
+               images every epoch
+
+    Returns:
+    dataset -- tf.data.Dataset of (images, labels) batches, with the class_names and file_paths
+               attributes of image_dataset_from_directory
+    """
+    # image_dataset_from_directory only lists the files here, the images are read below
+    listing = tf.keras.utils.image_dataset_from_directory(directory, batch_size=None, image_size=image_size,
+                                                          shuffle=shuffle, seed=seed,
+                                                          validation_split=validation_split, subset=subset)
+    class_names = listing.class_names
+    file_paths = listing.file_paths
+    labels = [class_names.index(os.path.basename(os.path.dirname(path))) for path in file_paths]
+
+    dataset = tf.data.Dataset.from_tensor_slices((file_paths, np.array(labels, dtype=np.int32)))
+    dataset = dataset.map(lambda path, label: (decode_image(path, image_size), label),
+                          num_parallel_calls=AUTOTUNE)
+    if cache is not None:
+        if cache and subset is not None:
+            cache = "{}.{}".format(cache, subset)
+        dataset = dataset.cache(cache)
+    if shuffle:
+        dataset = dataset.shuffle(len(file_paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    if data_augmentation is not None:
+        dataset = dataset.map(lambda images, labels: (data_augmentation(images, training=True), labels),
+                              num_parallel_calls=AUTOTUNE)
+    dataset = dataset.prefetch(AUTOTUNE)
+
+    dataset.class_names = class_names
+    dataset.file_paths = file_paths
+    return dataset
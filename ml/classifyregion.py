@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Runs a trained classifier over every tile of a section of config.ini
+and writes a catalog of HII Region candidates.
+"""
+
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from astropy.coordinates import SkyCoord
+from displayregion import iter_tiles
+
+def tile_batches(section, config_location, batch_size=256, image_size=(64, 64),
+                 workers=4):
+    """
+    Groups the tiles of a section into batches of model inputs. The
+    tiles are downloaded in the background while the previous batch
+    is being classified, so only a few batches are in memory at once.
+
+    Parameters
+    ----------
+    section : string
+        Specfic section of the config file to be used, determining
+        the grid of tile centers.
+    config_location : string
+        Directory of the location of the config.ini file.
+    batch_size : int, optional
+        Number of tiles per batch. The default is 256.
+    image_size : tuple of ints, optional
+        (H, W) the tiles are resized to. The default is (64, 64).
+    workers : int, optional
+        Number of downloads run at the same time. The default is 4.
+
+    Yields
+    ------
+    gnames : list of strings
+        Names of the tiles in the batch.
+    centers : ndarray of floats
+        (RA, Dec) in degrees of each tile center, shape (N, 2).
+    images : ndarray of float32
+        Tiles of shape (N, H, W, bands).
+
+    """
+    gnames, centers, images = [], [], []
+    for gname,center,wcs,cube in iter_tiles(section, config_location,
+                                            workers=workers,
+                                            depth=batch_size+2*workers):
+        gnames.append(gname)
+        centers.append(center)
+        images.append(tf.image.resize(cube, image_size).numpy())
+        if len(gnames) == batch_size:
+            yield gnames, np.array(centers), np.stack(images)
+            gnames, centers, images = [], [], []
+    if gnames:
+        yield gnames, np.array(centers), np.stack(images)
+
+def probabilities(outputs, positive_class=1, from_logits=False):
+    """
+    Converts model outputs into the probability that each tile
+    contains an HII Region.
+
+    Parameters
+    ----------
+    outputs : ndarray of floats
+        Model outputs, either (N, 1) for a sigmoid or logit output
+        (happyModel, alpaca_model) or (N, classes) for a softmax
+        output (ResNet50, convolutional_model).
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The outputs are logits rather than probabilities. The
+        default is False.
+
+    Returns
+    -------
+    prob : ndarray of floats
+        Probability per tile, shape (N,).
+
+    """
+    outputs = np.asarray(outputs, dtype=np.float64)
+    if outputs.ndim == 1 or outputs.shape[-1] == 1:
+        outputs = outputs.reshape(-1)
+        if from_logits:
+            outputs = 1/(1+np.exp(-outputs))
+        return outputs
+    if from_logits:
+        outputs = np.exp(outputs - outputs.max(axis=-1, keepdims=True))
+        outputs = outputs / outputs.sum(axis=-1, keepdims=True)
+    return outputs[:, positive_class]
+
+def band_statistics_model(input_shape=(64, 64, 3)):
+    """
+    Builds a cheap screening model: a logistic regression on the mean,
+    mean square and maximum of each band of the scaled tiles. It costs
+    a few operations per pixel, against millions for ResNet50, and is
+    trained with model.fit() on labelled tiles like any other model.
+
+    Parameters
+    ----------
+    input_shape : tuple of ints, optional
+        Shape of one tile. The default is (64, 64, 3).
+
+    Returns
+    -------
+    model : tf.keras.Model
+        Untrained model giving the probability of an HII Region,
+        shape (N, 1).
+
+    """
+    tiles = tf.keras.Input(shape=input_shape)
+    mean = tf.keras.layers.GlobalAveragePooling2D()(tiles)
+    square = tf.keras.layers.Multiply()([tiles, tiles])
+    mean_square = tf.keras.layers.GlobalAveragePooling2D()(square)
+    peak = tf.keras.layers.GlobalMaxPooling2D()(tiles)
+    features = tf.keras.layers.Concatenate()([mean, mean_square, peak])
+    outputs = tf.keras.layers.Dense(1, activation='sigmoid')(features)
+    return tf.keras.Model(inputs=tiles, outputs=outputs)
+
+def cascade_probabilities(screen, model, images, screen_threshold=0.1,
+                          positive_class=1, from_logits=False,
+                          screen_from_logits=False):
+    """
+    Probability of an HII Region per tile from a two stage cascade. The
+    screen runs on every tile, and only the tiles it gives at least
+    screen_threshold go on to the full model. The rejected tiles keep
+    the probability given by the screen, below screen_threshold, and
+    are left out of the catalog of classify_section().
+
+    Parameters
+    ----------
+    screen : tf.keras.Model
+        Cheap first stage, e.g. band_statistics_model() or happyModel.
+    model : tf.keras.Model
+        Full classifier, e.g. ResNet50.
+    images : ndarray of float32
+        Tiles of shape (N, H, W, bands).
+    screen_threshold : scalar, optional
+        Smallest screen probability sent to the full model. The
+        default is 0.1, tune it with cascade_report().
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The full model outputs logits. The default is False.
+    screen_from_logits : bool, optional
+        The screen outputs logits. The default is False.
+
+    Returns
+    -------
+    prob : ndarray of floats
+        Probability per tile, shape (N,).
+    full : ndarray of bools
+        Tiles classified by the full model.
+
+    """
+    prob = probabilities(screen.predict_on_batch(images), positive_class,
+                         screen_from_logits)
+    full = prob >= screen_threshold
+    if np.any(full):
+        prob[full] = probabilities(model.predict_on_batch(images[full]),
+                                   positive_class, from_logits)
+    return prob, full
+
+def write_candidates(catalog, gnames, centers, prob, threshold=0.0):
+    """
+    Appends the tiles of one batch to an open candidate catalog.
+
+    Parameters
+    ----------
+    catalog : file object
+        Catalog opened for writing, see classify_section().
+    gnames : list of strings
+        Names of the tiles.
+    centers : ndarray of floats
+        (RA, Dec) in degrees of each tile center, shape (N, 2).
+    prob : ndarray of floats
+        Probability per tile.
+    threshold : scalar, optional
+        Only tiles with at least this probability are written. The
+        default is 0.0, every tile.
+
+    Returns
+    -------
+    n : int
+        Number of tiles written.
+
+    """
+    keep = prob >= threshold
+    if not np.any(keep):
+        return 0
+    gal = SkyCoord(ra=centers[keep, 0], dec=centers[keep, 1], unit='deg',
+                   frame='icrs').galactic
+    n = 0
+    for gname,l,b,(ra,dec),p in zip(np.asarray(gnames)[keep], gal.l.deg,
+                                     gal.b.deg, centers[keep], prob[keep]):
+        catalog.write(f'{gname}\t{l:.4f}\t{b:.4f}\t{ra:.4f}\t{dec:.4f}\t{p:.6f}\n')
+        n += 1
+    return n
+
+def classify_section(model, section, config_location, outfile, batch_size=256,
+                     positive_class=1, from_logits=False, threshold=0.0,
+                     workers=4, screen=None, screen_threshold=0.1,
+                     screen_from_logits=False):
+    """
+    Classifies every tile of a section of config.ini with a trained
+    Keras model (e.g. ResNet50 or convolutional_model) and writes a
+    catalog with the probability of an HII Region per tile center.
+    The tiles are streamed through the model in batches, so memory
+    use does not grow with the size of the section. Given a screen,
+    the tiles are classified by cascade_probabilities() and only the
+    tiles the screen does not reject are run through the model and can
+    be written to the catalog.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained classifier taking (N, H, W, bands) tiles scaled to
+        [0, 1].
+    section : string
+        Specfic section of the config file to be used, determining
+        the grid of tile centers (e.g. Allskyparams).
+    config_location : string
+        Directory of the location of the config.ini file.
+    outfile : string
+        Tab separated catalog to create, with the columns gname,
+        glon, glat, ra, dec and probability.
+    batch_size : int, optional
+        Number of tiles per call to the model. The default is 256.
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The model outputs logits. The default is False.
+    threshold : scalar, optional
+        Only tiles with at least this probability are written, at
+        least screen_threshold given a screen. The default is 0.0,
+        every tile.
+    workers : int, optional
+        Number of downloads run at the same time. The default is 4.
+    screen : tf.keras.Model, optional
+        Cheap first stage model, e.g. band_statistics_model(), taking
+        tiles of the same size as model. The default is None, every
+        tile goes through model.
+    screen_threshold : scalar, optional
+        Smallest screen probability sent to model, at most threshold.
+        The default is 0.1.
+    screen_from_logits : bool, optional
+        The screen outputs logits. The default is False.
+
+    Raises
+    ------
+    ValueError
+        Raised when screen_threshold is above threshold given a
+        screen, the catalog would then miss tiles above threshold the
+        screen rejected.
+
+    Returns
+    -------
+    n_tiles : int
+        Number of tiles classified.
+    n_written : int
+        Number of tiles written to the catalog.
+
+    """
+    if screen is not None and threshold < screen_threshold:
+        raise ValueError(f'screen_threshold {screen_threshold} is above the'
+                         f' threshold {threshold} of the catalog')
+    clock = time.time()
+    image_size = tuple(model.input_shape[1:3])
+    n_tiles = 0
+    n_written = 0
+    n_full = 0
+    with open(outfile, 'w') as catalog:
+        catalog.write('gname\tglon\tglat\tra\tdec\tprobability\n')
+        for gnames,centers,images in tile_batches(section, config_location,
+                                                  batch_size, image_size,
+                                                  workers):
+            n_tiles += len(gnames)
+            if screen is None:
+                prob = probabilities(model.predict_on_batch(images),
+                                     positive_class, from_logits)
+                n_full += len(gnames)
+            else:
+                prob, full = cascade_probabilities(screen, model, images,
+                                                   screen_threshold,
+                                                   positive_class,
+                                                   from_logits,
+                                                   screen_from_logits)
+                n_full += int(np.sum(full))
+                # Only the tiles the full model saw are candidates
+                gnames, centers, prob = (np.asarray(gnames)[full],
+                                         centers[full], prob[full])
+            n_written += write_candidates(catalog, gnames, centers, prob,
+                                          threshold)
+    print('Classified',n_tiles,'tiles in',time.time() - clock,'s')
+    if screen is not None:
+        print('The screen rejected',n_tiles - n_full,'tiles,',
+              n_full,'went through the full model')
+    return n_tiles, n_written
+
+def cascade_report(screen, model, images, labels,
+                   thresholds=(0.01, 0.05, 0.1, 0.2, 0.5),
+                   positive_class=1, from_logits=False,
+                   screen_from_logits=False, decision=0.5, batch_size=256):
+    """
+    Measures the recall lost and the time saved by a cascade for
+    several screen thresholds, on labelled tiles not used to train
+    either model. The full model alone and the cascade at every
+    threshold are each run over the tiles in batches, as in
+    classify_section(), and timed end to end.
+
+    Parameters
+    ----------
+    screen : tf.keras.Model
+        Cheap first stage model.
+    model : tf.keras.Model
+        Full classifier.
+    images : ndarray of float32
+        Tiles of shape (N, H, W, bands).
+    labels : ndarray of ints
+        1 for the tiles with an HII Region, 0 otherwise.
+    thresholds : tuple of scalars, optional
+        Screen thresholds to try. The default is (0.01, 0.05, 0.1,
+        0.2, 0.5).
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The full model outputs logits. The default is False.
+    screen_from_logits : bool, optional
+        The screen outputs logits. The default is False.
+    decision : scalar, optional
+        Probability of the full model above which a tile counts as a
+        detection. The default is 0.5.
+    batch_size : int, optional
+        Number of tiles per call of the models. The default is 256.
+
+    Returns
+    -------
+    report : list of dicts
+        For each threshold, the 'threshold', the 'recall' of the full
+        model alone and of the 'cascade', the 'recall_loss' between
+        them, the fraction of full model inferences 'avoided' and the
+        measured 'speedup' of the cascade over the full model alone.
+
+    """
+    labels = np.asarray(labels).reshape(-1) == 1
+
+    def run(screen_threshold=None):
+        # Run twice, the second run is timed without the tracing of
+        # the first one
+        for repeat in range(2):
+            clock = time.perf_counter()
+            prob, full = [], []
+            for start in range(0, len(images), batch_size):
+                batch = images[start:start+batch_size]
+                if screen_threshold is None:
+                    prob.append(probabilities(model.predict_on_batch(batch),
+                                              positive_class, from_logits))
+                    full.append(np.ones(len(batch), dtype=bool))
+                else:
+                    p, f = cascade_probabilities(screen, model, batch,
+                                                 screen_threshold,
+                                                 positive_class, from_logits,
+                                                 screen_from_logits)
+                    prob.append(p)
+                    full.append(f)
+            seconds = time.perf_counter() - clock
+        return np.concatenate(prob), np.concatenate(full), seconds
+
+    full_prob, _, full_seconds = run()
+    recall = np.mean(full_prob[labels] >= decision)
+
+    report = []
+    for screen_threshold in thresholds:
+        # Only the tiles passing the screen can be detected, the full
+        # model decides on them
+        prob, passed, seconds = run(screen_threshold)
+        cascade = np.mean((passed & (prob >= decision))[labels])
+        avoided = 1 - np.mean(passed)
+        report.append({'threshold': screen_threshold,
+                       'recall': float(recall),
+                       'cascade': float(cascade),
+                       'recall_loss': float(recall - cascade),
+                       'avoided': float(avoided),
+                       'speedup': float(full_seconds/seconds)})
+    return report
+
+if __name__ == '__main__':
+# =============================================================================
+#     Classifies a section with a saved model, e.g.:
+#     python classifyregion.py 'D:/githubfiles/ASTR490/ml/config.ini' Allskyparams 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/candidates.tsv'
+#
+#     Where
+#
+#     str(sys.argv[1]) = 'D:/githubfiles/ASTR490/ml/config.ini'
+#     str(sys.argv[2]) = e.g. Allskyparams, baseparams, etc.
+#     str(sys.argv[3]) = trained Keras model saved with model.save()
+#     str(sys.argv[4]) = candidate catalog to create
+#
+#     Optionally followed by a screening model and its threshold to run
+#     as a cascade, e.g. 'D:/ASTR490/screen.h5' 0.1, the catalog then
+#     only has the tiles with at least that probability
+# =============================================================================
+
+    model = tf.keras.models.load_model(str(sys.argv[3]))
+    screen = None
+    screen_threshold = 0.1
+    if len(sys.argv) > 5:
+        screen = tf.keras.models.load_model(str(sys.argv[5]))
+    if len(sys.argv) > 6:
+        screen_threshold = float(sys.argv[6])
+    classify_section(model, str(sys.argv[2]), str(sys.argv[1]),
+                     str(sys.argv[4]),
+                     threshold=screen_threshold if screen is not None else 0.0,
+                     screen=screen, screen_threshold=screen_threshold)
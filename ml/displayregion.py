@@ -14,11 +14,22 @@ import astropy.units as u
 from astroquery.skyview import SkyView
 import matplotlib.pyplot as plt
 # from matplotlib.patches import Circle
+from astropy.io import fits
 from astropy.wcs import WCS
 from astropy.coordinates import SkyCoord
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 
+# Sections whose images are centred on the sources of a catalog rather
+# than on a grid of galactic coordinates
+CATALOG_SECTIONS = ('knownregion', 'SNRcatalog', 'PNecatalog')
+
+# SkyView client of each download thread, see _skyview()
+_skyview_clients = threading.local()
+
 def get_wise_catalog(db):
     """
     Returns a pandas dataframe containing relevant data from the 
@@ -110,6 +121,57 @@ def scale(data, vmin, vmax):
     data = data / np.nanmax(data)
     return data
 
+def load_catalog(db, section, catalog_cache=None):
+    """
+    Returns the source catalog used by a section of the config.ini
+    file. When a cache is given each file is only read once, so
+    several sections sharing a database do not re-read it.
+
+    Parameters
+    ----------
+    db : string
+        Filename to the HII Region/SNR/PNe database.
+    section : string
+        Section of the config.ini file that determines either PNe,
+        SNR, or HII Region catalog.
+    catalog_cache : dict, optional
+        Catalogs already read during this run, keyed by filename and
+        kind of catalog (SNR, PNe or WISE). The default is None,
+        which always reads the file.
+
+    Returns
+    -------
+    catalog : np.ndarray
+        Structured array containing at least the 'gname', 'ra' and
+        'dec' fields of the catalog.
+
+    """
+    # The same file is read differently by the SNR, PNe and WISE
+    # sections
+    kind = section if section in ('SNRcatalog', 'PNecatalog') else 'WISE'
+    if (catalog_cache is not None) and ((db, kind) in catalog_cache):
+        return catalog_cache[(db, kind)]
+
+    if section == 'SNRcatalog':
+        # Get the SNR catalog data
+        catalog = np.genfromtxt(db,skip_header=38,delimiter = ";",
+                                dtype=[('gname', '<U16'), ('ra', '<U16'),
+                                       ('dec', '<U16'),])
+
+    elif section == 'PNecatalog':
+        # Get the PNe catalog data
+        catalog = np.genfromtxt(db,skip_header=37,delimiter = ";",
+                                dtype=[('gname', '<U16'), ('ra', '<U16'),
+                                       ('dec', '<U16'),])
+
+    else:
+        # Get the WISE Catalog data
+        catalog = get_wise_catalog(db)
+
+    if catalog_cache is not None:
+        catalog_cache[(db, kind)] = catalog
+    return catalog
+
 def knownreg(db, outfile, catalogs, gname, imsize, section):
     """
     Returns a catalog of known HII Regions based off the names
@@ -137,7 +199,7 @@ def knownreg(db, outfile, catalogs, gname, imsize, section):
     Raises
     ------
     ValueError
-        Raised when the HII Region given isn't a part 
+        Raised when the HII Region given isn't a part
         of the known HII Regions or HII Region Candidates.
 
     Returns
@@ -145,93 +207,33 @@ def knownreg(db, outfile, catalogs, gname, imsize, section):
     None.
 
     """
-    if section == 'knownregion':
-        # Get the WISE Catalog data
-        catalog = get_wise_catalog(db)
-            
-    elif section == 'SNRcatalog':
-        # Get the SNR catalog data
-        catalog = np.genfromtxt(db,skip_header=38,delimiter = ";",
-                                dtype=[('gname', '<U16'), ('ra', '<U16'), 
-                                       ('dec', '<U16'),])
-    
-    elif section == 'PNecatalog':
-        # Get the PNe catalog data
-        catalog = np.genfromtxt(db,skip_header=37,delimiter = ";",
-                                dtype=[('gname', '<U16'), ('ra', '<U16'),
-                                       ('dec', '<U16'),])
-    
-    if gname == 'all':
-        names = catalog['gname']
-    elif len(gname.split(',')) > 1:
-        names = gname.split(',')
-    else:
-        names = [gname]
-    for name in names:
-         # Verify source is in the catalog (given that gname != 'all')
-        row = catalog[catalog["gname"] == name]
-        
-        # Since PNe catalog may have a space at the end of the source name,
-        # this will stop the code from crashing on the last source in a 
-        # given list
-        if len(name) == 0:
-            continue
-        rowra = row['ra'][0]
-        rowdec = row['dec'][0]
-        
-        if len(row) == 0:
-            raise ValueError(f"{gname} not found in catalog!")
-        
-        if (section == 'PNecatalog') or (section == 'SNRcatalog'):
-            coord = str(rowra)+' '+str(rowdec)
-            print(coord)
-            rowra, rowdec = getcoords(coord,framekwarg='icrs')
-        
-        # Get WISE infrared data
-        wise_3, wise_12, wise_22 = get_images(
-            name, rowra, rowdec, imsize, catalogs, outfile)
-        
-        # For failed download from get_images(), moves to next item 
-        # in list
-        if wise_3 == 'fail':
-            continue
-    
-        # Clip and scale infrared data
-        image_r = scale(wise_22.data, 10.0, 99.0)
-        image_g = scale(wise_12.data, 10.0, 99.5)
-        image_b = scale(wise_3.data, 10.0, 99.5)
-        image = np.stack([image_r, image_g, image_b], axis=-1)
-    
-        # Generate figure
-        fig = plt.figure()
-        wcs = WCS(wise_3.header).celestial
-        ax = plt.subplot(projection=wcs)
-        ax.imshow(image, origin="lower", interpolation="none")
-        ax.set_xlabel("RA (J2000)")
-        ax.set_ylabel("Declination (J2000)")
-# =============================================================================
-#       get pixel position of the WISE Catalog source
-#       xpos, ypos = wcs.wcs_world2pix(row["ra"], row["dec"], 1)
-#       radius = row["radius"] / 3600.0 / wise_3.header["CDELT2"]
-#       circle = Circle(
-#           (xpos, ypos), radius, fill=False,
-#           linestyle="dashed", color="yellow")
-#       ax.add_artist(circle)
-# =============================================================================
-        fig.savefig(outfile+name+'_wise.png', bbox_inches="tight")
-        plt.close(fig)
-    
-def get_images(gname, ra, dec, size, catalogs, outdir):
+    config = {'db': db, 'outputdir': outfile, 'imsize': imsize,
+              'gname': gname, 'catalogs': ','.join(catalogs)}
+    render_tiles([section_tiles(section, config)])
+
+def _skyview():
     """
-    Return the data in a given catalog (or catalogs) for a given sky
-    position. Automated version based off code originally created
-    by Trey Wenger.
+    SkyView client of the calling thread. Each thread has its own
+    cache directory, so clearing it after a failed download does not
+    delete the files other threads are downloading.
+    """
+    if not hasattr(_skyview_clients, 'client'):
+        client = SkyView()
+        client.cache_location = os.path.join(SkyView.cache_location,
+                                             f'thread{threading.get_ident()}')
+        _skyview_clients.client = client
+    return _skyview_clients.client
+
+def fetch_images(gname, ra, dec, size, catalogs):
+    """
+    Download the data in a given catalog (or catalogs) for a given
+    sky position without saving it. Automated version based off
+    code originally created by Trey Wenger.
 
     Parameters
     ----------
     gname : string
-        Source name. Images are saved to
-            f"{outdir}/{gname}_{catalog}.fits", etc..
+        Source name, only used to report a failed download.
     ra : scalar (deg)
         Cental sky position (J2000).
     dec : scalar (deg)
@@ -241,52 +243,133 @@ def get_images(gname, ra, dec, size, catalogs, outdir):
     catalogs : list of strings
         List of catalogs from which to pull the data from
         (e.g. WISE 3.4, WISE 12, etc.).
-    outdir : string
-        Directory where downloaded FITS images are saved.
 
     Returns
     -------
     list : list of strings or list of astropy.fits.HDU objects
-        Either a lis t of strings if the download from SkyView 
+        Either a list of strings if the download from SkyView
         fails or a list of FITS HDUs.
 
     """
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
-
     # SkyView occasionally fails, so we attempt multiple downloads
+    skyview = _skyview()
     success = False
     count = 0
     while not success:
         if count > 0:
             # Due to bug in astroquery.SkyView, a failed download is
             # cached and the cache directory must be deleted before
-            # a new attempt is made
-            shutil.rmtree(SkyView.cache_location)
-            os.mkdir(SkyView.cache_location)
+            # a new attempt is made. Only this thread's cache is
+            # deleted.
+            shutil.rmtree(skyview.cache_location, ignore_errors=True)
+            os.makedirs(skyview.cache_location, exist_ok=True)
         if count > 10:
             print(f"Exceeded download attempt limit for {gname}")
             return 'fail','fail','fail'
         try:
             hdus = []
-            for it,cat in enumerate(catalogs):
-                fname = os.path.join(outdir, f'{gname}_'+cat.split(' ')[0]+cat.split(' ')[1]+'.fits')
-                # Still dependent on the spaces in between eg WISE 22,
-                # will need to determine if this needs to be changed
-        
+            for cat in catalogs:
                 # attempt to acquire hdu of the given coordinates
                 # Each pixel is 4" across for WISE 22 micron
-                images = SkyView.get_images(
+                images = skyview.get_images(
                     position=f"{ra:.3f}, {dec:.3f}", coordinates="J2000",
                     pixels=900, width=size*u.deg, survey=cat)
                 hdus.append(images[0][0])
-                images[0][0].writeto(fname, overwrite=True)
 
             # success
             success = True
         except:
             count += 1
-            time.sleep(0.2)    
+            time.sleep(0.2)
+    return hdus
+
+def write_images(gname, hdus, catalogs, outdir):
+    """
+    Save the HDUs downloaded by fetch_images() as FITS files.
+
+    Parameters
+    ----------
+    gname : string
+        Source name. Images are saved to
+            f"{outdir}/{gname}_{catalog}.fits", etc..
+    hdus : list of astropy.fits.HDU objects
+        One HDU per catalog, in the same order as catalogs.
+    catalogs : list of strings
+        List of catalogs the HDUs were pulled from.
+    outdir : string
+        Directory where downloaded FITS images are saved.
+
+    Returns
+    -------
+    None.
+
+    """
+    os.makedirs(outdir, exist_ok=True)
+    for hdu,cat in zip(hdus,catalogs):
+        # Still dependent on the spaces in between eg WISE 22,
+        # will need to determine if this needs to be changed
+        fname = os.path.join(outdir, f'{gname}_'+cat.split(' ')[0]+cat.split(' ')[1]+'.fits')
+        hdu.writeto(fname, overwrite=True)
+
+def read_images(gname, catalogs, outdir):
+    """
+    Read back the FITS files saved by write_images() as HDUs.
+
+    Parameters
+    ----------
+    gname : string
+        Source name the images were saved under.
+    catalogs : list of strings
+        List of catalogs the HDUs were pulled from.
+    outdir : string
+        Directory of the FITS images.
+
+    Returns
+    -------
+    hdus : list of astropy.fits.HDU objects
+        One HDU per catalog, in the same order as catalogs.
+
+    """
+    hdus = []
+    for cat in catalogs:
+        fname = os.path.join(outdir, f'{gname}_'+cat.split(' ')[0]+cat.split(' ')[1]+'.fits')
+        data, header = fits.getdata(fname, header=True)
+        hdus.append(fits.PrimaryHDU(data, header))
+    return hdus
+
+def get_images(gname, ra, dec, size, catalogs, outdir):
+    """
+    Return the data in a given catalog (or catalogs) for a given sky
+    position. Automated version based off code originally created
+    by Trey Wenger.
+
+    Parameters
+    ----------
+    gname : string
+        Source name. Images are saved to
+            f"{outdir}/{gname}_{catalog}.fits", etc..
+    ra : scalar (deg)
+        Cental sky position (J2000).
+    dec : scalar (deg)
+        Cental sky position (J2000).
+    size : scalar (deg)
+        Image cutout size.
+    catalogs : list of strings
+        List of catalogs from which to pull the data from
+        (e.g. WISE 3.4, WISE 12, etc.).
+    outdir : string
+        Directory where downloaded FITS images are saved.
+
+    Returns
+    -------
+    list : list of strings or list of astropy.fits.HDU objects
+        Either a lis t of strings if the download from SkyView
+        fails or a list of FITS HDUs.
+
+    """
+    hdus = fetch_images(gname, ra, dec, size, catalogs)
+    if hdus[0] != 'fail':
+        write_images(gname, hdus, catalogs, outdir)
     return hdus
 
 def noregion(ra,dec,wise_catalog,imsize):
@@ -329,18 +412,446 @@ def noregion(ra,dec,wise_catalog,imsize):
         print('\nNo Regions in frame')
         return 'Good'
 
-def main(section,config_location):
+
+def section_tiles(section, config, catalog_cache=None):
     """
-    Generate a WISE infrared three-color catalog containing
-    WISE HII Regions.
+    Lists the images to be created for a section of the config.ini
+    file without downloading anything. The tiles are generated as
+    they are iterated over, so the first one is ready at once even
+    for the whole sky.
 
     Parameters
     ----------
     section : string
         Specfic section of the config file to be used, determining
         what catalog will be generated.
+    config : configparser.SectionProxy or dict
+        The parameters of that section.
+    catalog_cache : dict, optional
+        Catalogs already read during this run, passed on to
+        load_catalog(). The default is None.
+
+    Raises
+    ------
+    ValueError
+        Raised while iterating over tiles when a source name given
+        isn't a part of the catalog of the section.
+
+    Returns
+    -------
+    spec : dict
+        How the images of the section are saved: the output
+        directory, image size, catalogs, PNG suffix and the upper
+        clipping percentile of each color.
+    tiles : generator of tuples
+        The (gname, ra, dec) of the center of every image.
+
+    """
+    catalogs = config['catalogs'].split(',')
+    spec = {'section': section,
+            'outdir': config['outputdir'],
+            'imsize': float(config['imsize']),
+            'catalogs': catalogs}
+
+    # Creating the catalog of known HII Regions
+    if section in CATALOG_SECTIONS:
+        spec['png'] = '_wise.png'
+        spec['vmax'] = [99.0, 99.5, 99.5]
+        return spec, _catalog_tiles(section, config, catalog_cache)
+
+    spec['png'] = '_'+catalogs[0].split(' ')[0]+'.png'
+    spec['vmax'] = [95.0]*len(catalogs)
+    return spec, _grid_tiles(section, config, spec['imsize'], catalog_cache)
+
+def _catalog_tiles(section, config, catalog_cache=None):
+    """
+    Generates the (gname, ra, dec) of the sources of a catalog
+    section, see section_tiles().
+    """
+    catalog = load_catalog(config['db'], section, catalog_cache)
+
+    gname = config['gname']
+    if gname == 'all':
+        names = catalog['gname']
+    elif len(gname.split(',')) > 1:
+        names = gname.split(',')
+    else:
+        names = [gname]
+    for name in names:
+        # Since PNe catalog may have a space at the end of the source
+        # name, this will stop the code from crashing on the last
+        # source in a given list
+        if len(name) == 0:
+            continue
+
+        # Verify source is in the catalog (given that gname != 'all')
+        row = catalog[catalog["gname"] == name]
+        if len(row) == 0:
+            raise ValueError(f"{name} not found in catalog!")
+        rowra = row['ra'][0]
+        rowdec = row['dec'][0]
+
+        if (section == 'PNecatalog') or (section == 'SNRcatalog'):
+            coord = str(rowra)+' '+str(rowdec)
+            print(coord)
+            rowra, rowdec = getcoords(coord,framekwarg='icrs')
+        yield name, rowra, rowdec
+
+def _grid_tiles(section, config, imsize, catalog_cache=None):
+    """
+    Generates the (gname, ra, dec) of the images of a grid section,
+    see section_tiles().
+    """
+    dims = [imsize,imsize]
+    # Grabbing central coordinates of images of a set size of
+    # the entire Galaxy without checking what is in the images
+    if section == 'Allskyparams':
+        l_list = np.arange(0,360,dims[0])+dims[0]/2
+        b_list = np.arange(-90,90,dims[1])+dims[1]/2
+        ll,bb = np.meshgrid(l_list,b_list)
+        ls = ll.flatten()
+        bs = bb.flatten()
+        string = 'A'
+
+    # Grabbing central coordinates of images in a specific
+    # subsection of the Galaxy
+    elif (section == 'baseparams') or (section == 'noregion'):
+        upperglong = float(config['glongmax'])
+        lowerglong = float(config['glongmin'])
+        upperglat = float(config['glatmax'])
+        lowerglat = float(config['glatmin'])
+        l_list = np.arange(lowerglong,upperglong,dims[0])+dims[0]/2
+        b_list = np.arange(lowerglat,upperglat,dims[1])+dims[1]/2
+        ll,bb = np.meshgrid(l_list,b_list)
+        ls = ll.flatten()
+        bs = bb.flatten()
+
+        # Not checking what is in the images of this specfic
+        # subsection
+        if section == 'baseparams':
+            string = 'A'
+
+        # Verifying that there are no HII Regions in this specific
+        # subsection to create the catalog of non-HII Regions
+        else:
+            string = 'NR'
+            catalog = load_catalog(config['db'], section, catalog_cache)
+
+    # Grabbing central coordinates of images based on coordinates
+    # given in the config.ini file
+    elif section == 'coords':
+        ls = [config['glong']]
+        bs = [config['glat']]
+        string = 'NG'
+
+    # Stepping through each central coordinate from which an image
+    # will be created
+    for l,b in zip(ls,bs):
+        # convert galactic longitude and latitude to RA and Dec
+        radec = getcoords([l,b])
+
+        # determines if there are HII Regions in the bounds of the
+        # image and if so moves to the next item in list
+        if section == 'noregion':
+            ans = noregion(radec[0],radec[1],catalog,config['imsize'])
+            if ans == 'Regions':
+                continue
+
+        if float(b) >= 0:
+            gname = string+str(l)+'+'+str(b)
+        else:
+            gname = string+str(l)+str(b)
+        yield gname, radec[0], radec[1]
+
+def color_image(hdus, vmax):
+    """
+    Clip and scale the downloaded infrared data into the 3-color
+    image used for the PNG files, longest wavelength first.
+
+    Parameters
+    ----------
+    hdus : list of astropy.fits.HDU objects
+        One HDU per catalog, shortest wavelength first.
+    vmax : list of scalars
+        Maximum percentile for clipping each color, in the order
+        of the returned image (e.g. red, green, blue).
+
+    Returns
+    -------
+    image : ndarray of scalars
+        Clipped and scaled data of shape (H, W, len(hdus)).
+
+    """
+    frames = []
+    for hdu,cut in zip(hdus[::-1],vmax):
+        # Unused method of replacing the NaNs in data with a constant
+        # hdu.data = np.where(np.isnan(hdu.data),10000,hdu.data)
+        frames.append(scale(hdu.data, 10.0, cut))
+    return np.stack(frames, axis=-1)
+
+def save_tile(spec, gname, hdus, image=None):
+    """
+    Save the FITS files and the 3-color PNG of a single image.
+
+    Parameters
+    ----------
+    spec : dict
+        How the images of the section are saved, as returned by
+        section_tiles().
+    gname : string
+        Source name. Images are saved to
+            f"{outdir}/{gname}_{catalog}.fits", etc..
+    hdus : list of astropy.fits.HDU objects
+        One HDU per catalog, in the same order as the catalogs.
+    image : ndarray of scalars, optional
+        The 3-color image already returned by color_image(). The
+        default is None, which computes it.
+
+    Returns
+    -------
+    None.
+
+    """
+    write_images(gname, hdus, spec['catalogs'], spec['outdir'])
+    save_png(spec, gname, hdus, image)
+
+def save_png(spec, gname, hdus, image=None):
+    """
+    Save the 3-color PNG of a single image.
+
+    Parameters
+    ----------
+    spec : dict
+        How the images of the section are saved, as returned by
+        section_tiles().
+    gname : string
+        Source name. The image is saved to
+            f"{outdir}{gname}{spec['png']}".
+    hdus : list of astropy.fits.HDU objects
+        One HDU per catalog, in the same order as the catalogs.
+    image : ndarray of scalars, optional
+        The 3-color image already returned by color_image(). The
+        default is None, which computes it.
+
+    Returns
+    -------
+    None.
+
+    """
+    if image is None:
+        image = color_image(hdus, spec['vmax'])
+    os.makedirs(spec['outdir'], exist_ok=True)
+
+    # Generate figure
+    fig = plt.figure()
+    wcs = WCS(hdus[0].header).celestial
+    ax = plt.subplot(projection=wcs)
+    ax.imshow(image, origin="lower", interpolation="none")
+    ax.set_xlabel("RA (J2000)")
+    ax.set_ylabel("Declination (J2000)")
+# =============================================================================
+#   get pixel position of the WISE Catalog source
+#   xpos, ypos = wcs.wcs_world2pix(row["ra"], row["dec"], 1)
+#   radius = row["radius"] / 3600.0 / wise_3.header["CDELT2"]
+#   circle = Circle(
+#       (xpos, ypos), radius, fill=False,
+#       linestyle="dashed", color="yellow")
+#   ax.add_artist(circle)
+# =============================================================================
+    fig.savefig(spec['outdir']+gname+spec['png'], bbox_inches="tight")
+    plt.close(fig)
+
+def prefetch(jobs, func, workers=1, depth=None):
+    """
+    Lazily applies func to every job on a pool of threads, keeping
+    a bounded number of calls running ahead of the consumer.
+
+    Parameters
+    ----------
+    jobs : iterable
+        Arguments passed one at a time to func.
+    func : callable
+        Function run on the worker threads, usually a download.
+    workers : int, optional
+        Number of worker threads. The default is 1, which still
+        overlaps one call with the work done on the results.
+    depth : int, optional
+        Maximum number of calls queued or running at once. The
+        default is None, which uses twice the number of workers.
+
+    Yields
+    ------
+    job, result : tuple
+        Each job with the value func returned for it, in the order
+        of jobs.
+
+    """
+    if depth is None:
+        depth = 2*workers
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for job in jobs:
+                pending.append((job, pool.submit(func, job)))
+                if len(pending) >= depth:
+                    job, future = pending.popleft()
+                    yield job, future.result()
+            while pending:
+                job, future = pending.popleft()
+                yield job, future.result()
+        finally:
+            # The consumer stopped early, drop what has not started
+            for job, future in pending:
+                future.cancel()
+
+def render_tiles(sections, workers=1):
+    """
+    Download and save the images of one or more sections through a
+    single work queue. The tiles of the sections are read as the
+    downloads go, so the first download starts at once. An image
+    requested by several sections is only downloaded once and then
+    saved under each section's name: a request arriving while it is
+    being downloaded waits for it, a later one reads back the FITS
+    files already saved.
+
+    Parameters
+    ----------
+    sections : list of tuples
+        The (spec, tiles) of every section, as returned by
+        section_tiles().
+    workers : int, optional
+        Number of downloads run at the same time. The default is 1.
+
+    Returns
+    -------
+    None.
+
+    """
+    # Images being downloaded, by the SkyView query that produces
+    # them, and the first name each downloaded image was saved under
+    pending = {}
+    done = {}
+
+    def jobs():
+        for spec,tiles in sections:
+            for gname,ra,dec in tiles:
+                key = (f"{ra:.3f}, {dec:.3f}", spec['imsize'],
+                       tuple(spec['catalogs']))
+                if key in pending:
+                    pending[key][2].append((spec, gname))
+                elif key in done:
+                    # None for a failed download
+                    if done[key] is not None:
+                        first, name = done[key]
+                        save_tile(spec, gname,
+                                  read_images(name, first['catalogs'],
+                                              first['outdir']))
+                else:
+                    pending[key] = (ra, dec, [(spec, gname)])
+                    yield key
+
+    def fetch(key):
+        ra, dec, targets = pending[key]
+        return fetch_images(targets[0][1], ra, dec, key[1], list(key[2]))
+
+    for key, hdus in prefetch(jobs(), fetch, workers):
+        ra, dec, targets = pending.pop(key)
+        # For failed download from fetch_images(), moves to next item
+        # in list
+        if hdus[0] == 'fail':
+            done[key] = None
+            continue
+        for spec,gname in targets:
+            save_tile(spec, gname, hdus)
+        done[key] = targets[0]
+
+def iter_tiles(section, config_location, workers=1, depth=None,
+               scaled=True, vmax=None, fits=False, png=False):
+    """
+    Lazily yields the images of a section of the config.ini file as
+    arrays, straight from the download queue. Nothing is written to
+    disk unless asked for, and failed downloads are skipped.
+
+    Parameters
+    ----------
+    section : string
+        Specfic section of the config file to be used, determining
+        what tiles will be generated.
+    config_location : string
+        Directory of the location of the config.ini file.
+    workers : int, optional
+        Number of downloads run at the same time. The default is 1.
+    depth : int, optional
+        Maximum number of downloads kept ahead of the consumer. The
+        default is None, which uses twice the number of workers.
+    scaled : bool, optional
+        Clip and scale each band as for the PNG images. The default
+        is True, False returns the flux as downloaded.
+    vmax : list of scalars, optional
+        Maximum percentile for clipping each color when scaling. The
+        default is None, the one of the section (99-99.5 for the
+        catalog sections, 95 for the grid sections).
+    fits : bool, optional
+        Also save the FITS files of each image. The default is False.
+    png : bool, optional
+        Also save the 3-color PNG of each image. The default is False.
+
+    Yields
+    ------
+    gname : string
+        Name the image would be saved under.
+    center : tuple of floats
+        The (RA, Dec) in degrees (J2000) at the center of the image.
+    wcs : astropy.wcs.WCS
+        Celestial WCS of the image.
+    cube : ndarray of float32
+        Image of shape (H, W, bands), with the bands in the order
+        of the PNG colors (longest wavelength first).
+
+    """
+    config_object = ConfigParser()
+    config_object.read(config_location)
+    spec, tiles = section_tiles(section, config_object[section])
+    if vmax is not None:
+        spec['vmax'] = list(vmax)
+
+    def fetch(tile):
+        gname, ra, dec = tile
+        return fetch_images(gname, ra, dec, spec['imsize'], spec['catalogs'])
+
+    for (gname, ra, dec), hdus in prefetch(tiles, fetch, workers, depth):
+        if hdus[0] == 'fail':
+            continue
+        if scaled or png:
+            image = color_image(hdus, spec['vmax'])
+        if fits:
+            write_images(gname, hdus, spec['catalogs'], spec['outdir'])
+        if png:
+            save_png(spec, gname, hdus, image)
+        if scaled:
+            cube = image.astype(np.float32)
+        else:
+            cube = np.stack([hdu.data for hdu in hdus[::-1]],
+                            axis=-1).astype(np.float32)
+        yield gname, (ra, dec), WCS(hdus[0].header).celestial, cube
+
+def run_sections(sections, config_location, workers=1):
+    """
+    Generate the catalogs of several sections of the config.ini file
+    in one process. Each catalog file is read once and every image
+    of every section goes through the same download queue, while the
+    files written for each section are the same as running main()
+    on it alone.
+
+    Parameters
+    ----------
+    sections : list of strings
+        Sections of the config file to be used, e.g.
+        ['knownregion', 'noregion'].
     config_location : string
         Directory of the location of the config.ini file.
+    workers : int, optional
+        Number of downloads run at the same time. The default is 1.
 
     Returns
     -------
@@ -351,120 +862,50 @@ def main(section,config_location):
     clock = time.time()
     config_object = ConfigParser()
     config_object.read(config_location)
-    config = config_object[section]
-    dims = [float(config['imsize']),float(config['imsize'])]
-    catalogs = config['catalogs'].split(',')
-    
-    # Creating the catalog of known HII Regions
-    if (section == 'knownregion') or (section == 'PNecatalog') or (section == 'SNRcatalog'):
-        knownreg(config['db'], config['outputdir'], catalogs, config['gname'],
-                 config['imsize'], section)
-        
-    else:
-        # Grabbing central coordinates of images of a set size of 
-        # the entire Galaxy without checking what is in the images
-        if section == 'Allskyparams':
-            l_list = np.arange(0,360,dims[0])+dims[0]/2
-            b_list = np.arange(-90,90,dims[1])+dims[1]/2
-            ll,bb = np.meshgrid(l_list,b_list)
-            ls = ll.flatten()
-            bs = bb.flatten()
-            string = 'A'
-        
-        # Grabbing central coordinates of images in a specific 
-        # subsection of the Galaxy
-        elif (section == 'baseparams') or (section == 'noregion'):
-            upperglong = float(config['glongmax'])
-            lowerglong = float(config['glongmin'])
-            upperglat = float(config['glatmax'])
-            lowerglat = float(config['glatmin'])
-            l_list = np.arange(lowerglong,upperglong,dims[0])+dims[0]/2
-            b_list = np.arange(lowerglat,upperglat,dims[1])+dims[1]/2
-            ll,bb = np.meshgrid(l_list,b_list)
-            ls = ll.flatten()
-            bs = bb.flatten()
-            
-            # Not checking what is in the images of this specfic 
-            # subsection
-            if section == 'baseparams':
-                string = 'A'
-            
-            # Verifying that there are no HII Regions in this specific
-            # subsection to create the catalog of non-HII Regions
-            else:
-                string = 'NR'
-                catalog = get_wise_catalog(config['db'])
-        
-        # Grabbing central coordinates of images based on coordinates
-        # given in the config.ini file
-        elif section == 'coords':
-            ls = [config['glong']]
-            bs = [config['glat']]
-            string = 'NG'
-        
-        # Stepping through each central coordinate from which an image
-        # will be created
-        for it,(l,b) in enumerate(zip(ls,bs)):    
-            # convert galactic longitude and latitude to RA and Dec
-            radec = getcoords([l,b])
-            
-            # determines if there are HII Regions in the bounds of the
-            # image and if so moves to the next item in list
-            if section == 'noregion':
-                ans = noregion(radec[0],radec[1],catalog,config['imsize'])
-                if ans == 'Regions':
-                    continue
-                
-            # obtain the hdus for the given coordinates from 
-            # the given catalogs
-            if float(b) >= 0:
-                gname = string+str(l)+'+'+str(b)
-            else:
-                gname = string+str(l)+str(b)
-            hdu_list = get_images(
-            gname, radec[0], radec[1], dims[0], catalogs, config['outputdir'])
-            
-            # For failed download from get_images(), moves to next item 
-            # in list
-            if hdu_list[0] == 'fail':
-                continue
-        
-            # Clip and scale infrared data
-            frames = []
-            
-            for it,hdu in enumerate(hdu_list[::-1]):
-                # Unused method of replacing the NaNs in data with a constant
-                # hdu.data = np.where(np.isnan(hdu.data),10000,hdu.data)
-                
-                frames.append(scale(hdu.data, 10.0, 95.0))
-                
-                # Just a sanity check on which images contained NaNs.
-                # for num,i in enumerate(hdu.data[0]):
-                #     if np.isnan(i):
-                #         print('listnumber:',it,'index:',num)
-            image = np.stack(frames, axis=-1)
-        
-            # Generate figure
-            fig = plt.figure()
-            wcs = WCS(hdu_list[0].header).celestial
-            ax = plt.subplot(projection=wcs)
-            ax.imshow(image, origin="lower", interpolation="none")
-            ax.set_xlabel("RA (J2000)")
-            ax.set_ylabel("Declination (J2000)")
-            fig.savefig(config['outputdir']+gname+'_'+catalogs[0].split(' ')[0]+'.png',
-                        bbox_inches="tight")
-            plt.close(fig)
+    catalog_cache = {}
+    render_tiles([section_tiles(section, config_object[section],
+                                catalog_cache) for section in sections],
+                 workers)
     print('Elapsed time',time.time() - clock)
-    
+
+def main(section,config_location):
+    """
+    Generate a WISE infrared three-color catalog containing
+    WISE HII Regions.
+
+    Parameters
+    ----------
+    section : string
+        Specfic section of the config file to be used, determining
+        what catalog will be generated.
+    config_location : string
+        Directory of the location of the config.ini file.
+
+    Returns
+    -------
+    None.
+
+    """
+    run_sections([section], config_location)
+
 if __name__ == '__main__':
 # =============================================================================
 #     Code to run displayregion.py from author's database example:
 #     python displayregion.py 'D:/githubfiles/ASTR490/ml/config.ini' noregion
-# 
+#
 #     Where
-# 
+#
 #     str(sys.argv[1]) = 'D:/githubfiles/ASTR490/ml/config.ini'
-#     str(sys.argv[2]) = e.g. noregion, baseparams, etc. 
+#     str(sys.argv[2]) = e.g. noregion, baseparams, etc.
+#
+#     Several sections can be run together, sharing the catalogs and
+#     the download queue, by separating them with commas, optionally
+#     followed by the number of simultaneous downloads:
+#     python displayregion.py config.ini knownregion,noregion,SNRcatalog 4
 # =============================================================================
 
-    main(str(sys.argv[2]),str(sys.argv[1]))
\ No newline at end of file
+    if len(sys.argv) > 3:
+        run_sections(str(sys.argv[2]).split(','),str(sys.argv[1]),
+                     workers=int(sys.argv[3]))
+    else:
+        run_sections(str(sys.argv[2]).split(','),str(sys.argv[1]))
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Distills a trained ResNet50 into a small convolutional student, along
+the lines of convolutional_model, that scores tiles many times faster
+on CPU.
+"""
+
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from tiledataset import tile_dataset
+from quantizemodel import predicted_classes, images_per_second
+
+def student_model(input_shape=(64, 64, 3), classes=2, filters=(16, 32),
+                  units=64):
+    """
+    Builds a small classifier in the style of convolutional_model:
+    CONV2D -> RELU -> MAXPOOL -> CONV2D -> RELU -> MAXPOOL -> FLATTEN
+    -> DENSE -> RELU -> DENSE -> SOFTMAX. The softmax is a layer of
+    its own so distill() can train on the logits before it.
+
+    Parameters
+    ----------
+    input_shape : tuple of ints, optional
+        Shape of one tile. The default is (64, 64, 3).
+    classes : int, optional
+        Number of classes, the outputs of the teacher. The default
+        is 2.
+    filters : tuple of ints, optional
+        Filters of the two convolutions. The default is (16, 32).
+    units : int, optional
+        Units of the hidden Dense layer. The default is 64.
+
+    Returns
+    -------
+    model : tf.keras.Model
+        The untrained student, giving softmax probabilities.
+
+    """
+    input_img = tf.keras.Input(shape=input_shape)
+    X = tf.keras.layers.Conv2D(filters[0], (4, 4), padding='same')(input_img)
+    X = tf.keras.layers.ReLU()(X)
+    X = tf.keras.layers.MaxPool2D(pool_size=(4, 4), strides=(4, 4),
+                                  padding='same')(X)
+    X = tf.keras.layers.Conv2D(filters[1], (2, 2), padding='same')(X)
+    X = tf.keras.layers.ReLU()(X)
+    X = tf.keras.layers.MaxPool2D(pool_size=(4, 4), strides=(4, 4),
+                                  padding='same')(X)
+    X = tf.keras.layers.Flatten()(X)
+    X = tf.keras.layers.Dense(units, activation='relu')(X)
+    X = tf.keras.layers.Dense(classes, name='logits')(X)
+    outputs = tf.keras.layers.Activation('softmax')(X)
+    return tf.keras.Model(inputs=input_img, outputs=outputs)
+
+def _logits(model, from_logits=False):
+    """
+    Function giving the logits of a classifier, taken before its
+    softmax layer when it has one, or the log of its probabilities.
+    """
+    last = model.layers[-1]
+    if from_logits:
+        return model
+    if (isinstance(last, tf.keras.layers.Activation)
+            and last.get_config()['activation'] == 'softmax'):
+        return tf.keras.Model(model.inputs, last.input)
+    return lambda x, training=False: tf.math.log(model(x, training=training)
+                                                 + 1e-7)
+
+def distillation_loss(labels, student_logits, teacher_logits, temperature=4.0,
+                      alpha=0.1):
+    """
+    Loss of the student: alpha times the cross-entropy with the true
+    labels plus (1 - alpha) times the Kullback-Leibler divergence
+    between the teacher and student probabilities softened by
+    temperature, scaled by temperature**2 so its gradients do not
+    shrink as the temperature grows.
+
+    Parameters
+    ----------
+    labels : tensor of ints
+        True class of each tile, shape (N,).
+    student_logits : tensor of floats
+        Logits of the student, shape (N, classes).
+    teacher_logits : tensor of floats
+        Logits of the teacher, shape (N, classes).
+    temperature : scalar, optional
+        Softening of both distributions. The default is 4.0.
+    alpha : scalar, optional
+        Weight of the true labels. The default is 0.1.
+
+    Returns
+    -------
+    loss : scalar tensor
+        Mean loss over the batch.
+
+    """
+    hard = tf.keras.losses.sparse_categorical_crossentropy(
+        labels, student_logits, from_logits=True)
+    teacher_log_prob = tf.nn.log_softmax(teacher_logits/temperature)
+    student_log_prob = tf.nn.log_softmax(student_logits/temperature)
+    soft = tf.reduce_sum(tf.exp(teacher_log_prob)
+                         *(teacher_log_prob - student_log_prob), axis=-1)
+    return tf.reduce_mean(alpha*hard + (1 - alpha)*temperature**2*soft)
+
+def distill(teacher, student, dataset, epochs=10, temperature=4.0, alpha=0.1,
+            teacher_from_logits=False, optimizer=None, validation_data=None):
+    """
+    Trains the student on the softened outputs of the teacher over a
+    tile dataset. The teacher only runs forward, in inference mode.
+
+    Parameters
+    ----------
+    teacher : tf.keras.Model
+        Trained classifier, e.g. ResNet50 from W2A1.
+    student : tf.keras.Model
+        Classifier to train, e.g. from student_model(), with as many
+        outputs as the teacher.
+    dataset : tf.data.Dataset
+        Batches of (images, integer labels), e.g. from
+        tiledataset.tile_dataset().
+    epochs : int, optional
+        Number of passes over dataset. The default is 10.
+    temperature : scalar, optional
+        Softening of the teacher and student outputs. The default is
+        4.0.
+    alpha : scalar, optional
+        Weight of the true labels against the teacher. The default
+        is 0.1.
+    teacher_from_logits : bool, optional
+        The teacher outputs logits rather than softmax probabilities.
+        The default is False.
+    optimizer : tf.keras.optimizers.Optimizer, optional
+        Optimizer of the student. The default is None, Adam with a
+        learning rate of 0.001.
+    validation_data : tuple of ndarrays, optional
+        (images, labels) on which the accuracy of the student and its
+        agreement with the teacher are printed after every epoch. The
+        default is None.
+
+    Returns
+    -------
+    history : dict
+        Lists of the mean 'loss' of every epoch, and of the
+        'val_accuracy' and 'val_agreement' when validation_data is
+        given.
+
+    """
+    optimizer = optimizer or tf.keras.optimizers.Adam(learning_rate=0.001)
+    teacher_logits = _logits(teacher, teacher_from_logits)
+    student_logits = _logits(student)
+
+    @tf.function(reduce_retracing=True)
+    def train_step(images, labels):
+        targets = teacher_logits(images, training=False)
+        with tf.GradientTape() as tape:
+            loss = distillation_loss(labels, student_logits(images, training=True),
+                                     targets, temperature, alpha)
+        gradients = tape.gradient(loss, student.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, student.trainable_variables))
+        return loss
+
+    # Batches of a single class mean the dataset is grouped by source,
+    # the student would then train on long runs of one label
+    for batch,label in dataset.take(1):
+        if len(np.unique(label.numpy())) < 2:
+            print('Warning: the first batch holds a single class, shuffle'
+                  ' the dataset across sources')
+
+    history = {'loss': []}
+    if validation_data is not None:
+        images, labels = validation_data
+        teacher_classes = predicted_classes(teacher.predict(images, verbose=0))
+        history['val_accuracy'] = []
+        history['val_agreement'] = []
+    for epoch in range(epochs):
+        clock = time.time()
+        losses = []
+        for batch,label in dataset:
+            labels_batch = tf.reshape(tf.cast(label, tf.int32), (-1,))
+            losses.append(float(train_step(batch, labels_batch)))
+        history['loss'].append(float(np.mean(losses)))
+        message = f'Epoch {epoch+1}/{epochs} loss {history["loss"][-1]:.4f}'
+        if validation_data is not None:
+            classes = predicted_classes(student.predict(images, verbose=0))
+            history['val_accuracy'].append(float(np.mean(classes == labels)))
+            history['val_agreement'].append(float(np.mean(classes
+                                                          == teacher_classes)))
+            message += (f' val_accuracy {history["val_accuracy"][-1]:.4f}'
+                        f' val_agreement {history["val_agreement"][-1]:.4f}')
+        print(message, f'({time.time() - clock:.1f} s)')
+    return history
+
+def training_split(sources, batch_size=64, image_size=(64, 64), shards=10,
+                   seed=0):
+    """
+    Splits the tiles into a training dataset and a held out set the
+    student is compared to the teacher on. The split is made of whole
+    shards of tile_dataset(), so no tile is in both. The training tiles
+    are drawn one at a time from random shards and then batched, so
+    every batch mixes the sources even when a shard only holds chunks
+    of one of them.
+
+    Parameters
+    ----------
+    sources : list of tuples
+        (path, label) pairs of FITS directories or HDF5 tile stores,
+        as taken by tiledataset.tile_dataset().
+    batch_size : int, optional
+        Number of tiles per training batch. The default is 64.
+    image_size : tuple of ints, optional
+        (H, W) the tiles are resized to. The default is (64, 64).
+    shards : int, optional
+        The tiles are split into this many shards, one of which is
+        held out. The default is 10.
+    seed : int, optional
+        Seed of the shuffle. The default is 0.
+
+    Returns
+    -------
+    dataset : tf.data.Dataset
+        Shuffled batches of (images, labels) of the training shards.
+    images : ndarray of float32
+        Held out tiles of shape (N, H, W, bands).
+    labels : ndarray of ints
+        Label of each held out tile.
+
+    """
+    dataset = tf.data.Dataset.sample_from_datasets(
+        [tile_dataset(sources, batch_size, image_size, seed=seed+k,
+                      num_shards=shards, shard_index=k).unbatch()
+         for k in range(1, shards)], seed=seed)
+    dataset = dataset.batch(batch_size).prefetch(tf.data.experimental.AUTOTUNE)
+    images, labels = [], []
+    for batch,label in tile_dataset(sources, 256, image_size, shuffle=False,
+                                    num_shards=shards, shard_index=0):
+        images.append(batch.numpy())
+        labels.append(label.numpy())
+    return dataset, np.concatenate(images), np.concatenate(labels)
+
+def distillation_report(teacher, student, images, labels, batch_size=256,
+                        repeat=3):
+    """
+    Compares the student to its teacher on a set of labelled tiles
+    not used for training.
+
+    Parameters
+    ----------
+    teacher : tf.keras.Model
+        The teacher.
+    student : tf.keras.Model
+        The trained student.
+    images : ndarray of float32
+        Tiles of shape (N, H, W, bands).
+    labels : ndarray of ints
+        Label of each tile.
+    batch_size : int, optional
+        Number of tiles per call of the models, as in
+        classifyregion.py. The default is 256.
+    repeat : int, optional
+        Number of timed runs. The default is 3.
+
+    Returns
+    -------
+    report : dict
+        Accuracy of both models, the fraction of tiles on which the
+        student agrees with the teacher, the tiles per second of both
+        models and the speedup of the student.
+
+    """
+    images = np.asarray(images, dtype=np.float32)
+    labels = np.asarray(labels).reshape(-1)
+
+    def batched(model):
+        spec = tf.TensorSpec((None,)+images.shape[1:], tf.float32)
+        call = tf.function(lambda x: model(x, training=False),
+                           input_signature=[spec])
+        return lambda x: np.concatenate([call(x[start:start+batch_size]).numpy()
+                                         for start in range(0, len(x), batch_size)])
+
+    teacher_predict = batched(teacher)
+    student_predict = batched(student)
+    teacher_classes = predicted_classes(teacher_predict(images))
+    student_classes = predicted_classes(student_predict(images))
+    report = {'teacher_accuracy': float(np.mean(teacher_classes == labels)),
+              'student_accuracy': float(np.mean(student_classes == labels)),
+              'agreement': float(np.mean(student_classes == teacher_classes)),
+              'teacher_images_per_second': images_per_second(teacher_predict,
+                                                              images, repeat),
+              'student_images_per_second': images_per_second(student_predict,
+                                                              images, repeat)}
+    report['speedup'] = (report['student_images_per_second']
+                         / report['teacher_images_per_second'])
+    return report
+
+if __name__ == '__main__':
+# =============================================================================
+#     Distills a saved ResNet50 into a student on generated tiles, e.g.:
+#     python distillmodel.py 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/student.h5' 'D:/ASTR490/knownregion.h5' 'D:/ASTR490/noregion.h5' 20
+#
+#     Where
+#
+#     str(sys.argv[1]) = trained teacher saved with model.save()
+#     str(sys.argv[2]) = file to save the student to
+#     str(sys.argv[3]) = tiles with HII Regions (label 1), HDF5 tile
+#                        store or FITS directory
+#     str(sys.argv[4]) = tiles without HII Regions (label 0)
+#     int(sys.argv[5]) = number of epochs, 10 if not given
+# =============================================================================
+
+    teacher = tf.keras.models.load_model(str(sys.argv[1]))
+    sources = [(str(sys.argv[3]), 1), (str(sys.argv[4]), 0)]
+    epochs = int(sys.argv[5]) if len(sys.argv) > 5 else 10
+    image_size = tuple(teacher.input_shape[1:3])
+    student = student_model(teacher.input_shape[1:], teacher.output_shape[-1])
+    dataset, images, labels = training_split(sources, image_size=image_size)
+    distill(teacher, student, dataset, epochs=epochs,
+            validation_data=(images, labels))
+    student.save(str(sys.argv[2]))
+    report = distillation_report(teacher, student, images, labels)
+    for key in report:
+        print(key, report[key])
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Builds an index of the embeddings of sky tiles given by a frozen
+backbone, and finds the tiles most similar to a known HII Region,
+SNR or PN anywhere on the sky.
+"""
+
+import os
+import sys
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from classifyregion import tile_batches
+from tiledataset import read_fits_tile
+
+def embedding_model(model):
+    """
+    Frozen backbone giving one embedding per tile: a classifier (e.g.
+    ResNet50) cut before its Flatten or GlobalAveragePooling2D head,
+    or a base model without top (e.g. the MobileNetV2 base_model of
+    W2A2) followed by a global average pooling.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained classifier or base model.
+
+    Returns
+    -------
+    embedder : tf.keras.Model
+        Model giving (N, dim) embeddings.
+
+    """
+    if len(model.output_shape) == 4:
+        X = tf.keras.layers.GlobalAveragePooling2D()(model.output)
+        return tf.keras.Model(model.input, X)
+    head = [layer for layer in model.layers
+            if isinstance(layer, (tf.keras.layers.Flatten,
+                                  tf.keras.layers.GlobalAveragePooling2D))]
+    if not head:
+        raise ValueError(f'{model.name} has no Flatten or '
+                         'GlobalAveragePooling2D layer to cut at')
+    X = head[-1].output
+    return tf.keras.Model(model.input, X)
+
+def embed(embedder, images, batch_size=256):
+    """
+    Embeddings of tiles, normalized to unit length so the dot product
+    of two embeddings is their cosine similarity.
+
+    Parameters
+    ----------
+    embedder : tf.keras.Model
+        Model returned by embedding_model().
+    images : ndarray of float32
+        Tiles of shape (N, H, W, bands).
+    batch_size : int, optional
+        Number of tiles per call of the model. The default is 256.
+
+    Returns
+    -------
+    ndarray of float32
+        Embeddings of shape (N, dim).
+
+    """
+    images = np.asarray(images, dtype=np.float32)
+    outputs = np.concatenate([embedder(images[start:start+batch_size],
+                                       training=False).numpy()
+                              for start in range(0, len(images), batch_size)])
+    outputs = outputs.reshape(len(images), -1)
+    norm = np.linalg.norm(outputs, axis=1, keepdims=True)
+    return outputs/np.maximum(norm, 1e-12)
+
+def build_index(embedder, batches, directory, reduced_dim=64,
+                sample_size=10000, seed=0):
+    """
+    Writes the embeddings of every tile to an index directory:
+    embeddings.f16, a float16 matrix of one row per tile read back
+    as a memory map, tiles.tsv with the name and center of every
+    row, and index.json. A projection of the embeddings on their
+    reduced_dim principal components is stored as well, for the
+    approximate search of EmbeddingIndex.
+
+    Parameters
+    ----------
+    embedder : tf.keras.Model
+        Model returned by embedding_model().
+    batches : iterable
+        Yields (gnames, centers, images) batches, e.g.
+        classifyregion.tile_batches() of a section.
+    directory : string
+        Directory of the index, created if needed.
+    reduced_dim : int, optional
+        Number of principal components of the approximate search,
+        0 for none. The default is 64.
+    sample_size : int, optional
+        Number of embeddings the principal components are computed
+        from. The default is 10000.
+    seed : int, optional
+        Seed of the sample. The default is 0.
+
+    Returns
+    -------
+    n : int
+        Number of tiles in the index.
+
+    """
+    clock = time.time()
+    os.makedirs(directory, exist_ok=True)
+    n = 0
+    dim = embedder.output_shape[-1]
+    with open(os.path.join(directory, 'embeddings.f16'), 'wb') as matrix, \
+         open(os.path.join(directory, 'tiles.tsv'), 'w') as tiles:
+        tiles.write('gname\tra\tdec\n')
+        for gnames,centers,images in batches:
+            embeddings = embed(embedder, images)
+            matrix.write(embeddings.astype(np.float16).tobytes())
+            for gname,(ra,dec) in zip(gnames, centers):
+                tiles.write(f'{gname}\t{ra:.6f}\t{dec:.6f}\n')
+            n += len(gnames)
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+        json.dump({'n': n, 'dim': dim,
+                   'image_size': list(embedder.input_shape[1:3])}, f)
+
+    if reduced_dim and n > 0:
+        # Principal components of a sample, the embeddings are already
+        # unit length so they are not standardized
+        embeddings = np.memmap(os.path.join(directory, 'embeddings.f16'),
+                               dtype=np.float16, mode='r', shape=(n, dim))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, sample_size), replace=False))
+        _, _, vt = np.linalg.svd(np.asarray(embeddings[sample], dtype=np.float32),
+                                 full_matrices=False)
+        projection = vt[:reduced_dim].T.astype(np.float32)
+        np.save(os.path.join(directory, 'projection.npy'), projection)
+        reduced = np.lib.format.open_memmap(
+            os.path.join(directory, 'reduced.npy'), mode='w+',
+            dtype=np.float16, shape=(n, projection.shape[1]))
+        for start in range(0, n, 65536):
+            block = np.asarray(embeddings[start:start+65536], dtype=np.float32)
+            reduced[start:start+65536] = block @ projection
+        reduced.flush()
+    print('Indexed',n,'tiles in',time.time() - clock,'s')
+    return n
+
+def _top_k(scores, k):
+    """
+    Indices of the k largest scores of every row, largest first.
+    """
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k-1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1,
+                       kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+class EmbeddingIndex:
+    """
+    Answers top-k similarity queries over an index written by
+    build_index(). The float16 embeddings are memory mapped, so the
+    index is not read into memory, and queries are answered in blocks
+    of rows with one matrix product per block for all the queries.
+    The approximate search only scores the projected embeddings, kept
+    in memory, and reads a few hundred rows of the full embeddings per
+    query, which takes milliseconds where the exact search reads the
+    whole matrix.
+
+    Parameters
+    ----------
+    directory : string
+        Directory of the index.
+    block_size : int, optional
+        Number of rows scored at a time. The default is 16384.
+
+    """
+
+    def __init__(self, directory, block_size=16384):
+        with open(os.path.join(directory, 'index.json')) as f:
+            info = json.load(f)
+        self.n = info['n']
+        self.dim = info['dim']
+        self.image_size = tuple(info['image_size'])
+        self.block_size = block_size
+        if self.n == 0:
+            # An empty file cannot be memory mapped
+            self.embeddings = np.zeros((0, self.dim), dtype=np.float16)
+        else:
+            self.embeddings = np.memmap(os.path.join(directory,
+                                                     'embeddings.f16'),
+                                        dtype=np.float16, mode='r',
+                                        shape=(self.n, self.dim))
+        self.gnames = []
+        centers = []
+        with open(os.path.join(directory, 'tiles.tsv')) as tiles:
+            next(tiles)
+            for line in tiles:
+                gname, ra, dec = line.rstrip('\n').split('\t')
+                self.gnames.append(gname)
+                centers.append((float(ra), float(dec)))
+        self.centers = np.array(centers).reshape(-1, 2)
+        self.projection = None
+        if os.path.exists(os.path.join(directory, 'projection.npy')):
+            self.projection = np.load(os.path.join(directory, 'projection.npy'))
+            # The projected embeddings are small, they are kept in memory
+            self.reduced = np.load(os.path.join(directory,
+                                                'reduced.npy')).astype(np.float32)
+
+    def __len__(self):
+        return self.n
+
+    def _search(self, matrix, queries, k):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(matrix), self.block_size):
+            block = np.asarray(matrix[start:start+self.block_size],
+                               dtype=np.float32)
+            # Keep the best k so far together with the scores of the block
+            scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+            index = np.concatenate([best, np.broadcast_to(
+                np.arange(start, start + len(block)),
+                (len(queries), len(block)))], axis=1)
+            top = _top_k(scores, k)
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best = np.take_along_axis(index, top, axis=1)
+        return best, best_scores
+
+    def search(self, queries, k=10, approximate=False, candidates=None):
+        """
+        Tiles most similar to each query embedding.
+
+        Parameters
+        ----------
+        queries : ndarray of floats
+            Embeddings from embed(), shape (Q, dim) or (dim,).
+        k : int, optional
+            Number of tiles returned per query. The default is 10.
+        approximate : bool, optional
+            First score every tile on the principal components of the
+            embeddings, then rescore the best candidates exactly. The
+            default is False, every tile is scored exactly.
+        candidates : int, optional
+            Number of tiles rescored per query by the approximate
+            search. The default is None, 20 times k.
+
+        Returns
+        -------
+        indices : ndarray of ints
+            Rows of the most similar tiles, shape (Q, k), most similar
+            first.
+        scores : ndarray of float32
+            Their cosine similarity to the query, shape (Q, k).
+
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not approximate or self.projection is None:
+            return self._search(self.embeddings, queries, k)
+        candidates = max(candidates or 20*k, k)
+        rows, _ = self._search(self.reduced, queries @ self.projection,
+                               candidates)
+        indices, scores = [], []
+        for query,row in zip(queries, rows):
+            row = np.sort(row)
+            exact = np.asarray(self.embeddings[row], dtype=np.float32) @ query
+            top = _top_k(exact[np.newaxis], k)[0]
+            indices.append(row[top])
+            scores.append(exact[top])
+        return np.array(indices), np.array(scores)
+
+    def results(self, indices, scores):
+        """
+        (gname, ra, dec, similarity) of the tiles returned by search()
+        for one query.
+        """
+        return [(self.gnames[i], self.centers[i, 0], self.centers[i, 1],
+                 float(s)) for i,s in zip(indices, scores)]
+
+def similar_tiles(index, embedder, image, k=10, approximate=False):
+    """
+    The k tiles of the index most similar to one image, e.g. a known
+    HII Region, SNR or PN rendered by displayregion.knownreg().
+
+    Parameters
+    ----------
+    index : EmbeddingIndex
+        The index to search.
+    embedder : tf.keras.Model
+        The model the index was built with.
+    image : ndarray of float32
+        Scaled image of shape (H, W, bands), resized to the input size
+        of embedder.
+    k : int, optional
+        Number of tiles returned. The default is 10.
+    approximate : bool, optional
+        Use the approximate search. The default is False.
+
+    Returns
+    -------
+    list of tuples
+        (gname, ra, dec, similarity) of the k tiles, most similar
+        first.
+
+    """
+    image = tf.image.resize(image, index.image_size).numpy()
+    indices, scores = index.search(embed(embedder, image[np.newaxis]), k,
+                                   approximate)
+    return index.results(indices[0], scores[0])
+
+if __name__ == '__main__':
+# =============================================================================
+#     Indexes every tile of a section with a saved model, e.g.:
+#     python embeddingindex.py build 'D:/githubfiles/ASTR490/ml/config.ini' Allskyparams 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/allsky_index'
+#
+#     or finds the tiles most similar to a known source rendered by
+#     knownreg() into a directory of FITS files, e.g.:
+#     python embeddingindex.py query 'D:/ASTR490/allsky_index' 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/Catalog/' G297.626-00.771 20
+#
+#     Where for build
+#
+#     str(sys.argv[2]) = 'D:/githubfiles/ASTR490/ml/config.ini'
+#     str(sys.argv[3]) = e.g. Allskyparams, baseparams, etc.
+#     str(sys.argv[4]) = trained Keras model saved with model.save()
+#     str(sys.argv[5]) = directory of the index to create
+#
+#     and for query
+#
+#     str(sys.argv[2]) = directory of the index
+#     str(sys.argv[3]) = the model the index was built with
+#     str(sys.argv[4]) = directory of the FITS files of the source
+#     str(sys.argv[5]) = gname of the source
+#     int(sys.argv[6]) = number of tiles returned, 10 if not given
+# =============================================================================
+
+    if str(sys.argv[1]) == 'build':
+        embedder = embedding_model(tf.keras.models.load_model(str(sys.argv[4])))
+        build_index(embedder,
+                    tile_batches(str(sys.argv[3]), str(sys.argv[2]),
+                                 image_size=tuple(embedder.input_shape[1:3])),
+                    str(sys.argv[5]))
+    else:
+        index = EmbeddingIndex(str(sys.argv[2]))
+        embedder = embedding_model(tf.keras.models.load_model(str(sys.argv[3])))
+        k = int(sys.argv[6]) if len(sys.argv) > 6 else 10
+        image = read_fits_tile(str(sys.argv[4]), str(sys.argv[5]))
+        for gname,ra,dec,similarity in similar_tiles(index, embedder, image, k):
+            print(f'{gname}\t{ra:.4f}\t{dec:.4f}\t{similarity:.4f}')
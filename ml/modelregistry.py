@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Keeps trained models as SavedModels with serving signatures traced
+for fixed tile shapes, so inference scripts load them without
+rebuilding the model in Python or tracing it again.
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+def _version_directory(registry, name, version=None):
+    """
+    Directory of a version of a registered model, the latest one if
+    version is None.
+    """
+    directory = os.path.join(registry, name)
+    if version is None:
+        versions = [int(v) for v in os.listdir(directory) if v.isdigit()]
+        if not versions:
+            raise ValueError(f'No version of {name} in {registry}')
+        version = max(versions)
+    return os.path.join(directory, str(version))
+
+def register_model(model, registry, name, batch_sizes=(), description=''):
+    """
+    Saves a trained Keras model as a new version in the registry. The
+    model is exported as a SavedModel with a 'serve' signature traced
+    once for batches of any size of tiles of the model input shape,
+    in inference mode, and one 'serve_<batch size>' signature per
+    fixed batch size. The Keras model is kept next to it as
+    model.keras for further training.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained classifier, e.g. ResNet50, convolutional_model or
+        alpaca_model.
+    registry : string
+        Directory of the registry, created if needed.
+    name : string
+        Name of the model in the registry, e.g. 'resnet50'.
+    batch_sizes : tuple of ints, optional
+        Batch sizes given a signature of their own, e.g. (256,) for
+        classifyregion.py. The default is (), only the signature
+        for any batch size.
+    description : string, optional
+        Free text kept with the model. The default is ''.
+
+    Returns
+    -------
+    directory : string
+        Directory of the new version, registry/name/version.
+
+    """
+    os.makedirs(os.path.join(registry, name), exist_ok=True)
+    versions = [int(v) for v in os.listdir(os.path.join(registry, name))
+                if v.isdigit()]
+    version = max(versions, default=0) + 1
+    directory = os.path.join(registry, name, str(version))
+    os.makedirs(directory)
+
+    input_shape = tuple(model.input_shape[1:])
+    archive = tf.keras.export.ExportArchive()
+    archive.track(model)
+    archive.add_endpoint(name='serve',
+                         fn=lambda x: model(x, training=False),
+                         input_signature=[tf.TensorSpec((None,)+input_shape,
+                                                        tf.float32)])
+    for batch_size in batch_sizes:
+        archive.add_endpoint(name=f'serve_{batch_size}',
+                             fn=lambda x: model(x, training=False),
+                             input_signature=[tf.TensorSpec((batch_size,)
+                                                            + input_shape,
+                                                            tf.float32)])
+    archive.write_out(os.path.join(directory, 'saved_model'), verbose=False)
+    model.save(os.path.join(directory, 'model.keras'))
+    with open(os.path.join(directory, 'model.json'), 'w') as f:
+        json.dump({'name': name, 'version': version,
+                   'input_shape': list(input_shape),
+                   'output_shape': list(model.output_shape[1:]),
+                   'batch_sizes': list(batch_sizes),
+                   'description': description,
+                   'created': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=2)
+    return directory
+
+def list_models(registry):
+    """
+    Information of every version of every model in the registry.
+    """
+    models = []
+    for name in sorted(os.listdir(registry)):
+        if not os.path.isdir(os.path.join(registry, name)):
+            continue
+        for version in sorted((v for v in os.listdir(os.path.join(registry, name))
+                               if v.isdigit()), key=int):
+            with open(os.path.join(registry, name, version, 'model.json')) as f:
+                models.append(json.load(f))
+    return models
+
+class ServingModel:
+    """
+    A registered model loaded from its SavedModel, without Keras. It
+    has the predict_on_batch() and input_shape of a Keras model, so
+    it can replace one in classifyregion.py and the other scripts.
+
+    Parameters
+    ----------
+    directory : string
+        Directory of a version of a registered model.
+    warm : bool, optional
+        Run a batch of zeros through the signatures when loading, so
+        the graph optimization of the first call is not paid by the
+        first real batch. This moves the cost rather than removing
+        it, so it suits long running processes whose first request
+        should be fast rather than short jobs. The default is False.
+
+    """
+
+    def __init__(self, directory, warm=False):
+        with open(os.path.join(directory, 'model.json')) as f:
+            self.info = json.load(f)
+        self.input_shape = (None,) + tuple(self.info['input_shape'])
+        self.output_shape = (None,) + tuple(self.info['output_shape'])
+        self.batch_sizes = self.info['batch_sizes']
+        self.saved_model = tf.saved_model.load(os.path.join(directory,
+                                                            'saved_model'))
+        self.signatures = {batch_size: getattr(self.saved_model,
+                                               f'serve_{batch_size}')
+                           for batch_size in self.batch_sizes}
+        if warm:
+            self.warm_up()
+
+    def warm_up(self):
+        """
+        Runs a batch of zeros through the signature of every fixed
+        batch size, or through the one for any batch size if there
+        are none.
+        """
+        if not self.signatures:
+            self.saved_model.serve(np.zeros((1,)+self.input_shape[1:],
+                                            dtype=np.float32))
+        for batch_size,signature in self.signatures.items():
+            signature(np.zeros((batch_size,)+self.input_shape[1:],
+                               dtype=np.float32))
+
+    def predict_on_batch(self, images):
+        """
+        Model outputs for a batch of tiles, as a numpy array. Batches
+        of one of the registered batch sizes use their own signature.
+        """
+        images = np.asarray(images, dtype=np.float32)
+        signature = self.signatures.get(len(images), self.saved_model.serve)
+        return signature(images).numpy()
+
+    __call__ = predict_on_batch
+
+def load_model(registry, name, version=None, warm=False):
+    """
+    Loads a registered model for inference.
+
+    Parameters
+    ----------
+    registry : string
+        Directory of the registry.
+    name : string
+        Name of the model.
+    version : int, optional
+        Version to load. The default is None, the latest.
+    warm : bool, optional
+        Warm the model up when loading, see ServingModel. The default
+        is False.
+
+    Returns
+    -------
+    ServingModel
+        The loaded model.
+
+    """
+    return ServingModel(_version_directory(registry, name, version), warm)
+
+def _time_startup(kind, directory, batch_size):
+    """
+    Times the loading of a registered model and its first and second
+    batch, in a fresh process started by startup_report().
+    """
+    clock = time.perf_counter()
+    images = np.random.default_rng(0).random(
+        (batch_size,) + tuple(json.load(open(os.path.join(directory,
+                                                          'model.json')))['input_shape']),
+        dtype=np.float32)
+    if kind == 'keras':
+        model = tf.keras.models.load_model(os.path.join(directory,
+                                                        'model.keras'))
+    else:
+        model = ServingModel(directory, warm=(kind == 'warm'))
+    load = time.perf_counter() - clock
+    clock = time.perf_counter()
+    model.predict_on_batch(images)
+    first = time.perf_counter() - clock
+    clock = time.perf_counter()
+    model.predict_on_batch(images)
+    second = time.perf_counter() - clock
+    print(json.dumps({'load': load, 'first_batch': first,
+                      'second_batch': second}))
+
+def startup_report(registry, name, version=None, batch_size=64):
+    """
+    Measures how long a short job takes to get its first results from
+    a registered model. Each way of loading runs in a fresh Python
+    process, so nothing is already imported, traced or cached.
+
+    Parameters
+    ----------
+    registry : string
+        Directory of the registry.
+    name : string
+        Name of the model.
+    version : int, optional
+        Version to time. The default is None, the latest.
+    batch_size : int, optional
+        Number of tiles of the timed batches. The default is 64.
+
+    Returns
+    -------
+    report : dict
+        For 'keras' (tf.keras.models.load_model of model.keras),
+        'cold' (the SavedModel without warm-up) and 'warm' (the
+        SavedModel warmed up when loading), the seconds of the
+        'load', of the 'first_batch', of the 'second_batch' and
+        their 'startup', load plus first batch.
+
+    """
+    directory = _version_directory(registry, name, version)
+    report = {}
+    for kind in ('keras', 'cold', 'warm'):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                 '_time', kind, directory, str(batch_size)],
+                                capture_output=True, text=True, check=True)
+        report[kind] = json.loads(output.stdout.strip().splitlines()[-1])
+        report[kind]['startup'] = (report[kind]['load']
+                                   + report[kind]['first_batch'])
+    return report
+
+if __name__ == '__main__':
+# =============================================================================
+#     Registers a trained model, e.g.:
+#     python modelregistry.py register 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/registry' resnet50 256
+#
+#     or reports the load and first batch times of a registered model:
+#     python modelregistry.py report 'D:/ASTR490/registry' resnet50
+#
+#     Where for register
+#
+#     str(sys.argv[2]) = trained Keras model saved with model.save()
+#     str(sys.argv[3]) = directory of the registry
+#     str(sys.argv[4]) = name of the model in the registry
+#     int(sys.argv[5:]) = batch sizes given their own signature
+#
+#     and for report
+#
+#     str(sys.argv[2]) = directory of the registry
+#     str(sys.argv[3]) = name of the model in the registry
+# =============================================================================
+
+    if str(sys.argv[1]) == 'register':
+        model = tf.keras.models.load_model(str(sys.argv[2]))
+        print(register_model(model, str(sys.argv[3]), str(sys.argv[4]),
+                             tuple(int(b) for b in sys.argv[5:])))
+    elif str(sys.argv[1]) == 'report':
+        report = startup_report(str(sys.argv[2]), str(sys.argv[3]))
+        for kind in report:
+            print(kind, ' '.join(f'{key} {value:.2f} s'
+                                 for key,value in report[kind].items()))
+    elif str(sys.argv[1]) == '_time':
+        _time_startup(str(sys.argv[2]), str(sys.argv[3]), int(sys.argv[4]))
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Converts a trained classifier into a fully convolutional network that
+runs once over a large mosaic, giving a dense map of the probability
+of an HII Region, and turns the peaks of the map into a catalog of
+candidates.
+"""
+
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+from displayregion import color_image
+from classifyregion import probabilities
+
+def _head(model):
+    """
+    Index of the Flatten or GlobalAveragePooling2D layer starting the
+    classification head of model, and the layers after it.
+    """
+    layers = model.layers
+    index = max(i for i,layer in enumerate(layers)
+                if isinstance(layer, (tf.keras.layers.Flatten,
+                                      tf.keras.layers.GlobalAveragePooling2D)))
+    for layer in layers[index+1:]:
+        if not isinstance(layer, (tf.keras.layers.Dense,
+                                  tf.keras.layers.Dropout,
+                                  tf.keras.layers.Activation)):
+            raise ValueError(f'Cannot convert the {layer.__class__.__name__} '
+                             f'layer {layer.name} of the head to a convolution')
+    return index, layers[index+1:]
+
+def fully_convolutional(model):
+    """
+    Converts a classifier ending in Flatten (ResNet50,
+    convolutional_model) or GlobalAveragePooling2D (alpaca_model) and
+    Dense layers into an equivalent fully convolutional network
+    accepting images of any size.
+
+    The first Dense layer becomes a convolution with a kernel the
+    size of the features of one tile, the following ones 1x1
+    convolutions, and a global average pooling becomes an average
+    pooling over the features of one tile. A pooling layer right
+    before Flatten is made to stride 1 and the convolution after it
+    dilated to match, so it does not coarsen the map. On a tile of
+    the input size of model the network gives a 1x1 map equal to the
+    output of model, and on a larger image one output per window,
+    every stride pixels.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained classifier taking (N, H, W, bands) tiles.
+
+    Returns
+    -------
+    fcn : tf.keras.Model
+        Fully convolutional network taking (N, any, any, bands)
+        images and giving (N, rows, cols, outputs) maps.
+
+    """
+    index, head = _head(model)
+    flatten = model.layers[index]
+    features = flatten.input
+    h, w = features.shape[1:3]
+
+    # Rebuild the layers before the head for inputs of any size
+    trunk = tf.keras.Model(model.inputs, features)
+    config = trunk.get_config()
+    dilation = (1, 1)
+    for layer in config['layers']:
+        if layer['class_name'] == 'InputLayer':
+            shape = layer['config']['batch_shape']
+            layer['config']['batch_shape'] = (None, None, None, shape[-1])
+    last = trunk.layers[-1]
+    if (isinstance(flatten, tf.keras.layers.Flatten)
+            and isinstance(last, (tf.keras.layers.AveragePooling2D,
+                                  tf.keras.layers.MaxPooling2D))
+            and last.padding == 'valid'):
+        dilation = tuple(last.strides)
+        for layer in config['layers']:
+            if layer['config']['name'] == last.name:
+                layer['config']['strides'] = (1, 1)
+    fcn_trunk = tf.keras.Model.from_config(config)
+    for layer in trunk.layers:
+        fcn_trunk.get_layer(layer.name).set_weights(layer.get_weights())
+
+    inputs = tf.keras.Input(shape=(None, None, model.input_shape[-1]))
+    X = fcn_trunk(inputs)
+    if isinstance(flatten, tf.keras.layers.GlobalAveragePooling2D):
+        X = tf.keras.layers.AveragePooling2D(pool_size=(h, w), strides=1)(X)
+        kernel_size = (1, 1)
+    else:
+        kernel_size = (h, w)
+    convolutions = []
+    for layer in head:
+        if isinstance(layer, tf.keras.layers.Dense):
+            kernel, bias = layer.get_weights()
+            conv = tf.keras.layers.Conv2D(layer.units, kernel_size,
+                                          dilation_rate=dilation,
+                                          activation=layer.activation,
+                                          name=layer.name)
+            X = conv(X)
+            convolutions.append((conv, kernel.reshape(kernel_size
+                                                      + (-1, layer.units)), bias))
+            kernel_size = (1, 1)
+            dilation = (1, 1)
+        else:
+            X = layer.__class__.from_config(layer.get_config())(X)
+    fcn = tf.keras.Model(inputs, X)
+    for conv,kernel,bias in convolutions:
+        conv.set_weights([kernel, bias])
+    return fcn
+
+def map_stride(fcn, tile_size):
+    """
+    Number of input pixels between neighbouring outputs of a fully
+    convolutional network, found from the size of its output on a
+    large image.
+    """
+    size = 64*tile_size
+    bands = fcn.input_shape[-1]
+    small = fcn.compute_output_shape((1, tile_size, tile_size, bands))[1]
+    large = fcn.compute_output_shape((1, tile_size+size, tile_size+size,
+                                      bands))[1]
+    return int(round(size/(large - small)))
+
+def conversion_error(model, fcn, images):
+    """
+    Largest difference between the outputs of model and of the fully
+    convolutional network on tiles of the model input size.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    expected = model(images, training=False).numpy()
+    outputs = fcn(images, training=False).numpy()
+    return float(np.max(np.abs(expected - outputs.reshape(expected.shape))))
+
+def read_mosaic(files, vmax=(95.0, 95.0, 95.0)):
+    """
+    Reads a mosaic made of one FITS file per band into a clipped and
+    scaled image, as displayregion.py does for its tiles.
+
+    Parameters
+    ----------
+    files : list of strings
+        FITS files of the mosaic on the same pixel grid, shortest
+        wavelength first (e.g. WISE 3.4, 12 and 22 micron).
+    vmax : tuple of scalars, optional
+        Maximum percentile for clipping each color, longest
+        wavelength first. The default is 95 for every color, as used
+        for the grid sections.
+
+    Returns
+    -------
+    image : ndarray of float32
+        Image of shape (H, W, bands), longest wavelength first, with
+        blank pixels set to 0.
+    wcs : astropy.wcs.WCS
+        Celestial WCS of the mosaic.
+
+    """
+    hdus = [fits.open(f)[0] for f in files]
+    image = np.nan_to_num(color_image(hdus, vmax).astype(np.float32))
+    return image, WCS(hdus[0].header).celestial
+
+def probability_map(fcn, image, tile_size, scale=1.0, positive_class=1,
+                    from_logits=False, block_size=None, margin=4):
+    """
+    Runs a fully convolutional network once over an image and returns
+    the probability of an HII Region of every window of the input
+    size of the original model, every stride pixels. The convolutions
+    of neighbouring windows are shared instead of repeated for every
+    overlapping tile. A window sees the mosaic around it where a lone
+    tile is padded with zeros, so the map is close to, but not the
+    same as, classifying each window as a separate tile.
+
+    Parameters
+    ----------
+    fcn : tf.keras.Model
+        Network returned by fully_convolutional().
+    image : ndarray of float32
+        Mosaic of shape (H, W, bands), scaled like the training tiles.
+    tile_size : int
+        Input size of the original model in pixels, e.g. 64.
+    scale : scalar, optional
+        Resize factor bringing the mosaic to the pixel scale of the
+        tiles the model was trained on, see mosaic_scale(). The
+        default is 1.0, no resizing.
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The model outputs logits. The default is False.
+    block_size : int, optional
+        Number of map pixels per side of the blocks the image is run
+        in, limiting memory use on very large mosaics. The default is
+        None, the whole image at once.
+    margin : int, optional
+        Map pixels of context added around every block, so windows at
+        the edge of a block see the same neighbourhood as in a run
+        over the whole image. The default is 4.
+
+    Returns
+    -------
+    prob : ndarray of floats
+        Probability map of shape (rows, cols). prob[i, j] is the
+        probability of the window whose top left pixel is
+        (i*stride, j*stride) in the resized image.
+    stride : int
+        Pixels of the resized image between neighbouring windows.
+
+    """
+    stride = map_stride(fcn, tile_size)
+    if scale != 1.0:
+        size = (int(round(image.shape[0]*scale)),
+                int(round(image.shape[1]*scale)))
+        image = tf.image.resize(image, size).numpy()
+
+    # Pad to a whole number of strides, covering the whole image
+    rows = max(int(np.ceil((image.shape[0] - tile_size)/stride)), 0) + 1
+    cols = max(int(np.ceil((image.shape[1] - tile_size)/stride)), 0) + 1
+    padded = np.zeros(((rows-1)*stride + tile_size,
+                       (cols-1)*stride + tile_size, image.shape[2]),
+                      dtype=np.float32)
+    padded[:image.shape[0], :image.shape[1]] = image
+
+    block_size = block_size or max(rows, cols)
+    call = tf.function(lambda x: fcn(x, training=False), reduce_retracing=True)
+    prob = np.zeros((rows, cols))
+    for i in range(0, rows, block_size):
+        for j in range(0, cols, block_size):
+            n = min(block_size, rows - i)
+            m = min(block_size, cols - j)
+            # Each block is run with margin extra windows of context on
+            # every side, which are dropped from its output
+            top, left = max(i - margin, 0), max(j - margin, 0)
+            bottom = min(i + n + margin, rows)
+            right = min(j + m + margin, cols)
+            block = padded[top*stride:(bottom-1)*stride + tile_size,
+                           left*stride:(right-1)*stride + tile_size]
+            outputs = call(block[np.newaxis]).numpy()[0, i-top:i-top+n,
+                                                      j-left:j-left+m]
+            prob[i:i+n, j:j+m] = probabilities(
+                outputs.reshape(n*m, -1), positive_class,
+                from_logits).reshape(n, m)
+    return prob, stride
+
+def mosaic_scale(wcs, tile_size, tile_degrees=0.5):
+    """
+    Resize factor bringing a mosaic to the pixel scale of the training
+    tiles, tile_degrees across resized to tile_size pixels.
+    """
+    degrees_per_pixel = np.mean(proj_plane_pixel_scales(wcs))
+    return tile_size*degrees_per_pixel/tile_degrees
+
+def find_peaks(prob, threshold=0.5, radius=1):
+    """
+    Local maxima of a probability map.
+
+    Parameters
+    ----------
+    prob : ndarray of floats
+        Probability map of shape (rows, cols).
+    threshold : scalar, optional
+        Smallest probability of a peak. The default is 0.5.
+    radius : int, optional
+        A peak is the largest value within radius map pixels. The
+        default is 1.
+
+    Returns
+    -------
+    rows : ndarray of ints
+        Map row of each peak.
+    cols : ndarray of ints
+        Map column of each peak.
+
+    """
+    size = 2*radius + 1
+    local = tf.nn.max_pool2d(prob[np.newaxis, ..., np.newaxis], size, 1,
+                             'SAME').numpy()[0, ..., 0]
+    return np.nonzero((prob >= local) & (prob >= threshold))
+
+def peak_catalog(prob, wcs, stride, tile_size, scale=1.0, threshold=0.5,
+                 radius=1, outfile=None):
+    """
+    Turns the peaks of a probability map into a catalog of HII Region
+    candidates at the center of their window.
+
+    Parameters
+    ----------
+    prob : ndarray of floats
+        Map returned by probability_map().
+    wcs : astropy.wcs.WCS
+        Celestial WCS of the mosaic before resizing.
+    stride : int
+        Stride returned by probability_map().
+    tile_size : int
+        Input size of the original model in pixels.
+    scale : scalar, optional
+        Resize factor given to probability_map(). The default is 1.0.
+    threshold : scalar, optional
+        Smallest probability of a candidate. The default is 0.5.
+    radius : int, optional
+        Map pixels within which a candidate is the most probable. The
+        default is 1.
+    outfile : string, optional
+        Tab separated catalog to create, with the columns gname,
+        glon, glat, ra, dec, probability and the x, y pixel of the
+        mosaic. The default is None, nothing is written.
+
+    Returns
+    -------
+    candidates : list of tuples
+        (gname, glon, glat, ra, dec, probability, x, y) of every
+        candidate, most probable first.
+
+    """
+    rows, cols = find_peaks(prob, threshold, radius)
+    order = np.argsort(-prob[rows, cols], kind='stable')
+    rows, cols = rows[order], cols[order]
+    # Window centers in the pixels of the mosaic before resizing
+    x = (cols*stride + tile_size/2)/scale - 0.5
+    y = (rows*stride + tile_size/2)/scale - 0.5
+    sky = wcs.pixel_to_world(x, y)
+    icrs = sky.icrs
+    gal = sky.galactic
+    candidates = []
+    for l,b,ra,dec,p,px,py in zip(np.atleast_1d(gal.l.deg),
+                                  np.atleast_1d(gal.b.deg),
+                                  np.atleast_1d(icrs.ra.deg),
+                                  np.atleast_1d(icrs.dec.deg),
+                                  prob[rows, cols], x, y):
+        gname = f'C{l:.3f}{b:+.3f}'
+        candidates.append((gname, l, b, ra, dec, p, px, py))
+    if outfile is not None:
+        with open(outfile, 'w') as catalog:
+            catalog.write('gname\tglon\tglat\tra\tdec\tprobability\tx\ty\n')
+            for gname,l,b,ra,dec,p,px,py in candidates:
+                catalog.write(f'{gname}\t{l:.4f}\t{b:.4f}\t{ra:.4f}\t'
+                              f'{dec:.4f}\t{p:.6f}\t{px:.1f}\t{py:.1f}\n')
+    return candidates
+
+def map_mosaic(model, files, outfile, tile_degrees=0.5, threshold=0.5,
+               radius=1, positive_class=1, from_logits=False,
+               vmax=(95.0, 95.0, 95.0), block_size=None):
+    """
+    Finds HII Region candidates in a mosaic with a trained classifier
+    run once over the whole mosaic, instead of once per overlapping
+    tile.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained classifier (e.g. ResNet50 or convolutional_model).
+    files : list of strings
+        FITS files of the mosaic, one per band, shortest wavelength
+        first.
+    outfile : string
+        Tab separated candidate catalog to create.
+    tile_degrees : scalar, optional
+        Size in degrees of the tiles the model was trained on, imsize
+        in config.ini. The default is 0.5.
+    threshold : scalar, optional
+        Smallest probability of a candidate. The default is 0.5.
+    radius : int, optional
+        Map pixels within which a candidate is the most probable. The
+        default is 1.
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The model outputs logits. The default is False.
+    vmax : tuple of scalars, optional
+        Maximum percentile for clipping each color. The default is
+        95 for every color.
+    block_size : int, optional
+        Map pixels per side of the blocks the mosaic is run in, see
+        probability_map(). The default is None, the whole mosaic.
+
+    Returns
+    -------
+    prob : ndarray of floats
+        The probability map.
+    candidates : list of tuples
+        The candidates written to outfile.
+
+    """
+    clock = time.time()
+    tile_size = model.input_shape[1]
+    fcn = fully_convolutional(model)
+    image, wcs = read_mosaic(files, vmax)
+    scale = mosaic_scale(wcs, tile_size, tile_degrees)
+    prob, stride = probability_map(fcn, image, tile_size, scale,
+                                   positive_class, from_logits, block_size)
+    candidates = peak_catalog(prob, wcs, stride, tile_size, scale, threshold,
+                              radius, outfile)
+    print('Mapped',prob.size,'windows and found',len(candidates),
+          'candidates in',time.time() - clock,'s')
+    return prob, candidates
+
+if __name__ == '__main__':
+# =============================================================================
+#     Maps a mosaic with a saved model, e.g.:
+#     python probabilitymap.py 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/mosaic_candidates.tsv' 'D:/ASTR490/mosaic_WISE3.4.fits' 'D:/ASTR490/mosaic_WISE12.fits' 'D:/ASTR490/mosaic_WISE22.fits'
+#
+#     Where
+#
+#     str(sys.argv[1]) = trained Keras model saved with model.save()
+#     str(sys.argv[2]) = candidate catalog to create
+#     str(sys.argv[3:]) = FITS files of the mosaic, one per band,
+#                         shortest wavelength first
+# =============================================================================
+
+    model = tf.keras.models.load_model(str(sys.argv[1]))
+    map_mosaic(model, [str(f) for f in sys.argv[3:]], str(sys.argv[2]))
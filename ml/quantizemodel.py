@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Exports a trained classifier (ResNet50, convolutional_model,
+alpaca_model) to an int8 quantized TFLite model for CPU-only
+scoring, and compares it to the float Keras model.
+"""
+
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from tiledataset import tile_dataset
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    Interpreter = tf.lite.Interpreter
+
+def sample_tiles(sources, n=1000, image_size=(64, 64), seed=0):
+    """
+    Draws a random sample of labelled tiles, used to calibrate the
+    quantization and to compare the quantized model to the float one.
+    An equal share of the tiles is drawn from every source and the
+    sample is shuffled, so any part of it, e.g. the first few hundred
+    tiles used for calibration, holds every class.
+
+    Parameters
+    ----------
+    sources : list of tuples
+        (path, label) pairs of FITS directories or HDF5 tile stores,
+        as taken by tiledataset.tile_dataset().
+    n : int, optional
+        Number of tiles to draw. The default is 1000.
+    image_size : tuple of ints, optional
+        (H, W) the tiles are resized to, the input size of the model.
+        The default is (64, 64).
+    seed : int, optional
+        Seed of the shuffle. The default is 0.
+
+    Returns
+    -------
+    images : ndarray of float32
+        Tiles of shape (n, H, W, bands), fewer if a source has less
+        than its share.
+    labels : ndarray of ints
+        Label of each tile.
+
+    """
+    images, labels = [], []
+    for it,source in enumerate(sources):
+        share = n//len(sources) + (it < n % len(sources))
+        if share == 0:
+            continue
+        dataset = tile_dataset([source], batch_size=min(share, 256),
+                               image_size=image_size, shuffle=True,
+                               seed=seed+it)
+        count = 0
+        for batch,label in dataset:
+            images.append(batch.numpy()[:share-count])
+            labels.append(label.numpy()[:share-count])
+            count += len(images[-1])
+            if count >= share:
+                break
+    order = np.random.default_rng(seed).permutation(sum(len(x) for x in labels))
+    return np.concatenate(images)[order], np.concatenate(labels)[order]
+
+def quantize_model(model, calibration, filename=None):
+    """
+    Converts a Keras model to a fully int8 quantized TFLite model,
+    with int8 weights, activations, inputs and outputs. The range of
+    every activation is calibrated on a representative sample of
+    tiles.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained classifier, e.g. ResNet50, convolutional_model or
+        alpaca_model.
+    calibration : ndarray of float32
+        Representative tiles of shape (N, H, W, bands), a few hundred
+        are enough.
+    filename : string, optional
+        .tflite file to write the model to. The default is None, the
+        model is only returned.
+
+    Returns
+    -------
+    tflite_model : bytes
+        The quantized model.
+
+    """
+    calibration = np.asarray(calibration, dtype=np.float32)
+
+    def representative_dataset():
+        for tile in calibration:
+            yield [tile[np.newaxis]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    tflite_model = converter.convert()
+    if filename is not None:
+        with open(filename, 'wb') as f:
+            f.write(tflite_model)
+    return tflite_model
+
+class TFLitePredictor:
+    """
+    Runs a TFLite model on batches of tiles. The interpreter is sized
+    for batch_size tiles once, the float tiles are quantized to the
+    input scale of the model and the outputs are converted back to
+    floats, so it can replace model.predict_on_batch().
+
+    Parameters
+    ----------
+    tflite_model : bytes or string
+        Model returned by quantize_model(), or the path of a .tflite
+        file.
+    batch_size : int, optional
+        Number of tiles per call of the interpreter. The default is
+        64.
+    num_threads : int, optional
+        Number of CPU threads of the interpreter. The default is None,
+        chosen by TFLite.
+
+    """
+
+    def __init__(self, tflite_model, batch_size=64, num_threads=None):
+        if isinstance(tflite_model, bytes):
+            self.interpreter = Interpreter(model_content=tflite_model,
+                                           num_threads=num_threads)
+        else:
+            self.interpreter = Interpreter(model_path=tflite_model,
+                                           num_threads=num_threads)
+        self.batch_size = batch_size
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self.input['shape'][1:])
+        self.interpreter.resize_tensor_input(self.input['index'],
+                                             (batch_size,)+self.input_shape)
+        self.interpreter.allocate_tensors()
+        self.buffer = np.zeros((batch_size,)+self.input_shape,
+                               dtype=self.input['dtype'])
+
+    def _quantize(self, images):
+        scale, zero_point = self.input['quantization']
+        if scale == 0:
+            return images
+        info = np.iinfo(self.input['dtype'])
+        return np.clip(np.round(images/scale + zero_point), info.min, info.max)
+
+    def _dequantize(self, outputs):
+        scale, zero_point = self.output['quantization']
+        if scale == 0:
+            return outputs.astype(np.float32)
+        return (outputs.astype(np.float32) - zero_point)*scale
+
+    def predict(self, images):
+        """
+        Model outputs for any number of tiles.
+
+        Parameters
+        ----------
+        images : ndarray of floats
+            Tiles of shape (N, H, W, bands).
+
+        Returns
+        -------
+        outputs : ndarray of float32
+            Dequantized model outputs, shape (N, outputs).
+
+        """
+        outputs = []
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start+self.batch_size]
+            # The last batch is padded, the interpreter has a fixed size
+            self.buffer[:len(batch)] = self._quantize(batch)
+            self.buffer[len(batch):] = 0
+            self.interpreter.set_tensor(self.input['index'], self.buffer)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output['index'])
+            outputs.append(self._dequantize(output[:len(batch)]))
+        return np.concatenate(outputs)
+
+    __call__ = predict
+
+def predicted_classes(outputs, from_logits=False):
+    """
+    Class predicted for each tile from the model outputs, thresholding
+    a single sigmoid or logit output (happyModel, alpaca_model) at 0.5
+    and taking the largest softmax output otherwise (ResNet50,
+    convolutional_model).
+
+    Parameters
+    ----------
+    outputs : ndarray of floats
+        Model outputs of shape (N, outputs).
+    from_logits : bool, optional
+        A single output is a logit rather than a probability. The
+        default is False.
+
+    Returns
+    -------
+    ndarray of ints
+        Predicted class per tile, shape (N,).
+
+    """
+    outputs = np.asarray(outputs)
+    if outputs.ndim == 1 or outputs.shape[-1] == 1:
+        outputs = outputs.reshape(-1)
+        return (outputs >= (0.0 if from_logits else 0.5)).astype(int)
+    return outputs.argmax(axis=-1)
+
+def images_per_second(predict, images, repeat=3):
+    """
+    Best throughput of predict(images) in tiles per second over
+    repeat runs, after a warm-up run.
+    """
+    predict(images)
+    best = np.inf
+    for it in range(repeat):
+        clock = time.perf_counter()
+        predict(images)
+        best = min(best, time.perf_counter() - clock)
+    return len(images)/best
+
+def quantization_report(model, predictor, images, labels, from_logits=False,
+                        batch_size=64, repeat=3):
+    """
+    Compares the quantized model to the float Keras model on a set of
+    labelled tiles.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        The float model.
+    predictor : TFLitePredictor
+        The quantized model.
+    images : ndarray of float32
+        Tiles of shape (N, H, W, bands), not used for calibration.
+    labels : ndarray of ints
+        Label of each tile.
+    from_logits : bool, optional
+        A single model output is a logit. The default is False.
+    batch_size : int, optional
+        Number of tiles per call of the Keras model. The default is
+        64, use the batch size of the predictor.
+    repeat : int, optional
+        Number of timed runs. The default is 3.
+
+    Returns
+    -------
+    report : dict
+        Accuracy of both models and its change, the fraction of tiles
+        on which they agree, the largest output difference and the
+        tiles per second of both models.
+
+    """
+    images = np.asarray(images, dtype=np.float32)
+    labels = np.asarray(labels).reshape(-1)
+    spec = tf.TensorSpec((None,)+images.shape[1:], tf.float32)
+    call = tf.function(lambda x: model(x, training=False),
+                       input_signature=[spec])
+
+    def keras_predict(images):
+        return np.concatenate([call(images[start:start+batch_size]).numpy()
+                               for start in range(0, len(images), batch_size)])
+
+    float_outputs = keras_predict(images)
+    int8_outputs = predictor.predict(images)
+    float_classes = predicted_classes(float_outputs, from_logits)
+    int8_classes = predicted_classes(int8_outputs, from_logits)
+    report = {'float_accuracy': float(np.mean(float_classes == labels)),
+              'int8_accuracy': float(np.mean(int8_classes == labels)),
+              'agreement': float(np.mean(float_classes == int8_classes)),
+              'max_output_difference': float(np.max(np.abs(float_outputs
+                                                           - int8_outputs))),
+              'float_images_per_second': images_per_second(keras_predict,
+                                                            images, repeat),
+              'int8_images_per_second': images_per_second(predictor.predict,
+                                                           images, repeat)}
+    report['accuracy_delta'] = report['int8_accuracy'] - report['float_accuracy']
+    return report
+
+if __name__ == '__main__':
+# =============================================================================
+#     Quantizes a saved model, calibrated on generated tiles, e.g.:
+#     python quantizemodel.py 'D:/ASTR490/resnet50.h5' 'D:/ASTR490/resnet50_int8.tflite' 'D:/ASTR490/knownregion.h5' 'D:/ASTR490/noregion.h5'
+#
+#     Where
+#
+#     str(sys.argv[1]) = trained Keras model saved with model.save()
+#     str(sys.argv[2]) = .tflite file to create
+#     str(sys.argv[3]) = tiles with HII Regions (label 1), HDF5 tile
+#                        store or FITS directory
+#     str(sys.argv[4]) = tiles without HII Regions (label 0)
+# =============================================================================
+
+    model = tf.keras.models.load_model(str(sys.argv[1]))
+    images, labels = sample_tiles([(str(sys.argv[3]), 1), (str(sys.argv[4]), 0)],
+                                  n=1200, image_size=tuple(model.input_shape[1:3]))
+    tflite_model = quantize_model(model, images[:200], str(sys.argv[2]))
+    report = quantization_report(model, TFLitePredictor(tflite_model),
+                                 images[200:], labels[200:])
+    for key in report:
+        print(key, report[key])
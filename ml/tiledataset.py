@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+tf.data input pipelines over the tiles produced by displayregion.py,
+read either from its FITS files or from an HDF5 tile store.
+"""
+
+import os
+import sys
+import glob
+import numpy as np
+import h5py
+import tensorflow as tf
+from configparser import ConfigParser
+from astropy.io import fits
+from displayregion import color_image, iter_tiles
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+# The catalogs used by every section of config.ini
+DEFAULT_CATALOGS = ['WISE 3.4','WISE 12','WISE 22']
+
+def band_names(catalogs):
+    """
+    Returns the band part of the FITS filenames written by
+    displayregion.py, e.g. 'WISE 3.4' -> 'WISE3.4'.
+
+    Parameters
+    ----------
+    catalogs : list of strings
+        List of catalogs the tiles were pulled from.
+
+    Returns
+    -------
+    list of strings
+        One filename band per catalog.
+
+    """
+    return [cat.split(' ')[0]+cat.split(' ')[1] for cat in catalogs]
+
+def fits_tiles(directory, catalogs=DEFAULT_CATALOGS):
+    """
+    Returns the names of the tiles in a directory that have a FITS
+    file for every catalog.
+
+    Parameters
+    ----------
+    directory : string
+        Output directory of a section of config.ini.
+    catalogs : list of strings, optional
+        List of catalogs the tiles were pulled from. The default is
+        the WISE 3.4, 12 and 22 micron catalogs.
+
+    Returns
+    -------
+    names : list of strings
+        Sorted tile names (gname), so every process lists the same
+        tiles in the same order.
+
+    """
+    bands = band_names(catalogs)
+    suffix = '_'+bands[0]+'.fits'
+    names = sorted(os.path.basename(f)[:-len(suffix)]
+                   for f in glob.glob(os.path.join(directory, '*'+suffix)))
+    return [name for name in names
+            if all(os.path.exists(os.path.join(directory, f'{name}_{band}.fits'))
+                   for band in bands[1:])]
+
+def read_fits_tile(directory, gname, catalogs=DEFAULT_CATALOGS,
+                   vmax=(95.0, 95.0, 95.0)):
+    """
+    Reads the FITS files of one tile into a clipped and scaled image,
+    as displayregion.py does for its PNG files.
+
+    Parameters
+    ----------
+    directory : string
+        Directory containing the FITS files.
+    gname : string
+        Name of the tile.
+    catalogs : list of strings, optional
+        List of catalogs the tile was pulled from. The default is
+        the WISE 3.4, 12 and 22 micron catalogs.
+    vmax : tuple of scalars, optional
+        Maximum percentile for clipping each color. The default is
+        95 for every color, as used for the grid sections.
+
+    Returns
+    -------
+    image : ndarray of float32
+        Image of shape (H, W, bands), longest wavelength first.
+
+    """
+    hdus = [fits.PrimaryHDU(fits.getdata(os.path.join(directory, f'{gname}_{band}.fits')))
+            for band in band_names(catalogs)]
+    return color_image(hdus, vmax).astype(np.float32)
+
+def write_tile_store(section, config_location, filename, image_size=None,
+                     vmax=(95.0, 95.0, 95.0), workers=1):
+    """
+    Downloads the tiles of a section of config.ini straight into an
+    HDF5 store, one chunk per tile, without writing FITS or PNG
+    files. Every store is clipped at the same vmax whatever its
+    section, so the clipping does not tell the classes apart.
+
+    Parameters
+    ----------
+    section : string
+        Specfic section of the config file to be used.
+    config_location : string
+        Directory of the location of the config.ini file.
+    filename : string
+        HDF5 file to create. It holds the datasets 'tiles'
+        (N, H, W, bands) float32, 'gname' and 'center' (RA, Dec),
+        and the vmax in its attributes. They are created even when
+        no tile could be downloaded, so the store can still be read.
+    image_size : tuple of ints, optional
+        (H, W) to resize the tiles to before storing them. The
+        default is None, which keeps the downloaded size.
+    vmax : tuple of scalars, optional
+        Maximum percentile for clipping each color. The default is
+        95 for every color, as read_fits_tile() uses.
+    workers : int, optional
+        Number of downloads run at the same time. The default is 1.
+
+    Returns
+    -------
+    n : int
+        Number of tiles stored.
+
+    """
+    config_object = ConfigParser()
+    config_object.read(config_location)
+    bands = len(config_object[section]['catalogs'].split(','))
+    n = 0
+    with h5py.File(filename, 'w') as store:
+        store.attrs['vmax'] = vmax
+        store.create_dataset('gname', shape=(0,), maxshape=(None,),
+                             dtype=h5py.string_dtype())
+        store.create_dataset('center', shape=(0, 2), maxshape=(None, 2),
+                             dtype='float64')
+        # Without resizing, the tile shape and its chunks are only known
+        # once the first tile is downloaded
+        if image_size is not None:
+            shape = tuple(image_size) + (bands,)
+            store.create_dataset('tiles', shape=(0,)+shape,
+                                 maxshape=(None,)+shape, chunks=(1,)+shape,
+                                 dtype='float32')
+        for gname,center,wcs,cube in iter_tiles(section, config_location,
+                                                workers=workers, vmax=vmax):
+            if image_size is not None:
+                cube = tf.image.resize(cube, image_size).numpy()
+            if 'tiles' not in store:
+                store.create_dataset('tiles', shape=(0,)+cube.shape,
+                                     maxshape=(None,)+cube.shape,
+                                     chunks=(1,)+cube.shape, dtype='float32')
+            for key in ('tiles', 'gname', 'center'):
+                store[key].resize(n+1, axis=0)
+            store['tiles'][n] = cube
+            store['gname'][n] = gname
+            store['center'][n] = center
+            n += 1
+        if 'tiles' not in store:
+            store.create_dataset('tiles', shape=(0, 0, 0, bands),
+                                 dtype='float32')
+    return n
+
+def _is_store(path):
+    return os.path.splitext(path)[1] in ('.h5', '.hdf5')
+
+def tile_dataset(sources, batch_size=32, image_size=(64, 64),
+                 num_classes=None, catalogs=DEFAULT_CATALOGS,
+                 vmax=(95.0, 95.0, 95.0), shuffle=True, seed=0,
+                 num_shards=1, shard_index=0, cache=None, chunk_size=64,
+                 cycle_length=4):
+    """
+    Builds a tf.data pipeline over generated sky tiles. Chunks of
+    tiles are read and decoded in parallel with interleave(), resized,
+    optionally cached, shuffled, batched and prefetched, so training
+    is not held up by reading the data.
+
+    Parameters
+    ----------
+    sources : list of tuples
+        (path, label) pairs, where path is either an output directory
+        of displayregion.py holding FITS files or an HDF5 store made
+        by write_tile_store(), and label is the integer class of
+        every tile in it (e.g. 1 for knownregion, 0 for noregion).
+    batch_size : int, optional
+        Number of tiles per batch. The default is 32.
+    image_size : tuple of ints, optional
+        (H, W) the tiles are resized to. The default is (64, 64),
+        the input shape of ResNet50 and convolutional_model.
+    num_classes : int, optional
+        Return one-hot labels with this many classes, for
+        categorical_crossentropy. The default is None, which
+        returns integer labels.
+    catalogs : list of strings, optional
+        List of catalogs of the FITS files. The default is the WISE
+        3.4, 12 and 22 micron catalogs.
+    vmax : tuple of scalars, optional
+        Maximum percentile for clipping each color of the FITS
+        files, and that HDF5 stores must have been written with.
+        The default is 95 for every color.
+    shuffle : bool, optional
+        Shuffle the chunks and the tiles every epoch, so every batch
+        mixes tiles of all the sources. The default is True, False
+        reads the sources one after the other.
+    seed : int, optional
+        Seed of the shuffle. The default is 0.
+    num_shards : int, optional
+        Number of workers the tiles are split between. The default
+        is 1.
+    shard_index : int, optional
+        Which of the num_shards disjoint parts this worker reads. The
+        default is 0.
+    cache : string, optional
+        File the decoded and resized tiles are cached to after the
+        first epoch ('' caches in memory). The shard index is added
+        to the name when sharding. The default is None, no caching.
+    chunk_size : int, optional
+        Number of tiles read at a time by each parallel reader. The
+        default is 64.
+    cycle_length : int, optional
+        Number of chunks read in parallel. The default is 4.
+
+    Raises
+    ------
+    ValueError
+        Raised when an HDF5 store was clipped at another vmax.
+
+    Returns
+    -------
+    dataset : tf.data.Dataset
+        Batches of (images, labels), with images of shape
+        (batch, H, W, bands) float32.
+
+    """
+    # List the tiles of every source once, then split them into chunks
+    names = []
+    chunks = []
+    for it,(path,label) in enumerate(sources):
+        if _is_store(path):
+            with h5py.File(path, 'r') as store:
+                n = len(store['tiles']) if 'tiles' in store else 0
+                clipped = store.attrs.get('vmax')
+            if clipped is not None and not np.allclose(clipped, vmax):
+                raise ValueError(f'{path} was clipped at vmax {[float(v) for v in clipped]},'
+                                 f' not {list(vmax)}')
+            names.append(None)
+        else:
+            names.append(fits_tiles(path, catalogs))
+            n = len(names[-1])
+        for start in range(0, n, chunk_size):
+            chunks.append((it, start, min(start+chunk_size, n)))
+    bands = len(catalogs)
+
+    def read_chunk(chunk):
+        it, start, stop = chunk
+        path, label = sources[it]
+        if names[it] is None:
+            with h5py.File(path, 'r') as store:
+                block = store['tiles'][start:stop]
+            for tile in block:
+                yield tile, label
+        else:
+            for gname in names[it][start:stop]:
+                yield read_fits_tile(path, gname, catalogs, vmax), label
+
+    signature = (tf.TensorSpec(shape=(None, None, bands), dtype=tf.float32),
+                 tf.TensorSpec(shape=(), dtype=tf.int32))
+    dataset = tf.data.Dataset.from_tensor_slices(
+        np.array(chunks, dtype=np.int64).reshape(-1, 3))
+
+    # Shard whole chunks so every worker reads a disjoint set of files
+    if num_shards > 1:
+        dataset = dataset.shard(num_shards, shard_index)
+
+    # The chunks are listed source by source, mix them before reading
+    # so the shuffle buffer holds tiles of every source
+    if shuffle:
+        dataset = dataset.shuffle(max(len(chunks), 1), seed=seed,
+                                  reshuffle_each_iteration=True)
+    dataset = dataset.interleave(
+        lambda chunk: tf.data.Dataset.from_generator(
+            read_chunk, args=(chunk,), output_signature=signature),
+        cycle_length=cycle_length, num_parallel_calls=AUTOTUNE,
+        deterministic=True)
+
+    def decode(image, label):
+        image = tf.image.resize(image, image_size)
+        if num_classes is not None:
+            label = tf.one_hot(label, num_classes)
+        return image, label
+
+    dataset = dataset.map(decode, num_parallel_calls=AUTOTUNE,
+                          deterministic=True)
+    if cache is not None:
+        if cache and num_shards > 1:
+            cache = f'{cache}.shard{shard_index}'
+        dataset = dataset.cache(cache)
+    if shuffle:
+        dataset = dataset.shuffle(max(10*batch_size, 1000), seed=seed,
+                                  reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(AUTOTUNE)
+
+if __name__ == '__main__':
+# =============================================================================
+#     Downloads the tiles of a section into an HDF5 store, e.g.:
+#     python tiledataset.py 'D:/githubfiles/ASTR490/ml/config.ini' noregion 'D:/ASTR490/noregion.h5'
+#
+#     Where
+#
+#     str(sys.argv[1]) = 'D:/githubfiles/ASTR490/ml/config.ini'
+#     str(sys.argv[2]) = e.g. noregion, knownregion, etc.
+#     str(sys.argv[3]) = HDF5 file to create
+# =============================================================================
+
+    n = write_tile_store(str(sys.argv[2]), str(sys.argv[1]), str(sys.argv[3]),
+                         image_size=(64, 64))
+    print('Stored',n,'tiles')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Load test of tileservice.py: serves a model on a stand-in cutout
+source and reports the latency percentiles of concurrent requests.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import threading
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+from astropy.io import fits
+from tileservice import TileSource, TileClassifier, make_server
+
+def standin_fetch(delay=0.2, pixels=300):
+    """
+    Stand-in for displayregion.fetch_images() that waits delay
+    seconds, as a download would, and returns random positive HDUs of
+    pixels x pixels, the same for the same tile name.
+    """
+
+    def fetch(gname, ra, dec, size, catalogs):
+        time.sleep(delay)
+        rng = np.random.default_rng(zlib.crc32(gname.encode()))
+        return [fits.PrimaryHDU(rng.lognormal(size=(pixels, pixels)))
+                for cat in catalogs]
+
+    return fetch
+
+def percentiles(seconds):
+    """
+    p50, p90 and p99 latency and the mean in milliseconds.
+    """
+    seconds = np.asarray(seconds)*1000
+    if len(seconds) == 0:
+        return {}
+    return {'p50_ms': float(np.percentile(seconds, 50)),
+            'p90_ms': float(np.percentile(seconds, 90)),
+            'p99_ms': float(np.percentile(seconds, 99)),
+            'mean_ms': float(np.mean(seconds))}
+
+def load_test(url, positions, concurrency=16):
+    """
+    Requests the classification of every position from a running
+    tileservice.py, concurrency requests at a time.
+
+    Parameters
+    ----------
+    url : string
+        Address of the service, e.g. 'http://127.0.0.1:8490'.
+    positions : list of tuples
+        (l, b) in degrees of every request, repeated positions are
+        answered from the cache.
+    concurrency : int, optional
+        Number of requests at the same time. The default is 16.
+
+    Returns
+    -------
+    report : dict
+        Number of 'requests' and 'errors', the 'requests_per_second',
+        and the latency percentiles of 'all' requests, of the
+        'uncached' ones that downloaded their tile, of the 'shared'
+        ones that waited for the download of another request and of
+        the 'cached' ones.
+
+    """
+
+    def request(position):
+        clock = time.perf_counter()
+        try:
+            with urlopen(f'{url}/classify?l={position[0]}&b={position[1]}',
+                         timeout=60) as response:
+                result = json.loads(response.read())
+        except OSError:
+            return None
+        state = ('cached' if result['cached'] else
+                 'shared' if result['shared'] else 'uncached')
+        return time.perf_counter() - clock, state
+
+    clock = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(request, positions))
+    seconds = time.perf_counter() - clock
+    done = [result for result in results if result is not None]
+    return {'requests': len(results),
+            'errors': len(results) - len(done),
+            'requests_per_second': len(results)/seconds,
+            'all': percentiles([s for s,state in done]),
+            'uncached': percentiles([s for s,state in done
+                                     if state == 'uncached']),
+            'shared': percentiles([s for s,state in done
+                                   if state == 'shared']),
+            'cached': percentiles([s for s,state in done
+                                   if state == 'cached'])}
+
+def random_positions(n, distinct, seed=0):
+    """
+    n positions in the galactic plane drawn from distinct ones, so
+    some requests repeat a position.
+    """
+    rng = np.random.default_rng(seed)
+    pool = np.column_stack([rng.uniform(0, 360, distinct).round(2),
+                            rng.uniform(-1, 1, distinct).round(2)])
+    return [tuple(p) for p in pool[rng.integers(0, distinct, n)]]
+
+if __name__ == '__main__':
+# =============================================================================
+#     Load tests the service with a saved model, e.g.:
+#     python tileloadtest.py 'D:/ASTR490/resnet50.h5' 1000 300 16
+#
+#     Where
+#
+#     str(sys.argv[1]) = trained Keras model saved with model.save(), or
+#                        a version directory of modelregistry.py
+#     int(sys.argv[2]) = number of requests, 1000 if not given
+#     int(sys.argv[3]) = number of distinct positions, 300 if not given
+#     int(sys.argv[4]) = concurrent requests, 16 if not given
+# =============================================================================
+
+    if os.path.exists(os.path.join(str(sys.argv[1]), 'model.json')):
+        from modelregistry import ServingModel
+        model = ServingModel(str(sys.argv[1]))
+    else:
+        model = tf.keras.models.load_model(str(sys.argv[1]))
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    distinct = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+
+    source = TileSource(model.input_shape[1:3], fetch=standin_fetch())
+    classifier = TileClassifier(model, source)
+    classifier.batcher.warm_up(model.input_shape[1:])
+    server = make_server(classifier, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    report = load_test(url, random_positions(n, distinct), concurrency)
+    server.shutdown()
+    report['service'] = classifier.stats()
+    for key in report:
+        print(key, report[key])
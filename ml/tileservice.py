@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Local HTTP service answering whether there is an HII Region at a
+galactic position, with the classifier kept loaded, concurrent
+requests classified together and tiles and results cached.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from configparser import ConfigParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import tensorflow as tf
+from displayregion import getcoords, fetch_images, color_image
+from classifyregion import probabilities
+
+def tile_key(l, b, resolution=0.01):
+    """
+    Name of the tile centered on (l, b) rounded to resolution degrees,
+    in the style of the gnames of displayregion.py, so nearby requests
+    share a tile and a result.
+    """
+    digits = max(int(np.ceil(-np.log10(resolution))), 0)
+    l = round(round(float(l)/resolution)*resolution % 360, digits)
+    b = round(round(float(b)/resolution)*resolution, digits)
+    return f'S{l:.{digits}f}{b:+.{digits}f}', l, b
+
+class LRUCache:
+    """
+    Dictionary keeping at most size items, dropping the least recently
+    used one first. It is safe to use from several threads.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+class TileSource:
+    """
+    Scaled and resized tiles by galactic position, downloaded with
+    fetch_images() and kept in memory and, optionally, as .npy files
+    in a cache directory that survives restarts.
+
+    Parameters
+    ----------
+    image_size : tuple of ints
+        (H, W) of the model input.
+    imsize : scalar, optional
+        Tile size in degrees. The default is 0.5.
+    catalogs : list of strings, optional
+        Catalogs of the bands. The default is the WISE 3.4, 12 and
+        22 micron catalogs.
+    vmax : tuple of scalars, optional
+        Maximum percentile for clipping each color. The default is
+        95 for every color, as used for the grid sections.
+    cache_dir : string, optional
+        Directory of the tile cache. The default is None, tiles are
+        only kept in memory.
+    memory_bytes : int, optional
+        Memory the tiles kept in memory may take. The tiles are the
+        float32 model inputs, about 600 kB each at 224 x 224 x 3. The
+        default is 2**28, 256 MB.
+    fetch : function, optional
+        Called as fetch(gname, ra, dec, imsize, catalogs) to get the
+        HDUs of a tile. The default is displayregion.fetch_images(),
+        a stand-in source can be given for testing.
+
+    """
+
+    def __init__(self, image_size, imsize=0.5,
+                 catalogs=('WISE 3.4', 'WISE 12', 'WISE 22'),
+                 vmax=(95.0, 95.0, 95.0), cache_dir=None, memory_bytes=2**28,
+                 fetch=fetch_images):
+        self.image_size = tuple(image_size)
+        self.imsize = imsize
+        self.catalogs = list(catalogs)
+        self.vmax = vmax
+        self.cache_dir = cache_dir
+        tile_bytes = 4*int(np.prod(self.image_size))*len(self.catalogs)
+        self.memory = LRUCache(max(memory_bytes//tile_bytes, 1))
+        self.fetch = fetch
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def tile(self, gname, l, b):
+        """
+        Tile of shape (H, W, bands) centered on (l, b), and whether it
+        came from a cache. Raises a RuntimeError if the download fails.
+        """
+        image = self.memory.get(gname)
+        if image is not None:
+            return image, True
+        filename = None
+        if self.cache_dir is not None:
+            filename = os.path.join(self.cache_dir, gname+'.npy')
+            if os.path.exists(filename):
+                image = np.load(filename)
+                self.memory.put(gname, image)
+                return image, True
+        ra, dec = getcoords([l, b])
+        hdus = self.fetch(gname, ra, dec, self.imsize, self.catalogs)
+        if hdus[0] == 'fail':
+            raise RuntimeError(f'Download of {gname} failed')
+        image = np.nan_to_num(color_image(hdus, self.vmax).astype(np.float32))
+        image = tf.image.resize(image, self.image_size).numpy()
+        if filename is not None:
+            np.save(filename, image)
+        self.memory.put(gname, image)
+        return image, False
+
+class MicroBatcher:
+    """
+    Collects the tiles of concurrent requests into one call of the
+    model. A batch is run as soon as max_batch tiles are waiting, or
+    max_delay seconds after its first tile arrived. Batches are padded
+    to a power of two, so the model only ever sees a few batch sizes,
+    which warm_up() traces before the first request.
+
+    Parameters
+    ----------
+    model : tf.keras.Model or modelregistry.ServingModel
+        Classifier with a predict_on_batch() method.
+    max_batch : int, optional
+        Largest batch. The default is 32.
+    max_delay : scalar, optional
+        Longest wait in seconds for more tiles. The default is 0.005.
+
+    """
+
+    def __init__(self, model, max_batch=32, max_delay=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.tiles = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def batch_sizes(self):
+        """
+        The padded batch sizes, powers of two up to max_batch.
+        """
+        sizes = [1]
+        while sizes[-1] < self.max_batch:
+            sizes.append(min(2*sizes[-1], self.max_batch))
+        return sizes
+
+    def warm_up(self, shape):
+        """
+        Runs batches of zeros of every padded size through the model,
+        tiles of the given (H, W, bands) shape.
+        """
+        for size in self.batch_sizes():
+            self.model.predict_on_batch(np.zeros((size,)+tuple(shape),
+                                                 dtype=np.float32))
+
+    def submit(self, image):
+        """
+        Future of the model output for one tile.
+        """
+        future = Future()
+        self.queue.put((image, future))
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_delay
+            while len(pending) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            size = next(size for size in self.batch_sizes()
+                        if size >= len(pending))
+            images = np.zeros((size,)+pending[0][0].shape, dtype=np.float32)
+            for it,(image,future) in enumerate(pending):
+                images[it] = image
+            try:
+                outputs = self.model.predict_on_batch(images)
+            except Exception as error:
+                for image,future in pending:
+                    future.set_exception(error)
+                continue
+            self.batches += 1
+            self.tiles += len(pending)
+            for (image,future),output in zip(pending, outputs):
+                future.set_result(output)
+
+class TileClassifier:
+    """
+    Probability of an HII Region at a galactic position. Results are
+    cached by tile, and concurrent requests for the same tile share
+    one download and one classification.
+
+    Parameters
+    ----------
+    model : tf.keras.Model or modelregistry.ServingModel
+        Trained classifier, kept loaded.
+    source : TileSource
+        Where the tiles come from.
+    resolution : scalar, optional
+        Positions are rounded to this many degrees. The default is
+        0.01.
+    cache_size : int, optional
+        Number of results kept. The default is 100000.
+    positive_class : int, optional
+        Index of the HII Region class of a softmax output. The
+        default is 1.
+    from_logits : bool, optional
+        The model outputs logits. The default is False.
+    max_batch : int, optional
+        Largest batch of the MicroBatcher. The default is 32.
+    max_delay : scalar, optional
+        Longest wait in seconds of the MicroBatcher. The default is
+        0.005.
+
+    """
+
+    def __init__(self, model, source, resolution=0.01, cache_size=100000,
+                 positive_class=1, from_logits=False, max_batch=32,
+                 max_delay=0.005):
+        self.source = source
+        self.resolution = resolution
+        self.positive_class = positive_class
+        self.from_logits = from_logits
+        self.batcher = MicroBatcher(model, max_batch, max_delay)
+        self.results = LRUCache(cache_size)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def classify(self, l, b):
+        """
+        Classifies the tile centered on (l, b).
+
+        Returns
+        -------
+        result : dict
+            The 'gname', 'glon' and 'glat' of the tile, its
+            'probability', whether the result was 'cached' or
+            'shared' with a request for the same tile already in
+            flight, and the 'seconds' taken.
+
+        """
+        clock = time.perf_counter()
+        gname, l, b = tile_key(l, b, self.resolution)
+        probability = self.results.get(gname)
+        cached = probability is not None
+        shared = False
+        if not cached:
+            with self.lock:
+                future = self.in_flight.get(gname)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self.in_flight[gname] = future
+            shared = not owner
+            if owner:
+                try:
+                    image, _ = self.source.tile(gname, l, b)
+                    output = self.batcher.submit(image).result()
+                    probability = float(probabilities(
+                        output[np.newaxis], self.positive_class,
+                        self.from_logits)[0])
+                    self.results.put(gname, probability)
+                    future.set_result(probability)
+                except Exception as error:
+                    future.set_exception(error)
+                finally:
+                    with self.lock:
+                        del self.in_flight[gname]
+            probability = future.result()
+        return {'gname': gname, 'glon': l, 'glat': b,
+                'probability': probability, 'cached': cached, 'shared': shared,
+                'seconds': time.perf_counter() - clock}
+
+    def stats(self):
+        """
+        Number of cached results and tiles, and the mean batch size.
+        """
+        batcher = self.batcher
+        return {'results': len(self.results),
+                'tiles': len(self.source.memory),
+                'batches': batcher.batches,
+                'mean_batch': batcher.tiles/max(batcher.batches, 1)}
+
+class TileServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer with room for many pending connections. With
+    the default of 5, connections beyond it are refused and the client
+    retries a second later, which sets the tail latency under load.
+    """
+    request_queue_size = 128
+    daemon_threads = True
+
+def make_server(classifier, host='127.0.0.1', port=8490):
+    """
+    HTTP server answering GET /classify?l=<deg>&b=<deg> with the JSON
+    result of classifier.classify() and GET /stats with its stats.
+    Every request is handled in its own thread.
+
+    Parameters
+    ----------
+    classifier : TileClassifier
+        The classifier to serve.
+    host : string, optional
+        Address to listen on. The default is '127.0.0.1', only local
+        connections.
+    port : int, optional
+        Port to listen on, 0 for any free port. The default is 8490.
+
+    Returns
+    -------
+    server : TileServer
+        The server, run it with server.serve_forever().
+
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                return self._reply(200, classifier.stats())
+            if url.path != '/classify':
+                return self._reply(404, {'error': 'unknown path'})
+            query = parse_qs(url.query)
+            try:
+                l = float(query['l'][0])
+                b = float(query['b'][0])
+            except (KeyError, ValueError):
+                return self._reply(400, {'error': 'give l and b in degrees'})
+            try:
+                return self._reply(200, classifier.classify(l, b))
+            except RuntimeError as error:
+                return self._reply(502, {'error': str(error)})
+            except Exception as error:
+                return self._reply(500, {'error': str(error)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return TileServer((host, port), Handler)
+
+if __name__ == '__main__':
+# =============================================================================
+#     Serves a saved model, e.g.:
+#     python tileservice.py 'D:/githubfiles/ASTR490/ml/config.ini' coords 'D:/ASTR490/resnet50.h5' 8490 'D:/ASTR490/tilecache'
+#
+#     and then e.g. http://127.0.0.1:8490/classify?l=301.5&b=0.2
+#
+#     Where
+#
+#     str(sys.argv[1]) = 'D:/githubfiles/ASTR490/ml/config.ini'
+#     str(sys.argv[2]) = section whose imsize and catalogs are used
+#     str(sys.argv[3]) = trained Keras model saved with model.save(),
+#                        or a version directory of modelregistry.py
+#     int(sys.argv[4]) = port, 8490 if not given
+#     str(sys.argv[5]) = tile cache directory, none if not given
+# =============================================================================
+
+    config_object = ConfigParser()
+    config_object.read(str(sys.argv[1]))
+    config = config_object[str(sys.argv[2])]
+    if os.path.exists(os.path.join(str(sys.argv[3]), 'model.json')):
+        from modelregistry import ServingModel
+        model = ServingModel(str(sys.argv[3]))
+    else:
+        model = tf.keras.models.load_model(str(sys.argv[3]))
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else 8490
+    cache_dir = str(sys.argv[5]) if len(sys.argv) > 5 else None
+    source = TileSource(model.input_shape[1:3], float(config['imsize']),
+                        config['catalogs'].split(','), cache_dir=cache_dir)
+    classifier = TileClassifier(model, source)
+    classifier.batcher.warm_up(model.input_shape[1:])
+    server = make_server(classifier, port=port)
+    print('Serving on port', server.server_address[1])
+    server.serve_forever()